@@ -0,0 +1,244 @@
+"""Washes many accounts, each in its own input file, in a process pool.
+
+Each input file is washed independently, the same way as
+`python wash.py -q -w in_file -o out_file`, but the worker processes are
+started and import their libraries once for the whole batch. A file that
+fails to wash is recorded in the summary, and the rest of the batch goes on.
+
+    python batch.py -i accounts/ -d washed/ --summary summary.json
+    python batch.py -m manifest.csv -d washed/ -j 8
+"""
+import argparse
+import concurrent.futures
+import csv
+import json
+import os
+import sys
+import time
+
+import groups as groups_lib
+import lots as lots_lib
+import stats as stats_lib
+import wash
+
+
+#%% class BadManifestError
+class BadManifestError(Exception):
+    """Raised if a manifest file is not in the correct format."""
+
+
+# The headers of a manifest file.
+MANIFEST_HEADERS = ['Input', 'Output']
+
+
+def read_manifest(data, base_directory=''):
+    """Reads the jobs in a manifest.
+
+    The first line must contain the headers Input,Output. Each other line is
+    one account: the path of its input csv file, and the name of the output
+    file to write in the destination directory. If the output is blank, the
+    input file's name is used. Each output must be different.
+
+    Args:
+        data: A list of strings, where each line is a CSV row.
+        base_directory: The directory that relative input paths are in.
+    Returns:
+        A list of (input_path, output_name) tuples.
+    """
+    reader = csv.reader(data)
+    header_row = next(reader, None)
+    if header_row != MANIFEST_HEADERS:
+        raise BadManifestError('{} != {}'.format(header_row,
+                                                 MANIFEST_HEADERS))
+    jobs = []
+    output_lines = {}
+    for row in reader:
+        if not row:
+            continue
+        if len(row) != 2 or not row[0]:
+            raise BadManifestError('Line {}: expected an input and an output, '
+                                   'got {}'.format(reader.line_num, row))
+        input_path = os.path.join(base_directory, row[0])
+        output_name = row[1] or os.path.basename(input_path)
+        # Jobs run in parallel, so two jobs can't write the same output.
+        if output_name in output_lines:
+            raise BadManifestError('Line {}: output {} is also written by '
+                                   'line {}'.format(reader.line_num,
+                                                    output_name,
+                                                    output_lines[output_name]))
+        output_lines[output_name] = reader.line_num
+        jobs.append((input_path, output_name))
+    return jobs
+
+
+def find_inputs(directory):
+    """Returns a job for each csv file in a directory, in name order.
+
+    Args:
+        directory: The path of a directory of input csv files.
+    Returns:
+        A list of (input_path, output_name) tuples.
+    """
+    return [(os.path.join(directory, name), name)
+            for name in sorted(os.listdir(directory))
+            if name.endswith('.csv')]
+
+
+def wash_file(input_path, output_path, groups=None):
+    """Washes one input file and writes the washed lots to output_path.
+
+    The output is written to a temporary file that replaces output_path once
+    it is complete, so a failed wash doesn't leave a partial output.
+
+    Args:
+        input_path: The path of a csv file of lots.
+        output_path: The path to write the washed lots to.
+        groups: A groups_lib.IdentityGroups object, or None.
+    Returns:
+        A dict with the 'input' and 'output' paths, the number of 'lots'
+        written, the 'seconds' spent in each phase, and the 'error' that
+        stopped the wash as a string, or None.
+    """
+    stats = stats_lib.Stats()
+    result = {'input': input_path, 'output': output_path, 'lots': 0,
+              'error': None}
+    temp_path = output_path + '.tmp'
+    try:
+        with stats.phase('read'):
+            with open(input_path) as f:
+                lots = lots_lib.Lots.create_from_csv_data(f)
+        with stats.phase('wash'):
+            wash.wash_all_lots(lots, groups=groups)
+        with stats.phase('write'):
+            with open(temp_path, 'w') as f:
+                lots.write_csv_data(f)
+            os.replace(temp_path, output_path)
+        result['lots'] = lots.size()
+    except Exception as e:
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    result['seconds'] = stats.summary()['seconds']
+    return result
+
+
+def _wash_job(job):
+    """Runs wash_file for an (input_path, output_path, groups) tuple."""
+    return wash_file(*job)
+
+
+def run_batch(jobs, destination, groups=None, max_workers=None):
+    """Washes each job's input file into the destination directory.
+
+    Args:
+        jobs: A list of (input_path, output_name) tuples.
+        destination: The directory to write the outputs to. It is created if
+            it doesn't exist.
+        groups: A groups_lib.IdentityGroups object, or None.
+        max_workers: An integer, the number of worker processes, or None to
+            use one per CPU. With one worker, the files are washed in this
+            process.
+    Returns:
+        A list with the wash_file result for each job, in the order of jobs.
+        A job whose worker process died gets a result with the error.
+    """
+    os.makedirs(destination, exist_ok=True)
+    file_jobs = [(input_path, os.path.join(destination, output_name), groups)
+                 for input_path, output_name in jobs]
+    if max_workers == 1 or len(file_jobs) <= 1:
+        return [_wash_job(job) for job in file_jobs]
+    results = [None] * len(file_jobs)
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers) as executor:
+        futures = {executor.submit(_wash_job, job): i
+                   for i, job in enumerate(file_jobs)}
+        for future in concurrent.futures.as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                # wash_file catches errors in the wash itself, so this is a
+                # worker that died, e.g. of running out of memory. The pool
+                # is broken then, and the jobs that hadn't finished fail too,
+                # but the ones that had are still reported.
+                input_path, output_path, _ = file_jobs[i]
+                results[i] = {'input': input_path, 'output': output_path,
+                              'lots': 0,
+                              'error': '{}: {}'.format(type(e).__name__, e),
+                              'seconds': {}}
+    return results
+
+
+def summarize(results, seconds):
+    """Returns a summary of a batch that can be saved as JSON.
+
+    Args:
+        results: A list of wash_file results.
+        seconds: The wall time of the whole batch.
+    Returns:
+        A dict with the number of 'files', 'failed' files and 'lots', the
+        wall 'seconds', the total seconds of each phase across files in
+        'phase_seconds', and the 'results' themselves.
+    """
+    phase_seconds = {}
+    for result in results:
+        for phase, value in result['seconds'].items():
+            phase_seconds[phase] = phase_seconds.get(phase, 0.0) + value
+    return {
+        'files': len(results),
+        'failed': sum(1 for result in results if result['error']),
+        'lots': sum(result['lots'] for result in results),
+        'seconds': seconds,
+        'phase_seconds': phase_seconds,
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    inputs = parser.add_mutually_exclusive_group(required=True)
+    inputs.add_argument('-i', '--in_dir',
+                        help='A directory of input csv files, one per account.')
+    inputs.add_argument('-m', '--manifest', metavar='manifest_file',
+                        help='A csv file with Input,Output rows. Relative '
+                        'inputs are relative to the manifest.')
+    parser.add_argument('-d', '--out_dir', required=True,
+                        help='The directory to write the washed files to.')
+    parser.add_argument('-g', '--groups', metavar='groups_file',
+                        help='A csv file with Symbol,Group rows, used for '
+                        'every account.')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='The number of processes. Defaults to one per '
+                        'CPU.')
+    parser.add_argument('--summary', metavar='summary_file',
+                        help='Where to save the summary of the batch as JSON.')
+    parsed = parser.parse_args()
+
+    if parsed.manifest:
+        with open(parsed.manifest) as f:
+            jobs = read_manifest(f, os.path.dirname(parsed.manifest))
+    else:
+        jobs = find_inputs(parsed.in_dir)
+    groups = None
+    if parsed.groups:
+        with open(parsed.groups) as f:
+            groups = groups_lib.IdentityGroups.create_from_csv_data(f)
+
+    start = time.perf_counter()
+    results = run_batch(jobs, parsed.out_dir, groups, parsed.jobs)
+    summary = summarize(results, time.perf_counter() - start)
+    for result in results:
+        if result['error']:
+            print('{}: {}'.format(result['input'], result['error']))
+    print('{} files, {} failed, {} lots in {:.3f}s'.format(
+        summary['files'], summary['failed'], summary['lots'],
+        summary['seconds']))
+    if parsed.summary:
+        with open(parsed.summary, 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+    if summary['failed']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
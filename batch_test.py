@@ -0,0 +1,105 @@
+import io
+import os
+import tempfile
+import unittest
+
+import batch
+import lots as lots_lib
+import wash
+import wash_test
+
+
+#%% class ExitWhenUnpickled
+class ExitWhenUnpickled(object):
+    """Kills the worker process that a job using it as its groups is sent to."""
+
+    def __reduce__(self):
+        return (os._exit, (1,))
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.in_dir = os.path.join(self.directory.name, 'in')
+        self.out_dir = os.path.join(self.directory.name, 'out')
+        os.mkdir(self.in_dir)
+        lots = lots_lib.Lots([
+            wash_test.create_lot(10, 2011, 6, 1, 120, 2012, 1, 10, 110),
+            wash_test.create_lot(18, 2012, 1, 1, 100, 2012, 6, 1, 200),
+        ])
+        with open(os.path.join(self.in_dir, 'good.csv'), 'w') as f:
+            lots.write_csv_data(f)
+        wash.wash_all_lots(lots)
+        output = io.StringIO()
+        lots.write_csv_data(output)
+        self.expected_output = output.getvalue()
+        with open(os.path.join(self.in_dir, 'bad.csv'), 'w') as f:
+            f.write('Not,The,Headers\n')
+        with open(os.path.join(self.in_dir, 'notes.txt'), 'w') as f:
+            f.write('Not an account\n')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_find_inputs(self):
+        self.assertEqual([(os.path.join(self.in_dir, 'bad.csv'), 'bad.csv'),
+                          (os.path.join(self.in_dir, 'good.csv'), 'good.csv')],
+                         batch.find_inputs(self.in_dir))
+
+    def test_read_manifest(self):
+        manifest = ['Input,Output', 'a/1.csv,one.csv', '', 'b/2.csv,']
+        self.assertEqual([(os.path.join('base', 'a/1.csv'), 'one.csv'),
+                          (os.path.join('base', 'b/2.csv'), '2.csv')],
+                         batch.read_manifest(manifest, 'base'))
+        with self.assertRaises(batch.BadManifestError):
+            batch.read_manifest(['Input'], 'base')
+        with self.assertRaises(batch.BadManifestError):
+            batch.read_manifest(['Input,Output', ',out.csv'], 'base')
+        with self.assertRaisesRegex(batch.BadManifestError, 'line 2'):
+            batch.read_manifest(['Input,Output', 'a/1.csv,', 'b/1.csv,'],
+                                'base')
+
+    def test_bad_file_does_not_stop_batch(self):
+        results = batch.run_batch(batch.find_inputs(self.in_dir), self.out_dir,
+                                  max_workers=1)
+        self.assertEqual(['bad.csv', 'good.csv'], [
+            os.path.basename(result['output']) for result in results])
+        self.assertIn('BadHeadersError', results[0]['error'])
+        self.assertIsNone(results[1]['error'])
+        self.assertEqual(3, results[1]['lots'])
+        self.assertEqual(['good.csv'], os.listdir(self.out_dir))
+        with open(os.path.join(self.out_dir, 'good.csv'), newline='') as f:
+            self.assertEqual(self.expected_output, f.read())
+
+        summary = batch.summarize(results, 1.5)
+        self.assertEqual(2, summary['files'])
+        self.assertEqual(1, summary['failed'])
+        self.assertEqual(3, summary['lots'])
+        self.assertEqual({'read', 'wash', 'write'},
+                         set(summary['phase_seconds']))
+
+    def test_process_pool(self):
+        jobs = batch.find_inputs(self.in_dir)
+        self.assertEqual(
+            [result['error'] is None for result in
+             batch.run_batch(jobs, self.out_dir, max_workers=1)],
+            [result['error'] is None for result in
+             batch.run_batch(jobs, self.out_dir, max_workers=2)])
+        with open(os.path.join(self.out_dir, 'good.csv'), newline='') as f:
+            self.assertEqual(self.expected_output, f.read())
+
+    def test_dead_worker_does_not_stop_batch(self):
+        jobs = batch.find_inputs(self.in_dir)
+        results = batch.run_batch(jobs, self.out_dir,
+                                  groups=ExitWhenUnpickled(), max_workers=2)
+        self.assertEqual(['bad.csv', 'good.csv'], [
+            os.path.basename(result['output']) for result in results])
+        for result in results:
+            self.assertIn('BrokenProcessPool', result['error'])
+        summary = batch.summarize(results, 1.5)
+        self.assertEqual(2, summary['failed'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,667 @@
+"""Benchmarks for the wash sale tracker.
+
+These are not run as part of the tests. Run them from a terminal, e.g.:
+
+    python bench.py lots -n 1000000
+    python bench.py logging -n 100000
+    python bench.py parse -n 1000000
+    python bench.py gains -n 1000000
+    python bench.py gains_series -n 100000
+    python bench.py classify -n 1000000
+    python bench.py startup --runs 20
+    python bench.py suite --sizes 1000,10000,100000,1000000 --json after.json \
+        --compare before.json
+"""
+import argparse
+import copy
+import csv
+import datetime
+import gc
+import io
+import json
+import math
+import platform
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from dateutil.relativedelta import relativedelta
+
+import logger as logger_lib
+import lots as lots_lib
+import wash
+
+
+def measure(func, *args):
+    """Measures the wall time and peak memory of a call.
+
+    The function is called twice: once to time it, and once with tracemalloc
+    running to find its peak memory, since tracing slows it down.
+
+    Args:
+        func: A callable.
+        *args: The arguments to call func with.
+    Returns:
+        A (seconds, peak_bytes) tuple.
+    """
+    gc.collect()
+    start = time.perf_counter()
+    result = func(*args)
+    seconds = time.perf_counter() - start
+    del result
+    gc.collect()
+    tracemalloc.start()
+    result = func(*args)
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del result
+    return seconds, peak_bytes
+
+
+def measure_stage(make_input, func):
+    """Measures the wall time and peak memory of one stage of a pipeline.
+
+    Like measure, but func is given a fresh input from make_input for each of
+    the two calls, so stages that modify their input can be measured. Only
+    memory allocated by func counts towards the peak.
+
+    Args:
+        make_input: A callable that returns the input for func.
+        func: A callable that takes one argument.
+    Returns:
+        A (seconds, peak_bytes) tuple.
+    """
+    value = make_input()
+    gc.collect()
+    start = time.perf_counter()
+    result = func(value)
+    seconds = time.perf_counter() - start
+    del result, value
+    value = make_input()
+    gc.collect()
+    tracemalloc.start()
+    result = func(value)
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del result, value
+    return seconds, peak_bytes
+
+
+def generate_history(num_lots, seed=0, num_symbols=50, years=10):
+    """Generates a realistic, reproducible trade history.
+
+    The history mixes the trades that make washing expensive:
+    - rebalancing buys of round lots, most of them sold later at a gain or a
+      loss;
+    - dividend reinvestment (DRIP) micro-lots of one to three shares;
+    - loss harvesting, where a lot is sold at a loss and the same symbol is
+      bought back within 30 days.
+    Prices follow a random walk per symbol. The same arguments always give the
+    same lots.
+
+    Args:
+        num_lots: An integer, the number of lots to generate.
+        seed: The seed for the random number generator.
+        num_symbols: An integer, the number of symbols to trade.
+        years: An integer, the number of years that the trades span.
+    Returns:
+        A list of Lot objects, in buy date order, with blank buy lots.
+    """
+    rng = random.Random(seed)
+    start = datetime.date(2010, 1, 1)
+    num_days = 365 * years
+    symbols = ['S{:03d}'.format(i) for i in range(num_symbols)]
+    prices = dict((symbol, rng.uniform(1000, 50000)) for symbol in symbols)
+
+    def lot(num_shares, symbol, buy_date, price, sell_date=None,
+            sell_price=0):
+        basis = int(round(num_shares * price))
+        proceeds = int(round(num_shares * sell_price)) if sell_date else 0
+        return lots_lib.Lot(num_shares, symbol, '', buy_date, buy_date, basis,
+                            basis, sell_date, proceeds, '', 0, '', '', [],
+                            False, False)
+
+    lot_list = []
+    while len(lot_list) < num_lots:
+        day = len(lot_list) * num_days // num_lots
+        date = start + datetime.timedelta(days=day)
+        symbol = rng.choice(symbols)
+        prices[symbol] *= math.exp(rng.gauss(0, 0.02))
+        price = prices[symbol]
+        kind = rng.random()
+        if kind < 0.6:
+            # Rebalancing.
+            sell_date = None
+            sell_price = 0
+            if rng.random() < 0.7:
+                sell_date = date + datetime.timedelta(days=rng.randint(1, 800))
+                sell_price = price * math.exp(rng.gauss(0.02, 0.15))
+            lot_list.append(lot(rng.choice([10, 20, 50, 100, 200]), symbol,
+                                date, price, sell_date, sell_price))
+        elif kind < 0.85:
+            # DRIP.
+            sell_date = None
+            sell_price = 0
+            if rng.random() < 0.3:
+                sell_date = date + datetime.timedelta(days=rng.randint(1, 800))
+                sell_price = price * math.exp(rng.gauss(0, 0.15))
+            lot_list.append(lot(rng.randint(1, 3), symbol, date, price,
+                                sell_date, sell_price))
+        else:
+            # Loss harvesting: a loss sold today, bought back within 30 days.
+            num_shares = rng.choice([10, 20, 50, 100])
+            lot_list.append(lot(num_shares, symbol,
+                                date - datetime.timedelta(
+                                    days=rng.randint(31, 400)),
+                                price * rng.uniform(1.05, 1.5), date, price))
+            rebuy_date = date + datetime.timedelta(days=rng.randint(0, 30))
+            lot_list.append(lot(rng.choice([num_shares // 2, num_shares,
+                                            num_shares * 2]),
+                                symbol, rebuy_date, price))
+    del lot_list[num_lots:]
+    lot_list.sort(key=lambda lot: lot.buy_date)
+    return lot_list
+
+
+def make_lots(num_lots):
+    """Creates a list of simple lots, a mix of open and closed positions.
+
+    Args:
+        num_lots: An integer, the number of lots to create.
+    Returns:
+        A list of Lot objects.
+    """
+    start = datetime.date(2014, 1, 1)
+    lot_list = []
+    for i in range(num_lots):
+        buy_date = start + datetime.timedelta(days=i % 365)
+        sell_date = None
+        proceeds = 0
+        if i % 3:
+            sell_date = buy_date + datetime.timedelta(days=i % 90)
+            proceeds = 900 + i % 200
+        lot_list.append(lots_lib.Lot(
+            10, 'ABC', '', buy_date, buy_date, 1000, 1000, sell_date, proceeds,
+            '', 0, str(i), '', [], False, False))
+    return lot_list
+
+
+def bench_lots(num_lots):
+    """Benchmarks the memory used by lots and the cost of copying them.
+
+    Copying with copy.deepcopy is what wash._split_lot used to do. Lot.clone
+    is what it does now.
+
+    Args:
+        num_lots: An integer, the number of lots.
+    Returns:
+        A dict mapping stage names to dicts of measurements.
+    """
+    results = {}
+    seconds, peak_bytes = measure(make_lots, num_lots)
+    results['create'] = {
+        'seconds': seconds,
+        'lots_per_second': num_lots / seconds,
+        'bytes_per_lot': peak_bytes / num_lots,
+    }
+    lot_list = make_lots(num_lots)
+    for name, copy_func in [('deepcopy', copy.deepcopy),
+                            ('clone', lots_lib.Lot.clone)]:
+        seconds, peak_bytes = measure(
+            lambda: [copy_func(lot) for lot in lot_list])
+        results[name] = {
+            'seconds': seconds,
+            'lots_per_second': num_lots / seconds,
+            'bytes_per_lot': peak_bytes / num_lots,
+        }
+    return results
+
+
+class _EnabledNullLogger(logger_lib.NullLogger):
+    """A logger that is enabled but prints nothing.
+
+    The wash engine builds every print_lots call for it, which is what a quiet
+    run cost before loggers could be disabled.
+    """
+    enabled = True
+
+
+def bench_logging(num_lots):
+    """Benchmarks the cost of logging calls in a quiet wash.
+
+    Args:
+        num_lots: An integer, the number of lots.
+    Returns:
+        A dict mapping stage names to dicts of measurements.
+    """
+    results = {}
+    for name, logger in [('disabled', logger_lib.NullLogger()),
+                         ('enabled', _EnabledNullLogger())]:
+        lots = lots_lib.Lots(make_lots(num_lots))
+        gc.collect()
+        start = time.perf_counter()
+        wash.wash_all_lots(lots, logger)
+        seconds = time.perf_counter() - start
+        results[name] = {
+            'seconds': seconds,
+            'lots_per_second': num_lots / seconds,
+        }
+    results['overhead'] = {
+        'fraction': (results['enabled']['seconds'] /
+                     results['disabled']['seconds'] - 1),
+    }
+    return results
+
+
+def bench_suite(num_lots, seed=0):
+    """Benchmarks each stage of washing a generated trade history.
+
+    Args:
+        num_lots: An integer, the number of lots to generate.
+        seed: The seed for generate_history.
+    Returns:
+        A dict mapping stage names to dicts of measurements.
+    """
+    output = io.StringIO()
+    lots_lib.Lots(generate_history(num_lots, seed)).write_csv_data(output)
+    csv_data = output.getvalue()
+    del output
+
+    def parse():
+        return lots_lib.Lots.create_from_csv_data(io.StringIO(csv_data))
+
+    def write(lots):
+        lots.write_csv_data(io.StringIO())
+
+    washed = parse()
+    wash.wash_all_lots(washed)
+    last_date = max(lot.sell_date or lot.buy_date for lot in washed)
+    stages = [
+        ('parse', lambda: None, lambda unused: parse()),
+        ('wash', parse, wash.wash_all_lots),
+        ('write', lambda: washed, write),
+        ('calc_gains', lambda: washed,
+         lambda lots: lots.calc_gains(date=last_date, price=10000)),
+    ]
+    results = {}
+    for name, make_input, func in stages:
+        seconds, peak_bytes = measure_stage(make_input, func)
+        results[name] = {
+            'seconds': seconds,
+            'lots_per_second': num_lots / seconds,
+            'peak_bytes': peak_bytes,
+            'bytes_per_lot': peak_bytes / num_lots,
+        }
+    return results
+
+
+def compare_results(old, new):
+    """Prints how the measurements in new changed from those in old.
+
+    Args:
+        old: A dict of the form written by main with --json.
+        new: A dict of the same form.
+    """
+    for size, stages in new['results'].items():
+        for stage, measurements in stages.items():
+            old_measurements = old['results'].get(size, {}).get(stage)
+            if not old_measurements:
+                continue
+            print('{:>8} {:<10} {}'.format(size, stage, ' '.join(
+                '{}={:.3g}x'.format(name, value / old_measurements[name])
+                for name, value in measurements.items()
+                if name in ('seconds', 'peak_bytes') and
+                old_measurements.get(name))))
+
+
+def legacy_create_from_csv_data(data):
+    """Parses csv data the way that Lots.create_from_csv_data used to.
+
+    Each row was read into a dict by csv.DictReader, and every date was parsed
+    with strptime. This is kept to compare the current parser against.
+
+    Args:
+        data: An iterable of strings, where each is a CSV row.
+    Returns:
+        A Lots object.
+    """
+
+    def convert_to_int(value):
+        if value:
+            return int(value)
+        return 0
+
+    def convert_to_date(value):
+        if value:
+            return datetime.datetime.strptime(value, '%m/%d/%Y').date()
+        return None
+
+    def convert_to_bool(value):
+        if value:
+            return value.lower() == 'true'
+        return False
+
+    def convert_to_string_list(value):
+        if value:
+            return value.split('|')
+        return []
+
+    reader = csv.DictReader(data, fieldnames=lots_lib.Lot.FIELD_NAMES)
+    header_row = next(reader)
+    if header_row != lots_lib.Lots.HEADERS:
+        raise lots_lib.BadHeadersError(str(header_row) +
+                                       str(lots_lib.Lots.HEADERS))
+    lot_list = []
+    for row in reader:
+        row['num_shares'] = convert_to_int(row['num_shares'])
+        row['buy_date'] = convert_to_date(row['buy_date'])
+        row['adjusted_buy_date'] = convert_to_date(row['adjusted_buy_date'])
+        if not row['adjusted_buy_date']:
+            row['adjusted_buy_date'] = copy.deepcopy(row['buy_date'])
+        row['basis'] = convert_to_int(row['basis'])
+        row['adjusted_basis'] = convert_to_int(row['adjusted_basis'])
+        if not row['adjusted_basis']:
+            row['adjusted_basis'] = row['basis']
+        row['sell_date'] = convert_to_date(row['sell_date'])
+        row['proceeds'] = convert_to_int(row['proceeds'])
+        row['adjustment'] = convert_to_int(row['adjustment'])
+        row['replacement_for'] = convert_to_string_list(row['replacement_for'])
+        row['is_replacement'] = convert_to_bool(row['is_replacement'])
+        row['loss_processed'] = convert_to_bool(row['loss_processed'])
+        lot_list.append(lots_lib.Lot(**row))
+    return lots_lib.Lots(lot_list)
+
+
+def bench_parse(num_lots, seed=0):
+    """Benchmarks parsing csv data against the legacy parser.
+
+    The data is a washed generated history, so that every column is used.
+    Both parsers must give the same lots, or this raises an AssertionError.
+
+    Args:
+        num_lots: An integer, the number of lots.
+        seed: The seed for generate_history.
+    Returns:
+        A dict mapping stage names to dicts of measurements.
+    """
+    lots = lots_lib.Lots(generate_history(num_lots, seed))
+    wash.wash_all_lots(lots)
+    output = io.StringIO()
+    lots.write_csv_data(output)
+    csv_data = output.getvalue()
+    del lots, output
+
+    results = {}
+    outputs = []
+    for name, parse in [('legacy', legacy_create_from_csv_data),
+                        ('current', lots_lib.Lots.create_from_csv_data)]:
+        seconds, peak_bytes = measure(
+            lambda: parse(io.StringIO(csv_data)))
+        results[name] = {
+            'seconds': seconds,
+            'lots_per_second': num_lots / seconds,
+            'bytes_per_lot': peak_bytes / num_lots,
+        }
+        output = io.StringIO()
+        parse(io.StringIO(csv_data)).write_csv_data(output)
+        outputs.append(output.getvalue())
+    assert outputs[0] == outputs[1] == csv_data, 'Parsers do not match'
+    return results
+
+
+def legacy_calc_gains(lots, date=None, price=None):
+    """Calculates gains the way that Lots.calc_gains used to.
+
+    Lot.calc_gains was called for each lot, and the results were merged into
+    the portfolio totals one lot at a time. This is kept to compare the
+    vectorized calculation against.
+
+    Args:
+        lots: A Lots object.
+        date: A datetime.date, or None.
+        price: The price to calculate unrealized gains at, or None.
+    Returns:
+        A dictionary with keys: r_st, r_lt, u_st, u_lt (GAINS_CODES).
+    """
+    port_gains = dict.fromkeys(lots_lib.Lot.GAINS_CODES, math.nan)
+    for lot in lots:
+        lot_gains = lot.calc_gains(date=date, price=price)
+        port_gains = lots_lib.Lots.add_lot_gains_to_port(lot_gains, port_gains)
+    return port_gains
+
+
+def bench_gains(num_lots, seed=0):
+    """Benchmarks calculating gains against the legacy calculation.
+
+    Both calculations must give the same gains, or this raises an
+    AssertionError.
+
+    Args:
+        num_lots: An integer, the number of lots.
+        seed: The seed for generate_history.
+    Returns:
+        A dict mapping stage names to dicts of measurements.
+    """
+    lots = lots_lib.Lots(generate_history(num_lots, seed))
+    date = max(lot.sell_date or lot.buy_date for lot in lots)
+    results = {}
+    outputs = []
+    for name, calc_gains in [('legacy', legacy_calc_gains),
+                             ('current', lots_lib.Lots.calc_gains)]:
+        seconds, peak_bytes = measure(calc_gains, lots, date, 10000)
+        results[name] = {
+            'seconds': seconds,
+            'lots_per_second': num_lots / seconds,
+            'bytes_per_lot': peak_bytes / num_lots,
+        }
+        outputs.append(calc_gains(lots, date, 10000))
+    for code in lots_lib.Lot.GAINS_CODES:
+        legacy, current = outputs[0][code], outputs[1][code]
+        assert (legacy == current or
+                (math.isnan(legacy) and math.isnan(current))), (
+                    'Gains do not match for {}: {} != {}'.format(
+                        code, legacy, current))
+    return results
+
+
+def bench_gains_series(num_lots, seed=0, num_dates=252):
+    """Benchmarks a daily gains curve against one calc_gains call per day.
+
+    Both must give the same gains, or this raises an AssertionError.
+
+    Args:
+        num_lots: An integer, the number of lots.
+        seed: The seed for generate_history and the prices.
+        num_dates: An integer, the number of trading days in the curve.
+    Returns:
+        A dict mapping stage names to dicts of measurements.
+    """
+    lots = lots_lib.Lots(generate_history(num_lots, seed))
+    last_date = max(lot.sell_date or lot.buy_date for lot in lots)
+    dates = [last_date - datetime.timedelta(days=i)
+             for i in reversed(range(num_dates))]
+    rng = random.Random(seed)
+    prices = [rng.randrange(5000, 15000) for _ in dates]
+
+    def loop():
+        return [[lots.calc_gains(date, price)[code]
+                 for code in lots_lib.Lot.GAINS_CODES]
+                for date, price in zip(dates, prices)]
+
+    results = {}
+    outputs = []
+    for name, func in [('loop', loop),
+                       ('series', lambda: lots.calc_gains_series(dates,
+                                                                 prices))]:
+        seconds, peak_bytes = measure(func)
+        results[name] = {
+            'seconds': seconds,
+            'dates_per_second': num_dates / seconds,
+            'bytes_per_lot': peak_bytes / num_lots,
+        }
+        outputs.append(func())
+    for row, (expected, actual) in enumerate(zip(*outputs)):
+        for code, legacy, current in zip(lots_lib.Lot.GAINS_CODES, expected,
+                                         actual):
+            assert (legacy == current or
+                    (math.isnan(legacy) and math.isnan(current))), (
+                        'Gains do not match for {} on {}: {} != {}'.format(
+                            code, dates[row], legacy, current))
+    return results
+
+
+def legacy_is_long_term(lot, date=None):
+    """Classifies a lot the way that Lot.is_long_term used to.
+
+    The threshold was computed with relativedelta on every call.
+    """
+    if lot.adjusted_buy_date is None:
+        start = lot.buy_date
+    else:
+        start = lot.adjusted_buy_date
+    end = date if lot.sell_date is None else lot.sell_date
+    if start is None or end is None:
+        return False
+    return end > start + relativedelta(years=1)
+
+
+def bench_classify(num_lots, seed=0):
+    """Benchmarks classifying lots as short or long term.
+
+    The per-lot legacy classification, Lot.is_long_term with its cached
+    threshold, and Lots.is_long_term must all agree, or this raises an
+    AssertionError.
+
+    Args:
+        num_lots: An integer, the number of lots.
+        seed: The seed for generate_history.
+    Returns:
+        A dict mapping stage names to dicts of measurements.
+    """
+    lots = lots_lib.Lots(generate_history(num_lots, seed))
+    date = max(lot.sell_date or lot.buy_date for lot in lots)
+    results = {}
+    outputs = []
+    for name, func in [
+            ('legacy', lambda: [legacy_is_long_term(lot, date)
+                                for lot in lots]),
+            ('lot', lambda: [lot.is_long_term(date) for lot in lots]),
+            # The thresholds were cached by the first runs of 'lot'.
+            ('lot_cached', lambda: [lot.is_long_term(date) for lot in lots]),
+            ('lots', lambda: lots.is_long_term(date).tolist())]:
+        seconds, peak_bytes = measure(func)
+        results[name] = {
+            'seconds': seconds,
+            'lots_per_second': num_lots / seconds,
+            'bytes_per_lot': peak_bytes / num_lots,
+        }
+        outputs.append(func())
+    assert all(output == outputs[0] for output in outputs), (
+        'Classifications differ')
+    return results
+
+
+# The most time that the fastest start of `python wash.py -q` may take. It
+# takes about a tenth of this when the libraries that it doesn't need, such
+# as numpy, aren't imported.
+STARTUP_BUDGET_SECONDS = 1.0
+
+
+def bench_startup(num_runs):
+    """Benchmarks starting `python wash.py -q`, as a scheduler does per account.
+
+    Each run is a new Python process. A bare interpreter is timed too, since
+    no run can start faster than that. If even the fastest start of wash.py
+    takes longer than STARTUP_BUDGET_SECONDS, this raises an AssertionError.
+
+    Args:
+        num_runs: An integer, the number of times to start each process.
+    Returns:
+        A dict mapping stage names to dicts of measurements.
+    """
+    wash_script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'wash.py')
+    results = {}
+    for name, args in [('python', ['-c', 'pass']),
+                       ('wash', [wash_script, '-q'])]:
+        times = []
+        for _ in range(num_runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable] + args, check=True)
+            times.append(time.perf_counter() - start)
+        results[name] = {
+            'min_seconds': min(times),
+            'median_seconds': statistics.median(times),
+        }
+    assert results['wash']['min_seconds'] < STARTUP_BUDGET_SECONDS, (
+        'wash.py took {:.3f}s to start'.format(results['wash']['min_seconds']))
+    return results
+
+
+def print_results(results):
+    """Prints a dict of results from one of the bench_* functions."""
+    for stage, measurements in results.items():
+        print('{:<10} {}'.format(stage, ' '.join(
+            '{}={:.6g}'.format(name, value)
+            for name, value in measurements.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('benchmark',
+                        choices=['lots', 'logging', 'parse', 'gains',
+                                 'gains_series', 'classify', 'startup',
+                                 'suite'])
+    parser.add_argument('-n', '--num_lots', type=int, default=100000)
+    parser.add_argument('--runs', type=int, default=10,
+                        help='The number of processes to start for startup.')
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='Comma-separated numbers of lots for the suite.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='File to save the suite results to.')
+    parser.add_argument('--compare',
+                        help='Suite results from an earlier run to compare '
+                        'against.')
+    parsed = parser.parse_args()
+
+    if parsed.benchmark == 'lots':
+        print_results(bench_lots(parsed.num_lots))
+    elif parsed.benchmark == 'logging':
+        print_results(bench_logging(parsed.num_lots))
+    elif parsed.benchmark == 'parse':
+        print_results(bench_parse(parsed.num_lots, parsed.seed))
+    elif parsed.benchmark == 'gains':
+        print_results(bench_gains(parsed.num_lots, parsed.seed))
+    elif parsed.benchmark == 'gains_series':
+        print_results(bench_gains_series(parsed.num_lots, parsed.seed))
+    elif parsed.benchmark == 'classify':
+        print_results(bench_classify(parsed.num_lots, parsed.seed))
+    elif parsed.benchmark == 'startup':
+        print_results(bench_startup(parsed.runs))
+    elif parsed.benchmark == 'suite':
+        output = {
+            'python': sys.version,
+            'platform': platform.platform(),
+            'date': datetime.datetime.now().isoformat(),
+            'seed': parsed.seed,
+            'results': {},
+        }
+        for size in parsed.sizes.split(','):
+            print('{} lots'.format(size))
+            results = bench_suite(int(size), parsed.seed)
+            print_results(results)
+            output['results'][size] = results
+        if parsed.json:
+            with open(parsed.json, 'w') as f:
+                json.dump(output, f, indent=2, sort_keys=True)
+        if parsed.compare:
+            with open(parsed.compare) as f:
+                compare_results(json.load(f), output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import csv
+
+
+#%% class BadGroupsError
+class BadGroupsError(Exception):
+    """Raised if a groups file is not in the correct format."""
+
+
+#%% class IdentityGroups
+class IdentityGroups(object):
+    """Maps symbols to groups of substantially identical securities.
+
+    Share classes of the same company, two ETFs that track the same index, or
+    options on the same underlying can all be put in one group, so that lots of
+    any symbol in the group can wash against each other. A symbol that is not
+    in any group is only substantially identical to itself.
+
+    The groups are indexed when they are loaded, so group_id is a single dict
+    lookup per lot.
+    """
+
+    HEADERS = ['Symbol', 'Group']
+
+    def __init__(self, symbol_groups):
+        """Indexes a mapping of symbols to group names.
+
+        Args:
+            symbol_groups: A dict mapping symbol strings to group name strings.
+        """
+        group_ids = {}
+        self._group_ids = {}
+        for symbol, group in symbol_groups.items():
+            self._group_ids[symbol] = group_ids.setdefault(group,
+                                                           len(group_ids))
+
+    def group_id(self, symbol):
+        """Returns a hashable id for the group that symbol is in.
+
+        Configured groups have integer ids, and any other symbol is its own id,
+        so two symbols have the same id only if they are substantially
+        identical.
+        """
+        return self._group_ids.get(symbol, symbol)
+
+    def lot_group_id(self, lot):
+        """Returns the group id of a Lot's symbol."""
+        return self._group_ids.get(lot.symbol, lot.symbol)
+
+    @staticmethod
+    def create_from_csv_data(data):
+        """Creates an IdentityGroups object from csv data.
+
+        The first line must contain the headers Symbol,Group. Each other line
+        assigns one symbol to a group, e.g. "VOO,S&P 500". A symbol may only be
+        in one group.
+
+        Args:
+            data: A list of strings, where each line is a CSV row.
+        Returns:
+            An IdentityGroups object.
+        """
+        reader = csv.reader(data)
+        header_row = next(reader, None)
+        if header_row != IdentityGroups.HEADERS:
+            raise BadGroupsError('{} != {}'.format(header_row,
+                                                   IdentityGroups.HEADERS))
+        symbol_groups = {}
+        for row in reader:
+            if not row:
+                continue
+            if len(row) != 2 or not row[0] or not row[1]:
+                raise BadGroupsError('Line {}: expected a symbol and a group, '
+                                     'got {}'.format(reader.line_num, row))
+            symbol, group = row
+            if symbol_groups.get(symbol, group) != group:
+                raise BadGroupsError(
+                    'Line {}: {} is in both {} and {}'.format(
+                        reader.line_num, symbol, symbol_groups[symbol], group))
+            symbol_groups[symbol] = group
+        return IdentityGroups(symbol_groups)
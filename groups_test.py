@@ -0,0 +1,44 @@
+import unittest
+
+import groups as groups_lib
+
+
+class TestIdentityGroups(unittest.TestCase):
+
+    def test_parse_valid_csv_file(self):
+        csv_data = [
+            'Symbol,Group',
+            'GOOG,Alphabet',
+            'GOOGL,Alphabet',
+            'VOO,S&P 500',
+            '',
+            'IVV,S&P 500',
+        ]
+        groups = groups_lib.IdentityGroups.create_from_csv_data(csv_data)
+        self.assertEqual(groups.group_id('GOOG'), groups.group_id('GOOGL'))
+        self.assertEqual(groups.group_id('VOO'), groups.group_id('IVV'))
+        self.assertNotEqual(groups.group_id('GOOG'), groups.group_id('VOO'))
+
+    def test_symbol_in_no_group(self):
+        groups = groups_lib.IdentityGroups({'GOOG': 'Alphabet'})
+        self.assertEqual('XYZ', groups.group_id('XYZ'))
+        self.assertNotEqual(groups.group_id('Alphabet'),
+                            groups.group_id('GOOG'))
+
+    def test_parse_invalid_headers(self):
+        with self.assertRaises(groups_lib.BadGroupsError):
+            groups_lib.IdentityGroups.create_from_csv_data(['Symbol,Name'])
+
+    def test_parse_symbol_in_two_groups(self):
+        csv_data = ['Symbol,Group', 'GOOG,Alphabet', 'GOOG,Google']
+        with self.assertRaises(groups_lib.BadGroupsError):
+            groups_lib.IdentityGroups.create_from_csv_data(csv_data)
+
+    def test_parse_missing_group(self):
+        csv_data = ['Symbol,Group', 'GOOG']
+        with self.assertRaises(groups_lib.BadGroupsError):
+            groups_lib.IdentityGroups.create_from_csv_data(csv_data)
+
+
+if __name__ == '__main__':
+    unittest.main()
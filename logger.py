@@ -2,6 +2,10 @@ import abc
 
 
 class Logger(object, metaclass=abc.ABCMeta):
+    # False if print_lots does nothing. Callers check this before building the
+    # arguments to print_lots, so that logging costs nothing when it is off.
+    enabled = True
+
     @abc.abstractmethod
     def print_lots(self,
                    message,
@@ -24,6 +28,15 @@ class Logger(object, metaclass=abc.ABCMeta):
 
 
 class TermLogger(Logger):
+    def __init__(self, window=None):
+        """Creates a logger that prints to the terminal and waits for enter.
+
+        Args:
+            window: The number of lots to print on either side of each
+                highlighted lot, or None to print all of the lots.
+        """
+        self.window = window
+
     def print_lots(self,
                    message,
                    lots,
@@ -33,11 +46,13 @@ class TermLogger(Logger):
                    split_off_replacement_lots=None):
         print('')
         lots.do_print(loss_lots, split_off_loss_lots, replacement_lots,
-                      split_off_replacement_lots)
+                      split_off_replacement_lots, window=self.window)
         input(message + '. Hit enter to continue>')
 
 
 class NullLogger(Logger):
+    enabled = False
+
     def print_lots(self,
                    message,
                    lots,
@@ -0,0 +1,439 @@
+import datetime
+import json
+import os
+import numpy as np
+import lots as lots_lib
+
+
+#%% class LotTable
+class LotTable(object):
+    """Holds a set of lots as NumPy columns (a structure of arrays).
+
+    Each lot is a row. The share and cent fields are int64 columns, the dates
+    are datetime64[D] columns with NaT standing in for None, and the flags are
+    bool columns. Buy lots and form positions are stored as integer codes, so
+    that the wash checks can be computed as one vectorized mask per loss
+    instead of one Python comparison per Lot.
+
+    Rows are only ever appended (when a lot is split), so a row number
+    identifies the same lot for the lifetime of the table.
+    """
+
+    INT_FIELDS = ['num_shares', 'basis', 'adjusted_basis', 'proceeds',
+                  'adjustment']
+    DATE_FIELDS = ['buy_date', 'adjusted_buy_date', 'sell_date']
+    BOOL_FIELDS = ['is_replacement', 'loss_processed']
+    OBJECT_FIELDS = ['symbol', 'description', 'adjustment_code']
+
+    # The buy date window on either side of a loss sale that replacement lots
+    # must be bought in.
+    WASH_WINDOW = np.timedelta64(30, 'D')
+
+    # The version of the snapshot format written by save.
+    SNAPSHOT_VERSION = 1
+
+    def __init__(self, size, capacity=None):
+        """Creates a table with size empty rows.
+
+        Use LotTable.from_lots to create a table that is populated.
+
+        Args:
+            size: An integer, the number of rows.
+            capacity: An integer, the number of rows to allocate room for.
+        """
+        if capacity is None:
+            capacity = size
+        capacity = max(capacity, 1)
+        self._size = size
+        self._columns = {}
+        for field in LotTable.INT_FIELDS:
+            self._columns[field] = np.zeros(capacity, dtype=np.int64)
+        for field in LotTable.DATE_FIELDS:
+            self._columns[field] = np.full(capacity, np.datetime64('NaT'),
+                                           dtype='datetime64[D]')
+        for field in LotTable.BOOL_FIELDS:
+            self._columns[field] = np.zeros(capacity, dtype=bool)
+        for field in LotTable.OBJECT_FIELDS:
+            self._columns[field] = np.full(capacity, '', dtype=object)
+        # Codes into self.buy_lots and self.form_positions. Form positions are
+        # sorted, so comparing codes orders rows the same way as comparing the
+        # strings.
+        self._columns['buy_lot'] = np.zeros(capacity, dtype=np.int64)
+        self._columns['form_position'] = np.zeros(capacity, dtype=np.int64)
+        self._columns['lot_number'] = np.zeros(capacity, dtype=np.int64)
+        self.buy_lots = []
+        self.form_positions = []
+        # A list with one list of buy lot codes per row.
+        self.replacement_for = [[] for _ in range(size)]
+        self._buy_lot_codes = {}
+        self._next_lot_number = 0
+
+    def size(self):
+        """Returns the number of rows."""
+        return self._size
+
+    def column(self, field):
+        """Returns a view of the column for field, trimmed to size().
+
+        Args:
+            field: A field in Lot.FIELD_NAMES other than replacement_for, or
+                'lot_number'. buy_lot and form_position are codes.
+        """
+        return self._columns[field][:self._size]
+
+    def _buy_lot_code(self, buy_lot):
+        code = self._buy_lot_codes.get(buy_lot)
+        if code is None:
+            code = len(self.buy_lots)
+            self._buy_lot_codes[buy_lot] = code
+            self.buy_lots.append(buy_lot)
+        return code
+
+    @staticmethod
+    def from_lots(lots):
+        """Creates a LotTable with one row per lot, in the order of lots.
+
+        Args:
+            lots: A Lots object.
+        Returns:
+            A LotTable.
+        """
+        lot_list = lots.lots()
+        table = LotTable(len(lot_list))
+        for field in (LotTable.INT_FIELDS + LotTable.DATE_FIELDS +
+                      LotTable.BOOL_FIELDS):
+            table.column(field)[:] = [getattr(lot, field) for lot in lot_list]
+        for field in LotTable.OBJECT_FIELDS:
+            column = table.column(field)
+            for i, lot in enumerate(lot_list):
+                column[i] = getattr(lot, field)
+        # The codes are assigned in sorted order, so that they sort like the
+        # form positions. Short CSV rows have None, which sorts first.
+        table.form_positions = sorted(
+            set(lot.form_position for lot in lot_list),
+            key=lambda form_position: (form_position is not None,
+                                       form_position))
+        codes = {form_position: code
+                 for code, form_position in enumerate(table.form_positions)}
+        table.column('form_position')[:] = [codes[lot.form_position]
+                                            for lot in lot_list]
+        table.column('buy_lot')[:] = [table._buy_lot_code(lot.buy_lot)
+                                      for lot in lot_list]
+        table.replacement_for = [
+            [table._buy_lot_code(buy_lot) for buy_lot in lot.replacement_for]
+            for lot in lot_list]
+        # Keep the relative order of the lot numbers, so ties are broken the
+        # same way as for the Lot objects.
+        table.column('lot_number')[:] = [lot._lot_number for lot in lot_list]
+        if lot_list:
+            table._next_lot_number = int(table.column('lot_number').max()) + 1
+        return table
+
+    def to_lots(self):
+        """Creates a Lots object with one new Lot per row, in row order.
+
+        The Lot objects are created in lot number order, so that they sort
+        the same way as the rows.
+
+        Returns:
+            A Lots object.
+        """
+        columns = {}
+        for field in (LotTable.INT_FIELDS + LotTable.BOOL_FIELDS +
+                      LotTable.OBJECT_FIELDS):
+            columns[field] = self.column(field).tolist()
+        for field in LotTable.DATE_FIELDS:
+            # Converting to object makes datetime.dates, and None for NaT.
+            columns[field] = self.column(field).astype(object).tolist()
+        buy_lots = self.buy_lots
+        columns['buy_lot'] = [buy_lots[code]
+                              for code in self.column('buy_lot').tolist()]
+        form_positions = self.form_positions
+        columns['form_position'] = [
+            form_positions[code]
+            for code in self.column('form_position').tolist()]
+        columns['replacement_for'] = [
+            [buy_lots[code] for code in codes] if codes else []
+            for codes in self.replacement_for]
+        lot_list = [None] * self._size
+        order = np.argsort(self.column('lot_number'), kind='stable').tolist()
+        fields = [[columns[field][i] for i in order]
+                  for field in lots_lib.Lot.FIELD_NAMES]
+        for i, lot in zip(order, map(lots_lib.Lot, *fields)):
+            lot_list[i] = lot
+        return lots_lib.Lots(lot_list)
+
+    # =============================================================================
+    # Snapshots
+    # =============================================================================
+    def save(self, directory):
+        """Saves the table as a snapshot that load can map back in.
+
+        The directory gets one .npy file per numeric column, and a
+        snapshot.json file with the strings. The symbol, description and
+        adjustment code columns are saved as codes into a table of their
+        distinct strings, and replacement_for is saved as one array of buy lot
+        codes with an array of the offset of each row's codes.
+
+        Args:
+            directory: The path of a directory to save to. It is created if it
+                doesn't exist, and existing snapshot files are replaced.
+        """
+        os.makedirs(directory, exist_ok=True)
+
+        def save_column(name, values):
+            np.save(os.path.join(directory, name + '.npy'), values)
+
+        for field in (LotTable.INT_FIELDS + LotTable.DATE_FIELDS +
+                      LotTable.BOOL_FIELDS +
+                      ['buy_lot', 'form_position', 'lot_number']):
+            save_column(field, self.column(field))
+        strings = []
+        string_codes = {}
+        for field in LotTable.OBJECT_FIELDS:
+            codes = np.empty(self._size, dtype=np.int64)
+            for i, value in enumerate(self.column(field)):
+                code = string_codes.get(value)
+                if code is None:
+                    code = string_codes[value] = len(strings)
+                    strings.append(value)
+                codes[i] = code
+            save_column(field, codes)
+        offsets = np.zeros(self._size + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(codes) for codes in self.replacement_for])
+        save_column('replacement_for_offsets', offsets)
+        save_column('replacement_for',
+                    np.array([code for codes in self.replacement_for
+                              for code in codes], dtype=np.int64))
+        with open(os.path.join(directory, 'snapshot.json'), 'w') as f:
+            json.dump({
+                'version': LotTable.SNAPSHOT_VERSION,
+                'strings': strings,
+                'buy_lots': self.buy_lots,
+                'form_positions': self.form_positions,
+                'next_lot_number': self._next_lot_number,
+            }, f)
+
+    @staticmethod
+    def load(directory, mmap_mode='c'):
+        """Loads a snapshot saved by save.
+
+        The numeric columns are memory-mapped, so they are only read from
+        disk as they are used. Only the strings are read up front.
+
+        Args:
+            directory: The path of a directory that save wrote to.
+            mmap_mode: The mmap_mode for numpy.load. The default, 'c', maps the
+                files copy-on-write, so the table can be washed without
+                changing the snapshot. None reads the columns into memory.
+        Returns:
+            A LotTable.
+        """
+
+        def load_column(name, mmap_mode=mmap_mode):
+            return np.load(os.path.join(directory, name + '.npy'),
+                           mmap_mode=mmap_mode)
+
+        with open(os.path.join(directory, 'snapshot.json')) as f:
+            snapshot = json.load(f)
+        if snapshot['version'] != LotTable.SNAPSHOT_VERSION:
+            raise ValueError('Unsupported snapshot version {}'.format(
+                snapshot['version']))
+        table = LotTable(0)
+        for field in (LotTable.INT_FIELDS + LotTable.DATE_FIELDS +
+                      LotTable.BOOL_FIELDS +
+                      ['buy_lot', 'form_position', 'lot_number']):
+            table._columns[field] = load_column(field)
+        table._size = len(table._columns['lot_number'])
+        strings = np.empty(len(snapshot['strings']), dtype=object)
+        strings[:] = snapshot['strings']
+        for field in LotTable.OBJECT_FIELDS:
+            table._columns[field] = strings[load_column(field, None)]
+        offsets = load_column('replacement_for_offsets', None)
+        replacement_for = load_column('replacement_for', None).tolist()
+        table.replacement_for = [[] for _ in range(table._size)]
+        # Most rows are not replacements, so only those that are are sliced.
+        for row in np.flatnonzero(np.diff(offsets)).tolist():
+            table.replacement_for[row] = replacement_for[
+                offsets[row]:offsets[row + 1]]
+        table.buy_lots = snapshot['buy_lots']
+        table._buy_lot_codes = dict(zip(table.buy_lots,
+                                        range(len(table.buy_lots))))
+        table.form_positions = snapshot['form_positions']
+        table._next_lot_number = snapshot['next_lot_number']
+        return table
+
+    # =============================================================================
+    # Vectorized wash checks
+    # =============================================================================
+    def loss_mask(self):
+        """Returns a bool array, True for rows that are unprocessed losses."""
+        sell_date = self.column('sell_date')
+        return (~np.isnat(sell_date) &
+                (self.column('proceeds') < self.column('adjusted_basis')) &
+                ~self.column('loss_processed'))
+
+    def replacement_mask(self, loss):
+        """Returns a bool array, True for rows that can replace a loss row.
+
+        This applies the same rules as wash.best_replacement_lot: the row must
+        be bought within 30 days of the loss sale, must not be the loss or
+        part of the same buy lot, must not already be a replacement, must not
+        be a buy lot that the loss already replaces, must not be sold before
+        the loss, and must not be a processed loss.
+
+        Args:
+            loss: An integer, the row of the loss.
+        """
+        sell_date = self.column('sell_date')
+        buy_lot = self.column('buy_lot')
+        loss_sell_date = sell_date[loss]
+        mask = (np.abs(self.column('buy_date') - loss_sell_date) <=
+                LotTable.WASH_WINDOW)
+        mask[loss] = False
+        if self.buy_lots[buy_lot[loss]] != '':
+            mask &= buy_lot != buy_lot[loss]
+        mask &= ~self.column('is_replacement')
+        if self.replacement_for[loss]:
+            mask &= ~np.isin(buy_lot, self.replacement_for[loss])
+        # NaT compares as False, so unsold rows are kept.
+        mask &= ~(sell_date < loss_sell_date)
+        mask &= ~self.column('loss_processed')
+        return mask
+
+    def _first_row(self, rows, keys):
+        """Returns the row of rows that sorts first by keys, or None.
+
+        Args:
+            rows: An integer array of row numbers.
+            keys: A list of columns, most significant first.
+        """
+        if not len(rows):
+            return None
+        order = np.lexsort([key[rows] for key in reversed(keys)])
+        return int(rows[order[0]])
+
+    def earliest_loss(self):
+        """Returns the row of the first unprocessed loss, or None.
+
+        Rows are ordered the same way as Lot.cmp_by_sell_date.
+        """
+        return self._first_row(
+            np.flatnonzero(self.loss_mask()),
+            [self.column('sell_date'), self.column('buy_date'),
+             self.column('form_position'), self.column('lot_number')])
+
+    def best_replacement(self, loss):
+        """Returns the row of the best replacement for a loss row, or None.
+
+        Rows are ordered the same way as Lot.cmp_by_original_buy_date.
+
+        Args:
+            loss: An integer, the row of the loss.
+        """
+        sell_date = self.column('sell_date')
+        return self._first_row(
+            np.flatnonzero(self.replacement_mask(loss)),
+            [self.column('buy_date'), np.isnat(sell_date), sell_date,
+             self.column('form_position'), self.column('lot_number')])
+
+    # =============================================================================
+    # Mutation
+    # =============================================================================
+    def _append_copy(self, row):
+        """Appends a copy of a row, with its own lot number, and returns it."""
+        if self._size == len(self._columns['lot_number']):
+            for field, column in self._columns.items():
+                grown = np.empty(2 * len(column), dtype=column.dtype)
+                grown[:self._size] = column
+                self._columns[field] = grown
+        new_row = self._size
+        for column in self._columns.values():
+            column[new_row] = column[row]
+        self._columns['lot_number'][new_row] = self._next_lot_number
+        self._next_lot_number += 1
+        self.replacement_for.append(list(self.replacement_for[row]))
+        self._size += 1
+        return new_row
+
+    def split(self, row, num_shares):
+        """Splits a row in two, the same way as wash._split_lot.
+
+        Args:
+            row: An integer, the row to split.
+            num_shares: An integer, the number of shares that row should
+                contain. The new row contains the rest.
+        Returns:
+            An integer, the new row.
+        """
+        total_shares = int(self._columns['num_shares'][row])
+        existing_portion = float(num_shares) / float(total_shares)
+        new_portion = float(total_shares - num_shares) / float(total_shares)
+        new_row = self._append_copy(row)
+        self._columns['num_shares'][new_row] = total_shares - num_shares
+        self._columns['num_shares'][row] = num_shares
+        for field in ('basis', 'adjusted_basis', 'proceeds', 'adjustment'):
+            column = self._columns[field]
+            value = int(column[row])
+            column[new_row] = int(round(value * new_portion))
+            column[row] = int(round(value * existing_portion))
+        return new_row
+
+    def wash(self, loss, replacement):
+        """Washes a loss row against a replacement row of the same size.
+
+        Args:
+            loss: An integer, the row of the loss.
+            replacement: An integer, the row of the replacement.
+        """
+        columns = self._columns
+        columns['loss_processed'][loss] = True
+        columns['adjustment_code'][loss] = 'W'
+        columns['adjustment'][loss] = (columns['adjusted_basis'][loss] -
+                                       columns['proceeds'][loss])
+        columns['is_replacement'][replacement] = True
+        self.replacement_for[replacement].extend(self.replacement_for[loss])
+        self.replacement_for[replacement].append(
+            int(columns['buy_lot'][loss]))
+        columns['adjusted_basis'][replacement] += columns['adjustment'][loss]
+        columns['adjusted_buy_date'][replacement] -= (
+            columns['sell_date'][loss] - columns['adjusted_buy_date'][loss])
+
+    # =============================================================================
+    # Tax-related calculations
+    # =============================================================================
+    def calc_gains(self, date=None, price=None):
+        """Calculates the gains of all rows, like Lots.calc_gains.
+
+        Args:
+            date: A datetime.date, or None.
+            price: The price to calculate unrealized gains at, or None.
+        Returns:
+            A dictionary with keys: r_st, r_lt, u_st, u_lt (GAINS_CODES).
+        """
+        return lots_lib.calc_column_gains(*self._gains_columns(), date=date,
+                                          price=price)
+
+    def calc_gains_series(self, dates, prices):
+        """Calculates the gains of all rows at each date and price.
+
+        Args:
+            dates: A sequence of datetime.date objects, or a datetime64 array.
+            prices: A sequence of prices, the same length as dates.
+        Returns:
+            A float array with a row per date and a column per code in
+            GAINS_CODES, like Lots.calc_gains_series.
+        """
+        return lots_lib.calc_column_gains_series(
+            *self._gains_columns(), dates=dates, prices=prices)
+
+    def _gains_columns(self):
+        """Returns the columns that lots_lib.calc_column_gains takes."""
+        buy_date = self.column('buy_date')
+        adjusted_buy_date = self.column('adjusted_buy_date')
+        return (self.column('num_shares'), self.column('adjusted_basis'),
+                self.column('proceeds'),
+                np.where(np.isnat(adjusted_buy_date), buy_date,
+                         adjusted_buy_date),
+                self.column('sell_date'),
+                self.column('adjustment_code') == 'W')
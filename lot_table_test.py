@@ -0,0 +1,174 @@
+import copy
+import datetime
+import io
+import tempfile
+import unittest
+
+import numpy as np
+
+import lot_table as lot_table_lib
+import lots as lots_lib
+import wash
+import wash_test
+
+
+create_lot = wash_test.create_lot
+
+
+class TestLotTable(unittest.TestCase):
+
+    def setUp(self):
+        self.loss = create_lot(10, 2011, 6, 1, 120, 2012, 1, 10, 110)
+        self.first_gain = create_lot(10, 2012, 1, 1, 100, 2012, 6, 1, 200)
+        self.unsold = create_lot(10, 2012, 1, 5, 130)
+        self.days_early_31 = create_lot(10, 2011, 12, 10, 130)
+        self.gain_just_before_loss = create_lot(10, 2012, 1, 1, 100,
+                                                2012, 1, 5, 200)
+
+    def test_round_trip(self):
+        lot = lots_lib.Lot(
+            10, 'ABC', 'A', datetime.date(2014, 9, 15),
+            datetime.date(2014, 9, 14), 2000, 2100, datetime.date(2014, 10, 5),
+            1800, 'W', 200, 'form1', 'lot1', ['lot3', 'lot4'], True, True)
+        lots = lots_lib.Lots([lot, self.loss, self.unsold])
+        round_tripped = lot_table_lib.LotTable.from_lots(lots).to_lots()
+        self.assertTrue(lots.contents_equal(round_tripped))
+
+        expected_output = io.StringIO()
+        lots.write_csv_data(expected_output)
+        actual_output = io.StringIO()
+        round_tripped.write_csv_data(actual_output)
+        self.assertEqual(expected_output.getvalue(), actual_output.getvalue())
+
+    def test_snapshot_round_trip(self):
+        lot = lots_lib.Lot(
+            10, 'ABC', 'Ünïcode, "quoted"', datetime.date(2014, 9, 15),
+            datetime.date(2014, 9, 14), 2000, 2100, datetime.date(2014, 10, 5),
+            1800, 'W', 200, 'form1', 'lot1', ['lot3', 'lot4'], True, True)
+        no_symbol = create_lot(10, 2012, 1, 5, 130)
+        no_symbol.symbol = None
+        lots = lots_lib.Lots([lot, self.loss, no_symbol])
+        with tempfile.TemporaryDirectory() as directory:
+            lots.save_snapshot(directory)
+            loaded = lots_lib.Lots.load_snapshot(directory)
+            table = lot_table_lib.LotTable.load(directory)
+            self.assertIsInstance(table.column('basis'), np.memmap)
+        self.assertTrue(lots.contents_equal(loaded))
+        for expected, actual in zip(lots, loaded):
+            for field in lots_lib.Lot.FIELD_NAMES:
+                self.assertEqual(getattr(expected, field),
+                                 getattr(actual, field))
+
+    def test_snapshot_round_trip_without_form_position(self):
+        no_position = create_lot(10, 2012, 1, 5, 130)
+        no_position.form_position = None
+        lots = lots_lib.Lots([self.loss, no_position])
+        with tempfile.TemporaryDirectory() as directory:
+            lots.save_snapshot(directory)
+            loaded = lots_lib.Lots.load_snapshot(directory)
+        self.assertTrue(lots.contents_equal(loaded))
+        self.assertEqual([self.loss.form_position, None],
+                         [lot.form_position for lot in loaded])
+
+    def test_wash_loaded_snapshot(self):
+        lots = lots_lib.Lots([
+            create_lot(10, 2011, 6, 1, 120, 2012, 1, 10, 110),
+            create_lot(18, 2012, 1, 5, 130),
+        ])
+        with tempfile.TemporaryDirectory() as directory:
+            lot_table_lib.LotTable.from_lots(lots).save(directory)
+            table = lot_table_lib.LotTable.load(directory)
+            wash.wash_lot_table(table)
+            unchanged = lot_table_lib.LotTable.load(directory)
+            self.assertEqual(3, table.size())
+            self.assertEqual([False, False],
+                             unchanged.column('is_replacement').tolist())
+            del table, unchanged
+
+    def test_loss_mask(self):
+        lots = lots_lib.Lots([self.unsold, self.loss, self.first_gain])
+        table = lot_table_lib.LotTable.from_lots(lots)
+        self.assertEqual([False, True, False], table.loss_mask().tolist())
+        self.assertEqual(1, table.earliest_loss())
+
+    def test_replacement_mask(self):
+        self.first_gain.is_replacement = True
+        lots = lots_lib.Lots([self.loss, self.first_gain, self.unsold,
+                              self.days_early_31, self.gain_just_before_loss])
+        table = lot_table_lib.LotTable.from_lots(lots)
+        self.assertEqual([False, False, True, False, False],
+                         table.replacement_mask(0).tolist())
+        self.assertEqual(2, table.best_replacement(0))
+
+    def test_replacement_mask_excludes_same_buy_lot(self):
+        self.unsold.buy_lot = 'lot1'
+        self.loss.buy_lot = 'lot1'
+        lots = lots_lib.Lots([self.loss, self.unsold])
+        table = lot_table_lib.LotTable.from_lots(lots)
+        self.assertIsNone(table.best_replacement(0))
+
+    def test_split(self):
+        large_gain = create_lot(18, 2012, 1, 1, 100, 2012, 6, 1, 200)
+        table = lot_table_lib.LotTable.from_lots(lots_lib.Lots([large_gain]))
+        new_row = table.split(0, 10)
+        self.assertEqual(2, table.size())
+        self.assertEqual([10, 8], table.column('num_shares').tolist())
+        self.assertEqual([56, 44], table.column('basis').tolist())
+        self.assertEqual([111, 89], table.column('proceeds').tolist())
+        self.assertGreater(table.column('lot_number')[new_row],
+                           table.column('lot_number')[0])
+
+    def test_wash_lot_table_matches_wash_all_lots(self):
+        lots = lots_lib.Lots([
+            create_lot(10, 2011, 6, 1, 120, 2012, 1, 10, 110),
+            create_lot(6, 2012, 1, 1, 100, 2012, 6, 1, 105),
+            create_lot(18, 2012, 1, 5, 130),
+            create_lot(10, 2012, 1, 20, 140, 2012, 3, 1, 115),
+            create_lot(10, 2012, 6, 10, 130),
+        ])
+        table = lot_table_lib.LotTable.from_lots(copy.deepcopy(lots))
+        wash.wash_all_lots(lots)
+        wash.wash_lot_table(table)
+        washed = table.to_lots()
+        washed.sort_by('sell_date')
+        self.assertTrue(lots.contents_equal(washed))
+        self.assertEqual(lots.size(), washed.size())
+
+    def test_wash_short_rows(self):
+        # The rows leave out the columns from Form Position on, which are
+        # read as None.
+        data = [','.join(lots_lib.Lots.HEADERS[name]
+                         for name in lots_lib.Lot.FIELD_NAMES),
+                '10,ABC,,6/1/2011,6/1/2011,120,120,1/10/2012,110,,',
+                '10,ABC,,1/5/2012,1/5/2012,130,130,,,,']
+        lots = lots_lib.Lots.create_from_csv_data(data)
+        self.assertIsNone(lots.lots()[0].form_position)
+        table = lot_table_lib.LotTable.from_lots(copy.deepcopy(lots))
+        wash.wash_all_lots(lots)
+        wash.wash_lot_table(table)
+        washed = table.to_lots()
+        washed.sort_by('sell_date')
+        self.assertTrue(lots.contents_equal(washed))
+        self.assertEqual([None, None],
+                         [lot.form_position for lot in washed])
+
+    def test_calc_gains_matches_lots(self):
+        lots = lots_lib.Lots([
+            create_lot(10, 2011, 6, 1, 120, 2012, 1, 10, 110),
+            create_lot(6, 2012, 1, 1, 100, 2013, 6, 1, 105),
+            create_lot(18, 2012, 1, 5, 130),
+            create_lot(10, 2012, 6, 10, 130),
+        ])
+        wash.wash_all_lots(lots)
+        table = lot_table_lib.LotTable.from_lots(lots)
+        date = datetime.date(2013, 3, 1)
+        self.assertEqual(lots.calc_gains(date=date, price=20),
+                         table.calc_gains(date=date, price=20))
+        dates = [date, datetime.date(2013, 6, 10)]
+        np.testing.assert_array_equal(
+            lots.calc_gains_series(dates, [20, 25]),
+            table.calc_gains_series(dates, [20, 25]))
+
+
+if __name__ == '__main__':
+    unittest.main()
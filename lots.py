@@ -1,33 +1,295 @@
-import copy
+import bisect
+import collections
 import csv
 import datetime
-import numpy as np
-from functools import cmp_to_key
-from dateutil.relativedelta import relativedelta
-
-_HAS_TERMINALTABLES = False
-try:
-    import terminaltables
-    _HAS_TERMINALTABLES = True
-except ImportError:
-    print('Install terminaltsables library for formatting tables.')
-
-_HAS_COLORCLASS = False
-try:
-    import colorclass
-    _HAS_COLORCLASS = True
-except ImportError:
-    print('Install colorclass library for color coding changes.')
-
-
-# This is a global value for the number of lots that have been created. It is
-# global because we want to increment it whenever a Lot object is created,
-# which is done in a number of different places.
-_LOT_COUNT = 0
+import itertools
+import operator
+import sys
+
+# numpy and dateutil are imported in the functions that use them, which
+# calculate gains, so that washing from the command line doesn't wait for
+# them to load.
+
+# Whether the optional terminaltables and colorclass libraries are installed,
+# or None until _load_formatting_libraries looks for them.
+_HAS_TERMINALTABLES = None
+_HAS_COLORCLASS = None
+
+def _load_formatting_libraries():
+    """Imports terminaltables and colorclass, if they are installed.
+
+    They are only used to print lots, so this is called the first time lots
+    are printed, and says on stderr which ones are missing.
+    """
+    global _HAS_TERMINALTABLES, _HAS_COLORCLASS, terminaltables, colorclass
+    if _HAS_TERMINALTABLES is not None:
+        return
+    try:
+        import terminaltables
+        _HAS_TERMINALTABLES = True
+    except ImportError:
+        _HAS_TERMINALTABLES = False
+        print('Install terminaltables library for formatting tables.',
+              file=sys.stderr)
+    try:
+        import colorclass
+        _HAS_COLORCLASS = True
+    except ImportError:
+        _HAS_COLORCLASS = False
+        print('Install colorclass library for color coding changes.',
+              file=sys.stderr)
+
+
+# Hands out lot numbers in creation order. It is global because we want to
+# number every Lot object that is created, which is done in a number of
+# different places.
+_LOT_NUMBERS = itertools.count()
+
+
+def _reserve_lot_numbers(lots):
+    """Makes sure that lots created from now on are numbered after lots.
+
+    This matters in a process that received lots from another process, since
+    its own numbering started over.
+
+    Args:
+        lots: An iterable of Lot objects.
+    """
+    global _LOT_NUMBERS
+    next_number = next(_LOT_NUMBERS)
+    for lot in lots:
+        next_number = max(next_number, lot._lot_number + 1)
+    _LOT_NUMBERS = itertools.count(next_number)
+
+# The Lot fields that are part of a sort order.
+_ORDER_FIELDS = ['buy_date', 'adjusted_buy_date', 'sell_date', 'form_position']
+
+#%% class _FieldVersions
+class _FieldVersions(object):
+    """Counts the changes to each of _ORDER_FIELDS of a group of lots.
+
+    Each Lots object makes one for the lots that it holds first, and compares
+    the counts against the ones its cached orders were built with to decide
+    whether they are stale. When it holds lots that are already in another
+    group, the two groups are merged, so that both objects see changes to
+    either's lots. Changes to lots in other groups don't affect it.
+    """
+
+    __slots__ = ['counts', 'merged_into']
+
+    def __init__(self):
+        self.counts = dict.fromkeys(_ORDER_FIELDS, 0)
+        # The group that this one was merged into, or None.
+        self.merged_into = None
+
+    def find(self):
+        """Returns the group that this one is now part of.
+
+        Each group on the way is pointed straight at it, so that later calls
+        are quick.
+        """
+        group = self
+        while group.merged_into is not None:
+            group = group.merged_into
+        while self is not group:
+            self.merged_into, self = group, self.merged_into
+        return group
+
+    def merge(self, other):
+        """Merges another group into this one, which must not be merged.
+
+        The counts are added, so they never go down, and a count that is
+        unchanged still means that none of the lots of the group changed.
+        """
+        other = other.find()
+        if other is not self:
+            for field, count in other.counts.items():
+                self.counts[field] += count
+            other.merged_into = self
+
+
+def _order_field(name, resets=()):
+    """Creates a property for a Lot field that is part of a sort order.
+
+    Setting the field bumps its count in the lot's field versions, if it is in
+    a Lots object.
+
+    Args:
+        name: A string, the name of the field.
+        resets: A tuple of the names of slots that cache values computed from
+            the field. Setting the field sets them to None.
+    """
+    attr = '_' + name
+
+    def fset(self, value):
+        setattr(self, attr, value)
+        versions = self._field_versions
+        if versions is not None:
+            if versions.merged_into is not None:
+                versions = self._field_versions = versions.find()
+            versions.counts[name] += 1
+        for cached in resets:
+            setattr(self, cached, None)
+
+    return property(operator.attrgetter(attr), fset)
+
+def _one_year_after(dates):
+    """Adds relativedelta(years=1) to each date in a datetime64[D] array.
+
+    A date that doesn't exist a year later, i.e. Feb 29, becomes the last day
+    of the month, as with relativedelta. NaT stays NaT.
+    """
+    import numpy as np
+    months = dates.astype('datetime64[M]')
+    day = dates - months.astype('datetime64[D]')
+    later_months = months + 12
+    later_month_starts = later_months.astype('datetime64[D]')
+    last_day = ((later_months + 1).astype('datetime64[D]') -
+                later_month_starts - np.timedelta64(1, 'D'))
+    return later_month_starts + np.minimum(day, last_day)
+
+# The day number of 1970-01-01, which is day 0 in a datetime64[D] array.
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+def _date_column(dates):
+    """Returns a datetime64[D] array of dates, with NaT for None.
+
+    Each distinct date is converted once, since lots share a few thousand
+    dates and NumPy converts date objects one at a time.
+    """
+    import numpy as np
+    days = {None: np.datetime64('NaT', 'D').astype(np.int64)}
+    values = []
+    append = values.append
+    for date in dates:
+        try:
+            append(days[date])
+        except KeyError:
+            days[date] = value = date.toordinal() - _EPOCH_ORDINAL
+            append(value)
+    return np.array(values, dtype=np.int64).view('datetime64[D]')
+
+def _sum_gains(gains, mask):
+    """Returns the sum of gains[mask], or NaN if mask selects nothing."""
+    import numpy as np
+    if not mask.any():
+        return np.nan
+    return gains[mask].sum().item()
+
+def calc_column_gains(num_shares, adjusted_basis, proceeds, start_dates,
+                      sell_dates, washed, date=None, price=None):
+    """Calculates the gains of a set of lots held as columns.
+
+    This gives the same result as Lots.calc_gains, but with a few array
+    operations instead of a Lot.calc_gains call per lot.
+
+    Args:
+        num_shares: An int64 array with a value per lot.
+        adjusted_basis: An int64 array.
+        proceeds: An int64 array.
+        start_dates: A datetime64[D] array, the start of each lot's holding
+            period, i.e. its adjusted buy date or else its buy date.
+        sell_dates: A datetime64[D] array, with NaT for unsold lots.
+        washed: A bool array, True for lots with a 'W' adjustment code.
+        date: A datetime.date, or None.
+        price: The price to calculate unrealized gains at, or None.
+    Returns:
+        A dictionary with keys: r_st, r_lt, u_st, u_lt (GAINS_CODES). Each
+        value is the sum of the lots' gains of that kind, or NaN if no lot has
+        a gain of that kind.
+    """
+    import numpy as np
+    long_term_after = _one_year_after(start_dates)
+    sold = ~np.isnat(sell_dates)
+    realized = sold & ~washed
+    # A comparison with NaT is False, so a missing buy date is short term, as
+    # in Lot.is_long_term.
+    realized_long_term = sell_dates > long_term_after
+    realized_gains = proceeds - adjusted_basis
+    gains = {
+        'r_st': _sum_gains(realized_gains, realized & ~realized_long_term),
+        'r_lt': _sum_gains(realized_gains, realized & realized_long_term),
+        'u_st': np.nan,
+        'u_lt': np.nan,
+    }
+    if price is not None and date is not None:
+        unrealized = ~sold & ~washed
+        unrealized_long_term = np.datetime64(date, 'D') > long_term_after
+        unrealized_gains = num_shares * price - adjusted_basis
+        gains['u_st'] = _sum_gains(unrealized_gains,
+                                   unrealized & ~unrealized_long_term)
+        gains['u_lt'] = _sum_gains(unrealized_gains,
+                                   unrealized & unrealized_long_term)
+    return gains
+
+def calc_column_gains_series(num_shares, adjusted_basis, proceeds,
+                             start_dates, sell_dates, washed, dates, prices):
+    """Calculates the gains of a set of lots held as columns at many dates.
+
+    Row i of the result matches calc_column_gains(..., dates[i], prices[i]).
+    Realized gains don't depend on the date, so they are summed once. The
+    unsold lots are sorted by the date they become long term, and the running
+    totals of their shares and bases give the long and short term unrealized
+    gains at every date from one binary search per date.
+
+    Args:
+        num_shares, adjusted_basis, proceeds, start_dates, sell_dates, washed:
+            The lot columns, as for calc_column_gains.
+        dates: A sequence of datetime.date objects, or a datetime64 array.
+        prices: A sequence of prices, the same length as dates.
+    Returns:
+        A float array with a row per date and a column per code in
+        GAINS_CODES. A code that no lot has a gain of is NaN.
+    """
+    import numpy as np
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    prices = np.asarray(prices, dtype=np.float64)
+    if dates.shape != prices.shape:
+        raise ValueError('dates and prices have different lengths: {} != {}'
+                         .format(len(dates), len(prices)))
+    result = np.full((len(dates), len(Lot.GAINS_CODES)), np.nan)
+    realized = calc_column_gains(num_shares, adjusted_basis, proceeds,
+                                 start_dates, sell_dates, washed)
+    result[:, 0] = realized['r_st']
+    result[:, 1] = realized['r_lt']
+
+    unrealized = np.isnat(sell_dates) & ~washed
+    long_term_after = _one_year_after(start_dates[unrealized])
+    order = np.argsort(long_term_after, kind='stable')
+    long_term_after = long_term_after[order]
+    # Running totals with a leading 0, so that index k is the total of the
+    # first k lots.
+    shares = np.concatenate(
+        ([0], np.cumsum(num_shares[unrealized][order], dtype=np.float64)))
+    basis = np.concatenate(
+        ([0], np.cumsum(adjusted_basis[unrealized][order], dtype=np.float64)))
+    # The lots before num_long_term[i] became long term before dates[i]. NaT
+    # sorts last, so a lot with no buy date is always short term.
+    num_long_term = np.searchsorted(long_term_after, dates, side='left')
+    num_lots = len(long_term_after)
+    long_term = prices * shares[num_long_term] - basis[num_long_term]
+    short_term = (prices * (shares[-1] - shares[num_long_term]) -
+                  (basis[-1] - basis[num_long_term]))
+    result[:, 2] = np.where(num_long_term < num_lots, short_term, np.nan)
+    result[:, 3] = np.where(num_long_term > 0, long_term, np.nan)
+    return result
 
 #%% class BadHeadersError
 class BadHeadersError(Exception):
     """Raised if the headers that are parsed are not in the correct format."""   
+#%% class BadRowError
+class BadRowError(ValueError):
+    """Raised if a row of csv data can't be parsed into a Lot.
+
+    Attributes:
+        line_num: The line number of the end of the row, counting from 1.
+    """
+
+    def __init__(self, line_num, message):
+        super(BadRowError, self).__init__(
+            'Line {}: {}'.format(line_num, message))
+        self.line_num = line_num
+
 #%% class Lot
 class Lot(object):
     """Models a single lot of stock."""
@@ -41,7 +303,29 @@ class Lot(object):
 
     # A list of codes for different kinds of gains (realized/unrealized, short/long term)
     GAINS_CODES = ['r_st', 'r_lt', 'u_st', 'u_lt']
-    
+
+    # The fields that identify which trade a lot came from. Lots.diff pairs up
+    # lots that differ but have the same values of these fields.
+    IDENTITY_FIELDS = ['symbol', 'buy_date', 'form_position', 'buy_lot']
+
+    # Slots keep a Lot small, since there can be millions of them. The sort
+    # order fields are stored in the underscored slots behind properties.
+    # __weakref__ lets sqlite_lots.SqliteLots keep a weak map of the lots that
+    # it has loaded. _long_term_after caches long_term_after, and is reset when
+    # a buy date changes. _field_versions is the _FieldVersions of the first
+    # Lots object that held the lot.
+    __slots__ = ['num_shares', 'symbol', 'description', '_buy_date',
+                 '_adjusted_buy_date', 'basis', 'adjusted_basis', '_sell_date',
+                 'proceeds', 'adjustment_code', 'adjustment', '_form_position',
+                 'buy_lot', 'replacement_for', 'is_replacement',
+                 'loss_processed', '_lot_number', '_long_term_after',
+                 '_field_versions', '__weakref__']
+
+    buy_date = _order_field('buy_date', resets=('_long_term_after',))
+    adjusted_buy_date = _order_field('adjusted_buy_date',
+                                     resets=('_long_term_after',))
+    sell_date = _order_field('sell_date')
+    form_position = _order_field('form_position')
 
     def __init__(self, num_shares, symbol, description, buy_date,
                  adjusted_buy_date, basis, adjusted_basis, sell_date, proceeds,
@@ -80,27 +364,57 @@ class Lot(object):
             loss_processed: A boolean, whether this lot is a loss and has
                 already been processed for a potential wash sale.
         """
+        # The sort order fields are set directly, since a new lot cannot be in
+        # any of the orders that Lots caches yet.
         self.num_shares = num_shares
         self.symbol = symbol
         self.description = description
-        self.buy_date = buy_date
-        self.adjusted_buy_date = adjusted_buy_date
+        self._buy_date = buy_date
+        self._adjusted_buy_date = adjusted_buy_date
         self.basis = basis
         self.adjusted_basis = adjusted_basis
-        self.sell_date = sell_date
+        self._sell_date = sell_date
         self.proceeds = proceeds
         self.adjustment_code = adjustment_code
         self.adjustment = adjustment
-        self.form_position = form_position
+        self._form_position = form_position
         self.buy_lot = buy_lot
         self.replacement_for = replacement_for
         self.is_replacement = is_replacement
         self.loss_processed = loss_processed
 
         # The lot number is only used to sort otherwise equivalent lots.
-        global _LOT_COUNT
-        self._lot_number = _LOT_COUNT
-        _LOT_COUNT += 1
+        self._lot_number = next(_LOT_NUMBERS)
+        self._long_term_after = None
+        self._field_versions = None
+
+    def clone(self):
+        """Returns a copy of this lot that sorts after all existing lots.
+
+        This is much cheaper than copy.deepcopy. The dates and strings are
+        immutable, so they are shared; only replacement_for is copied.
+        """
+        lot = Lot.__new__(Lot)
+        lot.num_shares = self.num_shares
+        lot.symbol = self.symbol
+        lot.description = self.description
+        lot._buy_date = self._buy_date
+        lot._adjusted_buy_date = self._adjusted_buy_date
+        lot.basis = self.basis
+        lot.adjusted_basis = self.adjusted_basis
+        lot._sell_date = self._sell_date
+        lot.proceeds = self.proceeds
+        lot.adjustment_code = self.adjustment_code
+        lot.adjustment = self.adjustment
+        lot._form_position = self._form_position
+        lot.buy_lot = self.buy_lot
+        lot.replacement_for = list(self.replacement_for)
+        lot.is_replacement = self.is_replacement
+        lot.loss_processed = self.loss_processed
+        lot._lot_number = next(_LOT_NUMBERS)
+        lot._long_term_after = self._long_term_after
+        lot._field_versions = None
+        return lot
 
     def is_loss(self):
         """Determines whether this lot is a loss.
@@ -134,6 +448,19 @@ class Lot(object):
     def __ne__(self, other):
         return not self == other
 
+    def key(self):
+        """Returns a hashable tuple of the values of all of the fields.
+
+        Two lots have equal keys exactly when they are equal. Lots can change,
+        so the key is a snapshot, and Lot objects themselves aren't hashable.
+        """
+        return (self.num_shares, self.symbol, self.description,
+                self._buy_date, self._adjusted_buy_date, self.basis,
+                self.adjusted_basis, self._sell_date, self.proceeds,
+                self.adjustment_code, self.adjustment, self._form_position,
+                self.buy_lot, tuple(self.replacement_for), self.is_replacement,
+                self.loss_processed)
+
     def __str__(self):
         return ' '.join(self.str_data())
 
@@ -157,6 +484,14 @@ class Lot(object):
                 '{}'.format(self.is_replacement),
                 '{}'.format(self.loss_processed)]
 
+    @staticmethod
+    def _cmp_lot_numbers(a, b):
+        if a._lot_number < b._lot_number:
+            return -1
+        if a._lot_number > b._lot_number:
+            return 1
+        return 0
+
     @staticmethod
     def cmp_by_buy_date(a, b):
         """Sorts two lots based on their (possibly adjusted) buy dates."""
@@ -172,7 +507,7 @@ class Lot(object):
             if a.form_position < b.form_position:
                 return -1
             return 1
-        return a._lot_number < b._lot_number
+        return Lot._cmp_lot_numbers(a, b)
 
     @staticmethod
     def cmp_by_original_buy_date(a, b):
@@ -189,7 +524,7 @@ class Lot(object):
             if a.form_position < b.form_position:
                 return -1
             return 1
-        return a._lot_number < b._lot_number
+        return Lot._cmp_lot_numbers(a, b)
 
     @staticmethod
     def cmp_by_sell_date(a, b):
@@ -206,39 +541,64 @@ class Lot(object):
             if a.form_position < b.form_position:
                 return -1
             return 1
-        return a._lot_number < b._lot_number
+        return Lot._cmp_lot_numbers(a, b)
+
+    @staticmethod
+    def buy_date_key(lot):
+        """Returns a sort key that orders lots like cmp_by_buy_date."""
+        return (lot._adjusted_buy_date, lot._sell_date is None, lot._sell_date,
+                lot._form_position, lot._lot_number)
+
+    @staticmethod
+    def original_buy_date_key(lot):
+        """Returns a sort key that orders lots like cmp_by_original_buy_date."""
+        return (lot._buy_date, lot._sell_date is None, lot._sell_date,
+                lot._form_position, lot._lot_number)
+
+    @staticmethod
+    def sell_date_key(lot):
+        """Returns a sort key that orders lots like cmp_by_sell_date."""
+        return (lot._sell_date is None, lot._sell_date, lot._buy_date,
+                lot._form_position, lot._lot_number)
     
     # =============================================================================
     # Tax-related calculations
     # =============================================================================
+    def long_term_after(self):
+        """Returns the last day of the short-term holding period, or None.
+
+        A lot sold or valued after this date gets long-term treatment. The
+        holding period starts on the adjusted buy date, or the buy date if
+        there is none. The date is computed once, and again only if a buy date
+        changes, e.g. when the lot is used as a replacement in a wash.
+        """
+        if self._long_term_after is None:
+            if self._adjusted_buy_date is None:
+                start = self._buy_date
+            else:
+                start = self._adjusted_buy_date
+            if start is not None:
+                from dateutil.relativedelta import relativedelta
+                self._long_term_after = start + relativedelta(years=1)
+        return self._long_term_after
+
     def is_long_term(self, date=None):
         """ Calculate if lot is eligible for long-ter gains treatment
             If it's closed, date is ignored.  If it's open and date=None, 
             return False
         """
-        # Determine start and end date of the holding period
-        if self.adjusted_buy_date is None:
-            start = self.buy_date
-        else:            
-            start = self.adjusted_buy_date
-        
         if self.sell_date is None:
             end = date
         else:
             end = self.sell_date
-            
+
         # Test is holding period is greater than 1 year to qualify for Long-Term treatment
-        if (start is None) or (end is None):
+        long_term_after = self.long_term_after()
+        if (long_term_after is None) or (end is None):
             return False
         else:
-            return (end > start + relativedelta(years=1))
-        
-        def is_long_term(start, end):
-            if (start is None) or (end is None):
-                return False
-            else:
-                return end > start+relativedelta(years=1)
-        
+            return end > long_term_after
+
     def calc_gains(self, date=None, price=None, ):
         """
         Calculate realized and unrealized gains, split into short-term and long-term
@@ -247,6 +607,7 @@ class Lot(object):
         Return a dictionary with keys: r_st, r_lt, u_st, u_lt (GAINS_CODES)
         (realized/unrealized, Short/Long-term)
         """
+        import numpy as np
             
         # Set values to defaults
         r_s, r_l, u_s, u_l  = (np.nan,) * 4
@@ -276,6 +637,9 @@ class Lot(object):
         gains = {'r_st' : r_s, 'r_lt' : r_l, 'u_st': u_s, 'u_lt': u_l}
         return gains
         
+# The result of Lots.diff.
+LotsDiff = collections.namedtuple('LotsDiff', ['added', 'removed', 'modified'])
+
 #%% class Lots
 class Lots(object):
     """Contains a set of lots."""
@@ -320,32 +684,191 @@ class Lots(object):
         'loss_processed': 'Processed'
     }
 
-    def __init__(self, lots):
+    # The orders that Lots keeps indexes for, mapped to the Lot sort key and the
+    # Lot fields that the key depends on.
+    ORDERS = {
+        'buy_date': (Lot.buy_date_key,
+                     ('adjusted_buy_date', 'sell_date', 'form_position')),
+        'original_buy_date': (Lot.original_buy_date_key,
+                              ('buy_date', 'sell_date', 'form_position')),
+        'sell_date': (Lot.sell_date_key,
+                      ('sell_date', 'buy_date', 'form_position')),
+    }
+
+    def __init__(self, lots, first_buy_lot=1):
         """Creates a new set of lots.
 
         Populates the buy_lot field in each lot if it is not set.
 
         Args:
             lots: A list of Lot objects.
+            first_buy_lot: An integer, the number to populate the first unset
+                buy_lot field with.
         """
-        i = 1
+        # Changes to the sort order fields of the lots are counted here. If a
+        # lot was already in another Lots object, that object's field versions
+        # are merged into these.
+        self._field_versions = _FieldVersions()
+        i = first_buy_lot
         for lot in lots:
             if not lot.buy_lot:
                 lot.buy_lot = '_{}'.format(i)
                 i += 1
+            self._watch(lot)
         self._lots = lots
+        # Cached orders of the lots, keyed by the names in ORDERS. Each value
+        # is a (field_versions, keys, lots) tuple, where keys and lots are
+        # parallel lists in sorted order.
+        self._indexes = {}
+        # The (order, field_versions, size) that self._lots was last sorted
+        # into by sort_by, or None.
+        self._sorted_by = None
+        self._num_sorts = 0
 
     def lots(self):
         """Returns the list of Lot objects."""
         return self._lots
 
+    def _watch(self, lot):
+        """Makes the cached orders notice changes to a lot's sort fields."""
+        versions = lot._field_versions
+        if versions is None:
+            lot._field_versions = self._field_versions
+        elif versions is not self._field_versions:
+            self._field_versions = self._field_versions.find()
+            self._field_versions.merge(versions)
+
+    def _versions(self, fields):
+        """Returns the number of changes to each of fields of the lots.
+
+        Lots that are in other Lots objects too may count changes to lots
+        that aren't in this one. That only makes a cached order be rebuilt
+        when it didn't need to be.
+        """
+        counts = self._field_versions.find().counts
+        return tuple(counts[field] for field in fields)
+
     def add(self, lot):
         """Adds a lot to this object.
 
+        Any cached orders are patched to include the lot.
+
         Args:
             lot: The Lot to add.
         """
         self._lots.append(lot)
+        self._watch(lot)
+        for order, (versions, keys, lots) in self._indexes.items():
+            key = Lots.ORDERS[order][0](lot)
+            i = bisect.bisect_right(keys, key)
+            keys.insert(i, key)
+            lots.insert(i, lot)
+
+    def update(self, lot):
+        """Records that the fields of a lot in this object were changed.
+
+        The Lot objects are held directly, so there is nothing to do. Stores
+        that keep lots elsewhere, such as sqlite_lots.SqliteLots, write the
+        lot back.
+
+        Args:
+            lot: The Lot that was changed.
+        """
+
+    def remove(self, lot):
+        """Removes a lot from this object.
+
+        Any cached orders are patched to leave the lot out.
+
+        Args:
+            lot: The Lot to remove. It is found by identity, not equality.
+        """
+        for i, other in enumerate(self._lots):
+            if other is lot:
+                del self._lots[i]
+                break
+        else:
+            raise ValueError('Lot is not in Lots')
+        for order, (versions, keys, lots) in list(self._indexes.items()):
+            key_func, fields = Lots.ORDERS[order]
+            if versions != self._versions(fields):
+                # It will be rebuilt without the lot anyway.
+                del self._indexes[order]
+                continue
+            i = bisect.bisect_left(keys, key_func(lot))
+            del keys[i]
+            del lots[i]
+        self._sorted_by = None
+
+    def _index(self, order):
+        """Returns the (field_versions, keys, lots) index for an order.
+
+        The index is rebuilt if any lot field that the order depends on has
+        changed since it was built.
+
+        Args:
+            order: A key of ORDERS.
+        """
+        key_func, fields = Lots.ORDERS[order]
+        versions = self._versions(fields)
+        index = self._indexes.get(order)
+        if index is None or index[0] != versions:
+            lots = sorted(self._lots, key=key_func)
+            self._num_sorts += 1
+            index = (versions, [key_func(lot) for lot in lots], lots)
+            self._indexes[order] = index
+        return index
+
+    def ordered(self, order):
+        """Returns the lots sorted in the given order.
+
+        The result is cached, so repeated calls are cheap until a lot is added
+        or one of the fields that the order depends on changes. The returned
+        list must not be modified.
+
+        Args:
+            order: A key of ORDERS, e.g. 'sell_date'.
+        Returns:
+            A list of Lot objects.
+        """
+        return self._index(order)[2]
+
+    def sort_by(self, order):
+        """Sorts the lots in place, in one of the orders from ORDERS.
+
+        Args:
+            order: A key of ORDERS, e.g. 'sell_date'.
+        """
+        versions, keys, lots = self._index(order)
+        sorted_by = (order, versions, len(self._lots))
+        if self._sorted_by != sorted_by:
+            self._lots[:] = lots
+            self._sorted_by = sorted_by
+
+    def bought_between(self, start, end):
+        """Yields the lots with an original buy date in [start, end].
+
+        The lots are yielded in cmp_by_original_buy_date order. Only the lots in
+        the range are visited, so stopping early is cheap.
+
+        Args:
+            start: A datetime.date, the earliest buy date to include.
+            end: A datetime.date, the latest buy date to include.
+        """
+        versions, keys, lots = self._index('original_buy_date')
+        for i in range(bisect.bisect_left(keys, (start,)), len(keys)):
+            if keys[i][0] > end:
+                return
+            yield lots[i]
+
+    def clone(self):
+        """Returns a new Lots object with a clone of each lot.
+
+        The lots are cloned in the order that they were created, so the clones
+        break ties the same way as the originals.
+        """
+        return Lots([lot.clone() for lot in
+                     sorted(self._lots, key=operator.attrgetter('_lot_number'))])
 
     def size(self):
         """Returns the number of lots."""
@@ -353,31 +876,124 @@ class Lots(object):
 
     def sort(self, **kwargs):
         self._lots.sort(**kwargs)
+        self._sorted_by = None
+        self._num_sorts += 1
+
+    def num_sorts(self):
+        """Returns the number of times that any of the lots were sorted.
+
+        This counts sorts done to build cached orders as well as calls to
+        sort, so it shows how often the caches had to be rebuilt.
+        """
+        return self._num_sorts
+
+    def partition(self, key):
+        """Splits the lots into groups that share a key.
+
+        Args:
+            key: A function that takes a Lot and returns a hashable value.
+        Returns:
+            A list of Lots objects, one per distinct key, in the order that each
+            key first appears. The Lot objects are shared, not copied.
+        """
+        groups = {}
+        for lot in self._lots:
+            groups.setdefault(key(lot), []).append(lot)
+        return [Lots(group) for group in groups.values()]
+
+    def __getstate__(self):
+        # The cached orders are only valid in the process that built them.
+        state = self.__dict__.copy()
+        state['_indexes'] = {}
+        state['_sorted_by'] = None
+        return state
+
+    def __setstate__(self, state):
+        # A Lots object that was unpickled, e.g. in a worker process, must
+        # keep numbering split-off lots after the lots it holds.
+        self.__dict__.update(state)
+        _reserve_lot_numbers(self._lots)
 
     def contents_equal(self, other):
         """Returns True if the individual lots are the same.
 
-        This is different than __eq__ because the individual Lot objects do not
-        need to have the same id(), just be equivalent.
+        This is different than __eq__ because the lots must also be in the
+        same order.
         """
+        if len(self._lots) != len(other._lots):
+            return False
         for this, that in zip(self._lots, other._lots):
             if this != that:
                 return False
         return True
 
     def __eq__(self, other):
+        """Returns True if the lots are equal, in any order.
+
+        Each lot must be equal to a different lot in other, so the lots are
+        compared as multisets of Lot.key values, in linear time.
+        """
         if len(self._lots) != len(other._lots):
             return False
-        for lot in self._lots:
-            if lot not in other._lots:
-                return False
-        return True
+        return (collections.Counter(lot.key() for lot in self._lots) ==
+                collections.Counter(lot.key() for lot in other._lots))
+
+    def diff(self, other):
+        """Finds the lots that differ between this object and other.
+
+        Lots that are equal in both are left out. The rest are paired up by
+        Lot.IDENTITY_FIELDS, in buy date order, into modified lots. Any that
+        can't be paired are added or removed.
+
+        Args:
+            other: A Lots object, e.g. the result of a later run.
+        Returns:
+            A LotsDiff. added has the unpaired lots that are only in other,
+            removed has those only in this object, and modified has a (lot,
+            other_lot) tuple for each pair. Each list is in buy date order.
+        """
+        keys = [lot.key() for lot in self._lots]
+        other_keys = [lot.key() for lot in other._lots]
+        counts = collections.Counter(keys)
+        other_counts = collections.Counter(other_keys)
+
+        def unmatched(lots, keys, extra_counts):
+            result = []
+            for lot, key in zip(lots, keys):
+                if extra_counts[key] > 0:
+                    extra_counts[key] -= 1
+                    result.append(lot)
+            result.sort(key=Lot.buy_date_key)
+            return result
+
+        removed = unmatched(self._lots, keys, counts - other_counts)
+        added = unmatched(other._lots, other_keys, other_counts - counts)
+
+        def identity(lot):
+            return tuple(getattr(lot, field) for field in Lot.IDENTITY_FIELDS)
+
+        added_by_identity = {}
+        for lot in added:
+            added_by_identity.setdefault(identity(lot),
+                                         collections.deque()).append(lot)
+        modified = []
+        unpaired_removed = []
+        for lot in removed:
+            candidates = added_by_identity.get(identity(lot))
+            if candidates:
+                modified.append((lot, candidates.popleft()))
+            else:
+                unpaired_removed.append(lot)
+        paired = set(id(other_lot) for lot, other_lot in modified)
+        return LotsDiff(
+            added=[lot for lot in added if id(lot) not in paired],
+            removed=unpaired_removed, modified=modified)
 
     def __ne__(self, other):
         return not self == other
 
     def __str__(self):
-        global _HAS_TERMINALTABLES
+        _load_formatting_libraries()
         if _HAS_TERMINALTABLES:
             return self._terminaltables_str()
         else:
@@ -390,56 +1006,87 @@ class Lots(object):
                  loss_lots=None,
                  split_off_loss_lots=None,
                  replacement_lots=None,
-                 split_off_replacement_lots=None):
-        global _HAS_TERMINALTABLES
+                 split_off_replacement_lots=None,
+                 window=None):
+        _load_formatting_libraries()
         if _HAS_TERMINALTABLES:
             print(self._terminaltables_str(loss_lots, split_off_loss_lots,
                                            replacement_lots,
-                                           split_off_replacement_lots))
+                                           split_off_replacement_lots, window))
         else:
             print(self._simple_str(loss_lots, split_off_loss_lots,
                                    replacement_lots,
-                                   split_off_replacement_lots))
+                                   split_off_replacement_lots, window))
+
+    # The (characters, color) that mark each kind of highlighted lot, in the
+    # order of the arguments to do_print. A lot in several lists is marked as
+    # the first one.
+    _HIGHLIGHT_STYLES = [('*', 'red'), ('x', 'magenta'), ('o', 'green'),
+                         ('+', 'blue')]
 
     @staticmethod
-    def _classify_lot(lot,
-                      loss_lots=None,
-                      split_off_loss_lots=None,
-                      replacement_lots=None,
-                      split_off_replacement_lots=None):
-        """Classifies the provided lot based on the lists of lots provided.
+    def _highlights(loss_lots=None,
+                    split_off_loss_lots=None,
+                    replacement_lots=None,
+                    split_off_replacement_lots=None):
+        """Classifies the lots to highlight, so each lookup is a dict lookup.
 
         Args:
-            lot: A Lot to classify.
             loss_lots: A list of Lot objects.
             split_off_loss_lots: A list of Lot objects.
             replacement_lots: A list of Lot objects.
             split_off_replacement_lots: A list of Lot objects.
 
         Returns:
-            (characters, color) or ()
+            A dict from the id() of each lot in the lists to (characters,
+            color).
             characters: A string containing classification characters, like * .
             color: A string containing the color to highlight the lot as.
         """
-        characters = ''
-        color = ''
-        if loss_lots and id(lot) in list(map(id, loss_lots)):
-            characters += '*'
-            color = 'red'
-        elif split_off_loss_lots and id(lot) in list(map(id, split_off_loss_lots)):
-            characters += 'x'
-            color = 'magenta'
-        elif replacement_lots and id(lot) in list(map(id, replacement_lots)):
-            characters += 'o'
-            color = 'green'
-        elif split_off_replacement_lots and id(lot) in list(map(
-                id, split_off_replacement_lots)):
-            characters += '+'
-            color = 'blue'
-
-        if characters or color:
-            return (characters, color)
-        return ()
+        highlights = {}
+        for lots, style in reversed(list(zip(
+                [loss_lots, split_off_loss_lots, replacement_lots,
+                 split_off_replacement_lots], Lots._HIGHLIGHT_STYLES))):
+            for lot in lots or ():
+                highlights[id(lot)] = style
+        return highlights
+
+    @staticmethod
+    def _window(lots, highlights, window=None):
+        """Selects the highlighted lots and their neighbours.
+
+        If no lots are highlighted, all of them are shown.
+
+        Args:
+            lots: A list of Lot objects, in the order they are shown.
+            highlights: A dict from _highlights.
+            window: The number of lots to show on either side of each
+                highlighted lot, or None to show all of the lots.
+        Returns:
+            A list of the Lot objects to show, with the number of lots left
+            out in place of each gap.
+        """
+        if window is None or not highlights:
+            return lots
+        rows = []
+        end = 0
+        for index, lot in enumerate(lots):
+            if id(lot) not in highlights:
+                continue
+            start = max(index - window, end)
+            stop = min(index + window + 1, len(lots))
+            if start > end:
+                rows.append(start - end)
+            rows.extend(lots[start:stop])
+            end = max(end, stop)
+        if end < len(lots):
+            rows.append(len(lots) - end)
+        return rows
+
+    @staticmethod
+    def _gap_str(num_lots):
+        """Returns the line shown in place of lots left out of a window."""
+        return '... {} more lots'.format(num_lots)
 
     @staticmethod
     def _color_string(color, s):
@@ -459,7 +1106,8 @@ class Lots(object):
                             loss_lots=None,
                             split_off_loss_lots=None,
                             replacement_lots=None,
-                            split_off_replacement_lots=None):
+                            split_off_replacement_lots=None,
+                            window=None):
         """Generates an ASCII table of this Lots object.
 
         Any lots in the optional lists are highlighted.
@@ -469,19 +1117,24 @@ class Lots(object):
             split_off_loss_lots: A list of Lot objects.
             replacement_lots: A list of Lot objects.
             split_off_replacement_lots: A list of Lot objects.
+            window: The number of lots to show on either side of each
+                highlighted lot, or None to show all of the lots.
         Returns:
             A string representing this Lots object.
         """
-        # Make a shallow copy so that we can sort but id(lot) still works.
-        lots = copy.copy(self._lots)
-        lots.sort(key=cmp_to_key(Lot.cmp_by_original_buy_date))
+        highlights = Lots._highlights(loss_lots, split_off_loss_lots,
+                                      replacement_lots,
+                                      split_off_replacement_lots)
         lots_data = [[self.SHORT_HEADERS[field] for field in Lot.FIELD_NAMES]]
         lots_data[0].append('Matched')
-        for lot in lots:
+        for lot in Lots._window(self.ordered('original_buy_date'), highlights,
+                                window):
+            if isinstance(lot, int):
+                lots_data.append([Lots._gap_str(lot)] +
+                                 [''] * len(Lot.FIELD_NAMES))
+                continue
             str_data = lot.str_data()
-            classification = Lots._classify_lot(
-                lot, loss_lots, split_off_loss_lots, replacement_lots,
-                split_off_replacement_lots)
+            classification = highlights.get(id(lot))
             if classification:
                 str_data.append(classification[0])
                 color = classification[1]
@@ -495,17 +1148,20 @@ class Lots(object):
                     loss_lots=None,
                     split_off_loss_lots=None,
                     replacement_lots=None,
-                    split_off_replacement_lots=None):
-        # Make a shallow copy so that we can sort but id(lot) still works.
-        lots = copy.copy(self._lots)
-        lots.sort(key=cmp_to_key(Lot.cmp_by_original_buy_date))
+                    split_off_replacement_lots=None,
+                    window=None):
+        highlights = Lots._highlights(loss_lots, split_off_loss_lots,
+                                      replacement_lots,
+                                      split_off_replacement_lots)
         lot_strings = []
         lot_strings.append(' '.join([self.SHORT_HEADERS[field]
                                      for field in Lot.FIELD_NAMES]))
-        for lot in lots:
-            classification = Lots._classify_lot(
-                lot, loss_lots, split_off_loss_lots, replacement_lots,
-                split_off_replacement_lots)
+        for lot in Lots._window(self.ordered('original_buy_date'), highlights,
+                                window):
+            if isinstance(lot, int):
+                lot_strings.append(Lots._gap_str(lot))
+                continue
+            classification = highlights.get(id(lot))
             str_data = str(lot)
             if classification:
                 str_data = classification[0] + ' ' + str_data
@@ -517,7 +1173,7 @@ class Lots(object):
     __repl__ = __str__
 
     @staticmethod
-    def create_from_csv_data(data):
+    def create_from_csv_data(data, first_buy_lot=1):
         """Creates a Lots object based on a multi-line string of csv data.
 
         The first line of the csv file must contain headers, which are the
@@ -527,9 +1183,37 @@ class Lots(object):
         Args:
             data: A list of strings, where each line is a CSV row that matches
                     the format above
+            first_buy_lot: An integer, passed to the Lots constructor.
         Returns:
             A Lots object
         """
+        return Lots(list(Lots.iter_csv_data(data, first_buy_lot)))
+
+    @staticmethod
+    def iter_csv_data(data, first_buy_lot=1, on_error=None):
+        """Yields a Lot for each row of csv data, reading it as it goes.
+
+        The data is in the same format as for create_from_csv_data, and buy_lot
+        fields that are not set are populated the same way as the Lots
+        constructor does. Only one row is held at a time, so a file object can
+        be read lazily, however large it is.
+
+        Args:
+            data: An iterable of strings, where each is a CSV row.
+            first_buy_lot: An integer, the number to populate the first unset
+                buy_lot field with.
+            on_error: A function that is called with a BadRowError for each row
+                that can't be parsed, after which the row is skipped. If None,
+                the BadRowError is raised.
+        Yields:
+            Lot objects, in the order of the rows.
+        Raises:
+            BadHeadersError: If the header row is not Lots.HEADERS.
+            BadRowError: If a row can't be parsed and on_error is None.
+        """
+        # Exports repeat the same dates on many rows, so each distinct date
+        # string is only parsed once.
+        dates = {'': None, None: None}
 
         def convert_to_int(value):
             if value:
@@ -537,9 +1221,12 @@ class Lots(object):
             return 0
 
         def convert_to_date(value):
-            if value:
-                return datetime.datetime.strptime(value, '%m/%d/%Y').date()
-            return None
+            try:
+                return dates[value]
+            except KeyError:
+                date = datetime.datetime.strptime(value, '%m/%d/%Y').date()
+                dates[value] = date
+                return date
 
         def convert_to_bool(value):
             if value:
@@ -551,87 +1238,117 @@ class Lots(object):
                 return value.split('|')
             return []
 
-        reader = csv.DictReader(data, fieldnames=Lot.FIELD_NAMES)
-        header_row = next(reader)
-        if header_row != Lots.HEADERS:
-            raise BadHeadersError(str(header_row) + str(Lots.HEADERS))
-        lots = []
+        # The columns are checked against the headers once, and then read by
+        # position.
+        num_fields = len(Lot.FIELD_NAMES)
+        headers = [Lots.HEADERS[name] for name in Lot.FIELD_NAMES]
+        reader = csv.reader(data)
+        # An empty file has no header row, which is reported as bad headers.
+        header_row = next((row for row in reader if row), None)
+        if header_row != headers:
+            raise BadHeadersError(str(header_row) + str(headers))
+        i = first_buy_lot
         for row in reader:
-            row['num_shares'] = convert_to_int(row['num_shares'])
-            row['buy_date'] = convert_to_date(row['buy_date'])
-            row['adjusted_buy_date'] = convert_to_date(row['adjusted_buy_date'])
-            if not row['adjusted_buy_date']:
-                row['adjusted_buy_date'] = copy.deepcopy(row['buy_date'])
-            row['basis'] = convert_to_int(row['basis'])
-            row['adjusted_basis'] = convert_to_int(row['adjusted_basis'])
-            if not row['adjusted_basis']:
-                row['adjusted_basis'] = row['basis']
-            row['sell_date'] = convert_to_date(row['sell_date'])
-            row['proceeds'] = convert_to_int(row['proceeds'])
-            row['adjustment'] = convert_to_int(row['adjustment'])
-            row['replacement_for'] = convert_to_string_list(row[
-                'replacement_for'])
-            row['is_replacement'] = convert_to_bool(row['is_replacement'])
-            row['loss_processed'] = convert_to_bool(row['loss_processed'])
-            lots.append(Lot(**row))
-        return Lots(lots)
+            try:
+                if len(row) != num_fields:
+                    if not row:
+                        continue
+                    if len(row) > num_fields:
+                        raise BadRowError(
+                            reader.line_num,
+                            'expected {} columns, got {}'.format(num_fields,
+                                                                 len(row)))
+                    # Missing columns are read as unset, as csv.DictReader
+                    # did.
+                    row.extend([None] * (num_fields - len(row)))
+                (num_shares, symbol, description, buy_date, adjusted_buy_date,
+                 basis, adjusted_basis, sell_date, proceeds, adjustment_code,
+                 adjustment, form_position, buy_lot, replacement_for,
+                 is_replacement, loss_processed) = row
+                buy_date = convert_to_date(buy_date)
+                basis = convert_to_int(basis)
+                lot = Lot(convert_to_int(num_shares), symbol, description,
+                          buy_date,
+                          convert_to_date(adjusted_buy_date) or buy_date,
+                          basis, convert_to_int(adjusted_basis) or basis,
+                          convert_to_date(sell_date), convert_to_int(proceeds),
+                          adjustment_code, convert_to_int(adjustment),
+                          form_position, buy_lot,
+                          convert_to_string_list(replacement_for),
+                          convert_to_bool(is_replacement),
+                          convert_to_bool(loss_processed))
+            except BadRowError as e:
+                if on_error is None:
+                    raise
+                on_error(e)
+                continue
+            except ValueError as e:
+                if on_error is None:
+                    raise BadRowError(reader.line_num, e)
+                on_error(BadRowError(reader.line_num, e))
+                continue
+            if not buy_lot:
+                lot.buy_lot = '_{}'.format(i)
+                i += 1
+            yield lot
 
-    def write_csv_data(self, output_file):
-        """Writes this lots data as CSV data to an output file.
+    @staticmethod
+    def iter_csv_chunks(data, chunk_size, first_buy_lot=1, on_error=None):
+        """Yields Lots objects with up to chunk_size lots each from csv data.
+
+        Like iter_csv_data, but in batches, for stages that work on many lots
+        at once. Pass each chunk to lot_table.LotTable.from_lots for a
+        columnar chunk. Buy lots are numbered across chunks, as if the whole
+        file was read at once.
 
         Args:
-            output_file: A file-like object to write to.
+            data: An iterable of strings, where each is a CSV row.
+            chunk_size: A positive integer, the most lots in a chunk.
+            first_buy_lot: An integer, passed to iter_csv_data.
+            on_error: A function, passed to iter_csv_data.
+        Yields:
+            Lots objects, in the order of the rows.
         """
+        lot_iter = Lots.iter_csv_data(data, first_buy_lot, on_error)
+        while True:
+            chunk = list(itertools.islice(lot_iter, chunk_size))
+            if not chunk:
+                return
+            yield Lots(chunk)
 
-        def convert_from_int(value):
-            if value:
-                return str(value)
-            return ''
+    def save_snapshot(self, directory):
+        """Saves the lots as a binary columnar snapshot.
 
-        def convert_from_date(value):
-            if value:
-                return value.strftime('%m/%d/%Y')
-            return ''
+        Loading a snapshot is much faster than parsing csv data. See
+        lot_table.LotTable.save for the format.
 
-        def convert_from_bool(value):
-            if value:
-                return 'True'
-            return ''
+        Args:
+            directory: The path of a directory to save to.
+        """
+        # lot_table imports this module, so it is imported when it is used.
+        import lot_table as lot_table_lib
+        lot_table_lib.LotTable.from_lots(self).save(directory)
 
-        def convert_from_string_list(value):
-            if value:
-                return '|'.join(value)
-            return ''
+    @staticmethod
+    def load_snapshot(directory):
+        """Loads lots saved by save_snapshot.
 
-        writer = csv.DictWriter(output_file, fieldnames=Lot.FIELD_NAMES)
-        writer.writerow(self.HEADERS)
-        for lot in self._lots:
-            row = {}
-            row['num_shares'] = convert_from_int(lot.num_shares)
-            row['symbol'] = lot.symbol
-            row['description'] = lot.description
-            row['buy_date'] = convert_from_date(lot.buy_date)
-            if lot.buy_date == lot.adjusted_buy_date:
-                row['adjusted_buy_date'] = ''
-            else:
-                row['adjusted_buy_date'] = convert_from_date(
-                    lot.adjusted_buy_date)
-            row['basis'] = convert_from_int(lot.basis)
-            if lot.basis == lot.adjusted_basis:
-                row['adjusted_basis'] = ''
-            else:
-                row['adjusted_basis'] = convert_from_int(lot.adjusted_basis)
-            row['sell_date'] = convert_from_date(lot.sell_date)
-            row['proceeds'] = convert_from_int(lot.proceeds)
-            row['adjustment_code'] = lot.adjustment_code
-            row['adjustment'] = convert_from_int(lot.adjustment)
-            row['form_position'] = lot.form_position
-            row['buy_lot'] = lot.buy_lot
-            row['replacement_for'] = convert_from_string_list(
-                lot.replacement_for)
-            row['is_replacement'] = convert_from_bool(lot.is_replacement)
-            row['loss_processed'] = convert_from_bool(lot.loss_processed)
-            writer.writerow(row)
+        Args:
+            directory: The path of a directory that save_snapshot wrote to.
+        Returns:
+            A Lots object, with the lots in the order they were saved in.
+        """
+        import lot_table as lot_table_lib
+        return lot_table_lib.LotTable.load(directory).to_lots()
+
+    def write_csv_data(self, output_file):
+        """Writes this lots data as CSV data to an output file.
+
+        Args:
+            output_file: A file-like object to write to.
+        """
+        with LotWriter(output_file) as writer:
+            writer.write_all(self._lots)
 
     # =============================================================================
     # Tax-related calculations
@@ -639,6 +1356,7 @@ class Lots(object):
     @staticmethod
     def add_lot_gains_to_port(lot_gains, port_gains):
         """ Add lot gains to portfolio, for each field, take care of nan's"""
+        import numpy as np
         port_gains1 = port_gains.copy()
     
         for k in lot_gains:
@@ -655,18 +1373,148 @@ class Lots(object):
         Calculate realized and unrealized gains for a portfolio of lots, 
         split into short-term and long-term.
         If price or date are not not given, we don't calculate unrealized gains
-        Loop over all lots and sum the results.
+        The result is the sum of Lot.calc_gains over all lots, but the lots
+        are read into columns once and summed with calc_column_gains.
 
         Return a dictionary with keys: r_st, r_lt, u_st, u_lt (GAINS_CODES)
         (realized/unrealized, Short/Long-term)
         """
-        
-        # Set values to defaults
-        port_gains = dict.fromkeys(Lot.GAINS_CODES, np.nan)
-        
-        for lot in self._lots:
-            lot_gains = lot.calc_gains(date=date, price=price)
-            port_gains = Lots.add_lot_gains_to_port(lot_gains, port_gains)
-                    
-        return port_gains
-    
\ No newline at end of file
+        return calc_column_gains(*self._gains_columns(), date=date,
+                                 price=price)
+
+    def is_long_term(self, date=None):
+        """
+        Classify every lot as short or long term, like Lot.is_long_term.
+
+        The holding period thresholds are computed for all lots in a few
+        array operations, rather than with a relativedelta per lot.
+
+        Args:
+            date: A datetime.date to classify unsold lots as of, or None to
+                classify them all as short term.
+        Returns:
+            A bool array with a value per lot, in the order of lots(). True
+            for lots that get long-term treatment.
+        """
+        import numpy as np
+        lots = self._lots
+        long_term_after = _one_year_after(_date_column(
+            [lot.adjusted_buy_date or lot.buy_date for lot in lots]))
+        end = _date_column([lot.sell_date for lot in lots])
+        if date is not None:
+            end[np.isnat(end)] = np.datetime64(date, 'D')
+        # NaT compares as False, so lots with no end date are short term.
+        return end > long_term_after
+
+    def calc_gains_series(self, dates, prices):
+        """
+        Calculate the gains of the lots at each of a series of dates and
+        prices, e.g. a daily price history.
+
+        Row i of the result is the same as calc_gains(dates[i], prices[i]),
+        but the lots are read and their long-term threshold dates computed
+        once for the whole series. See calc_column_gains_series.
+
+        Args:
+            dates: A sequence of datetime.date objects, or a datetime64 array.
+            prices: A sequence of prices, the same length as dates.
+        Returns:
+            A float array with a row per date and a column per code in
+            GAINS_CODES. A code that no lot has a gain of is NaN.
+        """
+        return calc_column_gains_series(*self._gains_columns(), dates=dates,
+                                        prices=prices)
+
+    def _gains_columns(self):
+        """Returns the lot columns that calc_column_gains takes."""
+        import numpy as np
+        lots = self._lots
+        return (
+            np.array([lot.num_shares for lot in lots], dtype=np.int64),
+            np.array([lot.adjusted_basis for lot in lots], dtype=np.int64),
+            np.array([lot.proceeds for lot in lots], dtype=np.int64),
+            _date_column([lot.adjusted_buy_date or lot.buy_date
+                          for lot in lots]),
+            _date_column([lot.sell_date for lot in lots]),
+            np.array([lot.adjustment_code == 'W' for lot in lots], dtype=bool))
+
+
+
+#%% class LotWriter
+class LotWriter(object):
+    """Writes lots as CSV data, in the format read by Lots.iter_csv_data.
+
+    Lots can be written as they are ready, e.g. by wash.wash_stream, rather
+    than all at once. Rows are formatted by position and buffered, and written
+    to the file in batches of batch_size rows. Call flush, or use the writer
+    as a context manager, to write the last batch.
+
+        with LotWriter(output_file) as writer:
+            for lot in lots:
+                writer.write(lot)
+    """
+
+    def __init__(self, output_file, batch_size=4096):
+        """Writes the CSV headers.
+
+        Args:
+            output_file: A file-like object to write to.
+            batch_size: An integer, the number of rows to buffer before they
+                are written.
+        """
+        self._writer = csv.writer(output_file)
+        self._writer.writerow([Lots.HEADERS[name] for name in Lot.FIELD_NAMES])
+        self._batch_size = batch_size
+        self._rows = []
+        # Formatted date strings, since many lots share the same dates.
+        self._dates = {None: ''}
+
+    def _format_date(self, date):
+        try:
+            return self._dates[date]
+        except KeyError:
+            value = date.strftime('%m/%d/%Y')
+            self._dates[date] = value
+            return value
+
+    def write(self, lot):
+        """Buffers a Lot to be written as a CSV row."""
+        format_date = self._format_date
+        self._rows.append([
+            str(lot.num_shares) if lot.num_shares else '',
+            lot.symbol,
+            lot.description,
+            format_date(lot.buy_date),
+            ('' if lot.buy_date == lot.adjusted_buy_date else
+             format_date(lot.adjusted_buy_date)),
+            str(lot.basis) if lot.basis else '',
+            ('' if lot.basis == lot.adjusted_basis or not lot.adjusted_basis
+             else str(lot.adjusted_basis)),
+            format_date(lot.sell_date),
+            str(lot.proceeds) if lot.proceeds else '',
+            lot.adjustment_code,
+            str(lot.adjustment) if lot.adjustment else '',
+            lot.form_position,
+            lot.buy_lot,
+            '|'.join(lot.replacement_for),
+            'True' if lot.is_replacement else '',
+            'True' if lot.loss_processed else '',
+        ])
+        if len(self._rows) >= self._batch_size:
+            self.flush()
+
+    def write_all(self, lots):
+        """Buffers each Lot in an iterable of lots."""
+        for lot in lots:
+            self.write(lot)
+
+    def flush(self):
+        """Writes the buffered rows to the file."""
+        self._writer.writerows(self._rows)
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
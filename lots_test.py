@@ -55,6 +55,65 @@ class TestLots(unittest.TestCase):
         expected_lots = lots_lib.Lots(expected_lots_rows)
         self.assertSameLots(lots, expected_lots)
 
+    def test_parse_blank_lines_and_short_rows(self):
+        csv_data = [
+            'Num Shares,Symbol,Description,Buy Date,Adjusted Buy Date,Basis,'
+            'Adjusted Basis,Sell Date,Proceeds,Adjustment Code,Adjustment,'
+            'Form Position,Buy Lot,Replacement For,Is Replacement,'
+            'Loss Processed',
+            '',
+            '10,ABC,A,9/15/2014,,2000,,10/5/2014,1800',
+            '20,ABC,A,9/15/2014,,3000,,,,,,,,,,',
+        ]
+        lots = lots_lib.Lots.create_from_csv_data(csv_data)
+        self.assertEqual(2, lots.size())
+        first, second = lots.lots()
+        self.assertEqual(datetime.date(2014, 10, 5), first.sell_date)
+        self.assertEqual(1800, first.proceeds)
+        self.assertEqual(0, first.adjustment)
+        self.assertEqual([], first.replacement_for)
+        self.assertEqual('_1', first.buy_lot)
+        self.assertEqual(datetime.date(2014, 9, 15), second.adjusted_buy_date)
+        self.assertIsNone(second.sell_date)
+        self.assertEqual('_2', second.buy_lot)
+
+    def test_parse_bad_rows(self):
+        csv_data = [
+            'Num Shares,Symbol,Description,Buy Date,Adjusted Buy Date,Basis,'
+            'Adjusted Basis,Sell Date,Proceeds,Adjustment Code,Adjustment,'
+            'Form Position,Buy Lot,Replacement For,Is Replacement,'
+            'Loss Processed',
+            '10,ABC,A,9/15/2014,,2000,,,,,,,,,,',
+            'ten,ABC,A,9/15/2014,,2000,,,,,,,,,,',
+            '10,ABC,A,9/31/2014,,2000,,,,,,,,,,',
+            '10,ABC,A,9/15/2014,,2000,,,,,,,,,,,extra',
+            '20,ABC,A,9/16/2014,,3000,,,,,,,,,,',
+        ]
+        with self.assertRaises(lots_lib.BadRowError) as context:
+            list(lots_lib.Lots.iter_csv_data(csv_data))
+        self.assertEqual(3, context.exception.line_num)
+
+        errors = []
+        lots = list(lots_lib.Lots.iter_csv_data(csv_data,
+                                                on_error=errors.append))
+        self.assertEqual([3, 4, 5], [error.line_num for error in errors])
+        self.assertEqual([10, 20], [lot.num_shares for lot in lots])
+        self.assertEqual(['_1', '_2'], [lot.buy_lot for lot in lots])
+
+    def test_iter_csv_chunks(self):
+        csv_data = [
+            'Num Shares,Symbol,Description,Buy Date,Adjusted Buy Date,Basis,'
+            'Adjusted Basis,Sell Date,Proceeds,Adjustment Code,Adjustment,'
+            'Form Position,Buy Lot,Replacement For,Is Replacement,'
+            'Loss Processed',
+        ] + ['{},ABC,A,9/15/2014,,2000,,,,,,,,,,'.format(i)
+             for i in range(1, 6)]
+        chunks = list(lots_lib.Lots.iter_csv_chunks(csv_data, 2))
+        self.assertEqual([[1, 2], [3, 4], [5]],
+                         [[lot.num_shares for lot in chunk]
+                          for chunk in chunks])
+        self.assertEqual('_5', chunks[-1].lots()[0].buy_lot)
+
     def test_parse_invalid_headers(self):
         csv_data = [
             'Num,Symbol,Description,Buy Date,Basis,Sell Date,'
@@ -65,6 +124,11 @@ class TestLots(unittest.TestCase):
         with self.assertRaises(lots_lib.BadHeadersError):
             lots = lots_lib.Lots.create_from_csv_data(csv_data)
 
+    def test_parse_empty_file(self):
+        for csv_data in (io.StringIO(''), io.StringIO('\n\n')):
+            with self.assertRaises(lots_lib.BadHeadersError):
+                list(lots_lib.Lots.iter_csv_data(csv_data))
+
     def test_write_csv_data(self):
         lots_rows = []
         lots_rows.append(lots_lib.Lot(
@@ -99,6 +163,22 @@ class TestLots(unittest.TestCase):
             [line.rstrip()
              for line in actual_output.readlines()], expected_csv_data)
 
+    def test_lot_writer_writes_in_batches(self):
+        lot = lots_lib.Lot(10, 'ABC', 'A', datetime.date(2014, 9, 15),
+                           datetime.date(2014, 9, 15), 2000, 2000, None, 0, '',
+                           0, '', 'lot1', [], False, False)
+        output = io.StringIO()
+        writer = lots_lib.LotWriter(output, batch_size=2)
+        writer.write(lot)
+        self.assertEqual(1, len(output.getvalue().splitlines()))
+        writer.write(lot)
+        self.assertEqual(3, len(output.getvalue().splitlines()))
+        writer.write(lot)
+        writer.flush()
+        self.assertEqual(
+            ['10,ABC,A,09/15/2014,,2000,,,,,,,lot1,,,'] * 3,
+            output.getvalue().splitlines()[1:])
+
     def test_load_then_write_csv_data(self):
         csv_data = [
             'Num Shares,Symbol,Description,Buy Date,Adjusted Buy Date,Basis,'
@@ -335,6 +415,259 @@ class TestLots(unittest.TestCase):
         other_lots.lots()[0].num_shares = 2
         self.assertFalse(lots.contents_equal(other_lots))
 
+        other_lots = copy.deepcopy(lots)
+        other_lots.add(other_lots.lots()[0].clone())
+        self.assertFalse(lots.contents_equal(other_lots))
+
+    def test_equal_as_multisets(self):
+        lot = lots_lib.Lot(1, '', '', datetime.date(2014, 9, 2),
+            datetime.date(2014, 9, 2), 0, 0, datetime.date(2014, 11, 5), 0, '',
+            0, 'form2', '', ['_1'], False, False)
+        other = lots_lib.Lot(5, '', '', datetime.date(2014, 9, 1),
+            datetime.date(2014, 9, 1), 0, 0, None, 0, '', 0, 'form1', '', [],
+            False, False)
+        self.assertEqual(lot.key(), copy.deepcopy(lot).key())
+        self.assertNotEqual(lot.key(), other.key())
+
+        self.assertEqual(lots_lib.Lots([lot, other]),
+                         lots_lib.Lots([other.clone(), lot.clone()]))
+        self.assertNotEqual(lots_lib.Lots([lot, lot, other]),
+                            lots_lib.Lots([lot, other, other]))
+
+    def test_diff(self):
+        def create_lot(num_shares, buy_day, form_position):
+            return lots_lib.Lot(num_shares, 'ABC', '',
+                                datetime.date(2014, 9, buy_day),
+                                datetime.date(2014, 9, buy_day), 100, 100,
+                                None, 0, '', 0, form_position, '', [], False,
+                                False)
+
+        same = create_lot(10, 1, 'form1')
+        changed = create_lot(10, 2, 'form2')
+        removed = create_lot(10, 3, 'form3')
+        old = lots_lib.Lots([same, changed, removed])
+
+        new_changed = changed.clone()
+        new_changed.adjusted_basis = 150
+        added = create_lot(5, 4, 'form4')
+        new = lots_lib.Lots([added, new_changed, same.clone()])
+
+        diff = old.diff(new)
+        self.assertEqual([added], diff.added)
+        self.assertEqual([removed], diff.removed)
+        self.assertEqual(1, len(diff.modified))
+        self.assertIs(changed, diff.modified[0][0])
+        self.assertIs(new_changed, diff.modified[0][1])
+
+        self.assertEqual(lots_lib.LotsDiff([], [], []), old.diff(old.clone()))
+
+    def test_bought_between(self):
+        def make_lot(buy_day, sell_day=None, form_position=''):
+            sell_date = None
+            if sell_day:
+                sell_date = datetime.date(2014, 10, sell_day)
+            return lots_lib.Lot(1, '', '', datetime.date(2014, 9, buy_day),
+                datetime.date(2014, 9, buy_day), 0, 0, sell_date, 0, '', 0,
+                form_position, '', [], False, False)
+
+        unsold = make_lot(2)
+        sold_late = make_lot(2, 20)
+        sold_early = make_lot(2, 10)
+        too_early = make_lot(1, 10)
+        last = make_lot(5, 1)
+        too_late = make_lot(6, 1)
+        lots = lots_lib.Lots([too_late, unsold, sold_late, last, too_early,
+                              sold_early])
+        start = datetime.date(2014, 9, 2)
+        end = datetime.date(2014, 9, 5)
+        self.assertEqual(
+            [sold_early, sold_late, unsold, last],
+            list(lots.bought_between(start, end)))
+
+        # Lots added after the index is built are included in order.
+        added = make_lot(3, 1, 'form1')
+        lots.add(added)
+        self.assertEqual(
+            [sold_early, sold_late, unsold, added, last],
+            list(lots.bought_between(start, end)))
+
+    def test_windowed_str(self):
+        lot_list = [lots_lib.Lot(1, '', '', datetime.date(2014, 9, day),
+                                 datetime.date(2014, 9, day), 0, 0, None, 0,
+                                 '', 0, 'form{}'.format(day), '', [], False,
+                                 False)
+                    for day in range(1, 11)]
+        lots = lots_lib.Lots(list(reversed(lot_list)))
+        loss, replacement = lot_list[1], lot_list[8]
+        lines = lots._simple_str(loss_lots=[loss],
+                                 replacement_lots=[replacement, loss],
+                                 window=1).split('\n')
+        self.assertEqual(
+            [' '.join(lots_lib.Lots.SHORT_HEADERS[field]
+                      for field in lots_lib.Lot.FIELD_NAMES),
+             str(lot_list[0]), '* ' + str(loss), str(lot_list[2]),
+             '... 4 more lots',
+             str(lot_list[7]), 'o ' + str(replacement), str(lot_list[9])],
+            lines)
+
+        # Windows that overlap are merged, and unhighlighted lots are all shown.
+        lines = lots._simple_str(loss_lots=[lot_list[3], lot_list[5]],
+                                 window=1).split('\n')
+        self.assertEqual('... 2 more lots', lines[1])
+        self.assertEqual('* ' + str(lot_list[5]), lines[5])
+        self.assertEqual('... 3 more lots', lines[7])
+        self.assertEqual(len(lot_list) + 1,
+                         len(lots._simple_str(window=1).split('\n')))
+        self.assertEqual(lots._simple_str(loss_lots=[loss]).split('\n')[1:],
+                         [('* ' if lot is loss else '') + str(lot)
+                          for lot in lot_list])
+
+    def test_clone(self):
+        lot = lots_lib.Lot(10, 'ABC', 'A', datetime.date(2014, 9, 15),
+                           datetime.date(2014, 9, 14), 2000, 2100,
+                           datetime.date(2014, 10, 5), 1800, 'W', 200,
+                           'form1', 'lot1', ['lot3'], True, True)
+        clone = lot.clone()
+        self.assertIsNot(lot, clone)
+        self.assertEqual(lot, clone)
+        self.assertEqual(1, lots_lib.Lot.cmp_by_sell_date(clone, lot))
+
+        clone.replacement_for.append('lot4')
+        self.assertEqual(['lot3'], lot.replacement_for)
+        self.assertEqual(lot, copy.deepcopy(lot))
+
+    def test_comparators_break_ties_by_lot_number(self):
+        def make_lot():
+            return lots_lib.Lot(1, '', '', datetime.date(2014, 9, 2),
+                datetime.date(2014, 9, 2), 0, 0, None, 0, '', 0, '', '', [],
+                False, False)
+        first = make_lot()
+        second = make_lot()
+        for cmp in (lots_lib.Lot.cmp_by_buy_date,
+                    lots_lib.Lot.cmp_by_original_buy_date,
+                    lots_lib.Lot.cmp_by_sell_date):
+            self.assertEqual(-1, cmp(first, second))
+            self.assertEqual(1, cmp(second, first))
+            self.assertEqual(0, cmp(first, first))
+
+    def test_ordered_matches_comparators(self):
+        lots_rows = []
+        for buy_day, adjusted_buy_day, sell_day, form_position in [
+                (2, 2, 5, 'form2'), (1, 9, 5, 'form1'), (2, 2, None, 'form1'),
+                (2, 1, 5, 'form1'), (3, 3, 6, ''), (2, 2, 5, 'form2')]:
+            sell_date = None
+            if sell_day:
+                sell_date = datetime.date(2014, 10, sell_day)
+            lots_rows.append(lots_lib.Lot(1, '', '',
+                datetime.date(2014, 9, buy_day),
+                datetime.date(2014, 9, adjusted_buy_day), 0, 0, sell_date, 0,
+                '', 0, form_position, '', [], False, False))
+        lots = lots_lib.Lots(list(lots_rows))
+        for order, cmp in [('buy_date', lots_lib.Lot.cmp_by_buy_date),
+                           ('original_buy_date',
+                            lots_lib.Lot.cmp_by_original_buy_date),
+                           ('sell_date', lots_lib.Lot.cmp_by_sell_date)]:
+            expected = sorted(lots_rows, key=cmp_to_key(cmp))
+            actual = lots.ordered(order)
+            self.assertEqual(list(map(id, expected)), list(map(id, actual)))
+
+    def test_ordered_is_cached_until_a_keyed_field_changes(self):
+        first = lots_lib.Lot(1, '', '', datetime.date(2014, 9, 2),
+            datetime.date(2014, 9, 2), 0, 0, None, 0, '', 0, '', '', [],
+            False, False)
+        second = lots_lib.Lot(1, '', '', datetime.date(2014, 9, 3),
+            datetime.date(2014, 9, 3), 0, 0, None, 0, '', 0, '', '', [],
+            False, False)
+        lots = lots_lib.Lots([second, first])
+        by_buy_date = lots.ordered('buy_date')
+        by_original_buy_date = lots.ordered('original_buy_date')
+        self.assertIs(by_buy_date, lots.ordered('buy_date'))
+
+        # Changing a field that is not part of the order keeps the cache.
+        first.num_shares = 5
+        self.assertIs(by_buy_date, lots.ordered('buy_date'))
+
+        first.adjusted_buy_date = datetime.date(2014, 9, 4)
+        self.assertIsNot(by_buy_date, lots.ordered('buy_date'))
+        self.assertEqual([id(second), id(first)],
+                         list(map(id, lots.ordered('buy_date'))))
+        self.assertIs(by_original_buy_date, lots.ordered('original_buy_date'))
+
+    def test_ordered_is_only_stale_when_its_own_lots_change(self):
+        def make_lots():
+            return lots_lib.Lots([lots_lib.Lot(1, '', '',
+                datetime.date(2014, 9, day), datetime.date(2014, 9, day), 0, 0,
+                None, 0, '', 0, '', '', [], False, False) for day in (3, 2)])
+
+        lots = make_lots()
+        by_buy_date = lots.ordered('buy_date')
+        other_lots = make_lots()
+        other_lots.lots()[0].adjusted_buy_date = datetime.date(2014, 9, 4)
+        clone = lots.clone()
+        clone.lots()[0].adjusted_buy_date = datetime.date(2014, 9, 4)
+        self.assertIs(by_buy_date, lots.ordered('buy_date'))
+
+        # Lots shared with a partition are still watched.
+        partition = lots.partition(lambda lot: lot.buy_date.day)[0]
+        partition.lots()[0].adjusted_buy_date = datetime.date(2014, 9, 1)
+        self.assertIsNot(by_buy_date, lots.ordered('buy_date'))
+        self.assertEqual([datetime.date(2014, 9, 1), datetime.date(2014, 9, 2)],
+                         [lot.adjusted_buy_date
+                          for lot in lots.ordered('buy_date')])
+
+        # So are lots from another Lots object that are added.
+        by_buy_date = lots.ordered('buy_date')
+        added = other_lots.lots()[1]
+        lots.add(added)
+        self.assertEqual(added, lots.ordered('buy_date')[-1])
+        added.adjusted_buy_date = datetime.date(2014, 8, 1)
+        self.assertIs(added, lots.ordered('buy_date')[0])
+
+        # And lots from several Lots objects that are merged into a new one.
+        by_buy_date = other_lots.ordered('buy_date')
+        merged = lots_lib.Lots(lots.lots() + other_lots.lots()[:1])
+        merged_by_buy_date = merged.ordered('buy_date')
+        other_lots.lots()[0].adjusted_buy_date = datetime.date(2014, 7, 1)
+        self.assertIsNot(by_buy_date, other_lots.ordered('buy_date'))
+        self.assertIsNot(merged_by_buy_date, merged.ordered('buy_date'))
+        self.assertIs(other_lots.lots()[0], merged.ordered('buy_date')[0])
+
+    def test_sort_by(self):
+        first = lots_lib.Lot(1, '', '', datetime.date(2014, 9, 2),
+            datetime.date(2014, 9, 2), 0, 0, datetime.date(2014, 10, 6), 0, '',
+            0, '', '', [], False, False)
+        second = lots_lib.Lot(1, '', '', datetime.date(2014, 9, 3),
+            datetime.date(2014, 9, 3), 0, 0, datetime.date(2014, 10, 5), 0, '',
+            0, '', '', [], False, False)
+        lots = lots_lib.Lots([first])
+        lots.sort_by('sell_date')
+        lots.add(second)
+        lots.sort_by('sell_date')
+        self.assertEqual([id(second), id(first)], list(map(id, lots.lots())))
+        lots.sort_by('original_buy_date')
+        self.assertEqual([id(first), id(second)], list(map(id, lots.lots())))
+
+    def test_remove(self):
+        def make_lot(buy_day):
+            return lots_lib.Lot(1, '', '', datetime.date(2014, 9, buy_day),
+                datetime.date(2014, 9, buy_day), 0, 0, None, 0, '', 0, '', '',
+                [], False, False)
+        first = make_lot(3)
+        equal_to_first = make_lot(3)
+        second = make_lot(4)
+        lots = lots_lib.Lots([first, second, equal_to_first])
+        lots.ordered('original_buy_date')
+        lots.remove(equal_to_first)
+        self.assertEqual([id(first), id(second)], list(map(id, lots.lots())))
+        self.assertEqual([id(first), id(second)],
+                         list(map(id, lots.ordered('original_buy_date'))))
+        self.assertEqual([id(first), id(second)],
+                         list(map(id, lots.bought_between(
+                             datetime.date(2014, 9, 1),
+                             datetime.date(2014, 9, 30)))))
+        with self.assertRaises(ValueError):
+            lots.remove(equal_to_first)
+
 #%% Test tax-related calculations for a single lot
 class TestLotGains(unittest.TestCase):
     def test_is_long_term(self):
@@ -396,6 +729,20 @@ class TestLotGains(unittest.TestCase):
         self.assertFalse(shortterm_lot4.is_long_term(t))
         self.assertFalse(shortterm_lot4.is_long_term())
                 
+    def test_long_term_after_is_reset_by_wash(self):
+        """ Test that moving the adjusted buy date moves the threshold """
+        lot = lots_lib.Lot(10, 'ABC', 'A', datetime.date(2022, 1, 2),
+                           datetime.date(2022, 1, 2), 2000, 2000,
+                           None, 0, '', 0, 'form1', 'lot1', [], False, False)
+        t = datetime.date(2023, 1, 2)
+        self.assertEqual(datetime.date(2023, 1, 2), lot.long_term_after())
+        self.assertFalse(lot.is_long_term(t))
+
+        lot.adjusted_buy_date -= datetime.timedelta(days=10)
+        self.assertEqual(datetime.date(2022, 12, 23), lot.long_term_after())
+        self.assertTrue(lot.is_long_term(t))
+        self.assertEqual(lot.long_term_after(), lot.clone().long_term_after())
+
     def test_calc_gains(self):
     
         
@@ -575,6 +922,101 @@ class TestLotsGains(unittest.TestCase):
         expected = np.where(np.isnan(exp_per_lot).all(axis=0),np.nan, expected)
         self.assertTrue(test_dict_vs_vals(expected, gains))           
 
+    def test_calc_gains_matches_lot_gains(self):
+        """ Test that the vectorized sum matches summing Lot.calc_gains """
+        lots_rows = [
+            # Bought on Feb 29, so long term starts on Mar 1 the next year.
+            lots_lib.Lot(10, 'ABC', 'A', datetime.date(2020, 2, 29),
+                         datetime.date(2020, 2, 29), 2000, 2000,
+                         datetime.date(2021, 3, 1), 2500, '', 0,
+                         'form1', '_1', [], False, False),
+            lots_lib.Lot(10, 'ABC', 'A', datetime.date(2020, 2, 29),
+                         datetime.date(2020, 2, 29), 2000, 2000,
+                         datetime.date(2021, 2, 28), 2500, '', 0,
+                         'form1', '_2', [], False, False),
+            # A washed loss is left out.
+            lots_lib.Lot(10, 'ABC', 'A', datetime.date(2020, 1, 15),
+                         datetime.date(2020, 1, 15), 2000, 2000,
+                         datetime.date(2020, 6, 1), 1500, 'W', 500,
+                         'form1', '_3', [], False, True),
+            # The adjusted buy date makes this replacement long term.
+            lots_lib.Lot(10, 'ABC', 'A', datetime.date(2020, 6, 15),
+                         datetime.date(2019, 11, 1), 2000, 2500,
+                         None, 0, '', 0, 'form1', '_4', [], True, False),
+            lots_lib.Lot(5, 'ABC', 'A', datetime.date(2020, 9, 1),
+                         datetime.date(2020, 9, 1), 1000, 1000,
+                         None, 0, '', 0, 'form1', '_5', [], False, False),
+        ]
+        lots = lots_lib.Lots(lots_rows)
+        for t, p in [(None, None), (datetime.date(2020, 12, 1), 300),
+                     (datetime.date(2021, 9, 2), 150.5)]:
+            expected = dict.fromkeys(lots_lib.Lot.GAINS_CODES, np.nan)
+            for lot in lots_rows:
+                expected = lots_lib.Lots.add_lot_gains_to_port(
+                    lot.calc_gains(date=t, price=p), expected)
+            gains = lots.calc_gains(date=t, price=p)
+            self.assertEqual(lots_lib.Lot.GAINS_CODES, list(gains))
+            self.assertTrue(test_dict_vs_vals(
+                [expected[k] for k in lots_lib.Lot.GAINS_CODES], gains))
+
+        self.assertTrue(test_dict_vs_vals(
+            [np.nan] * 4, lots_lib.Lots([]).calc_gains(
+                date=datetime.date(2021, 1, 1), price=100)))
+
+    def test_is_long_term(self):
+        """ Test that the bulk classifier matches Lot.is_long_term """
+        lots_rows = [
+            lots_lib.Lot(10, 'ABC', 'A', datetime.date(2020, 2, 29),
+                         datetime.date(2020, 2, 29), 2000, 2000,
+                         datetime.date(2021, 3, 1), 2500, '', 0,
+                         'form1', '_1', [], False, False),
+            lots_lib.Lot(10, 'ABC', 'A', datetime.date(2020, 2, 29),
+                         datetime.date(2020, 2, 29), 2000, 2000,
+                         datetime.date(2021, 2, 28), 2500, '', 0,
+                         'form1', '_2', [], False, False),
+            lots_lib.Lot(10, 'ABC', 'A', datetime.date(2020, 6, 15),
+                         datetime.date(2019, 11, 1), 2000, 2500,
+                         None, 0, '', 0, 'form1', '_3', [], True, False),
+            lots_lib.Lot(5, 'ABC', 'A', datetime.date(2020, 9, 1),
+                         None, 1000, 1000,
+                         None, 0, '', 0, 'form1', '_4', [], False, False),
+        ]
+        lots = lots_lib.Lots(lots_rows)
+        for t in [None, datetime.date(2020, 11, 1), datetime.date(2020, 11, 2),
+                  datetime.date(2021, 9, 2)]:
+            self.assertEqual([lot.is_long_term(t) for lot in lots_rows],
+                             lots.is_long_term(t).tolist())
+
+    def test_calc_gains_series(self):
+        """ Test that each row of the series matches calc_gains """
+        lots = lots_lib.Lots([
+            lots_lib.Lot(10, 'ABC', 'A', datetime.date(2020, 2, 29),
+                         datetime.date(2020, 2, 29), 2000, 2000,
+                         None, 0, '', 0, 'form1', '_1', [], False, False),
+            lots_lib.Lot(5, 'ABC', 'A', datetime.date(2020, 6, 15),
+                         datetime.date(2019, 11, 1), 1000, 1300,
+                         None, 0, '', 0, 'form1', '_2', [], True, False),
+            lots_lib.Lot(10, 'ABC', 'A', datetime.date(2020, 1, 15),
+                         datetime.date(2020, 1, 15), 2000, 2000,
+                         datetime.date(2020, 6, 1), 1500, '', 0,
+                         'form1', '_3', [], False, False),
+        ])
+        # Before, on and after the days that the unsold lots become long term.
+        dates = [datetime.date(2020, 3, 1), datetime.date(2020, 11, 1),
+                 datetime.date(2020, 11, 2), datetime.date(2021, 2, 28),
+                 datetime.date(2021, 3, 1)]
+        prices = [150, 210, 190, 250, 300]
+        series = lots.calc_gains_series(dates, prices)
+        self.assertEqual((len(dates), len(GAINS_CODES)), series.shape)
+        for row, t, p in zip(series, dates, prices):
+            self.assertTrue(test_dict_vs_vals(
+                row, lots.calc_gains(date=t, price=p)))
+
+        self.assertEqual((0, len(GAINS_CODES)),
+                         lots.calc_gains_series([], []).shape)
+        with self.assertRaises(ValueError):
+            lots.calc_gains_series(dates, prices[:-1])
+
 #%% Entry point
 if __name__ == '__main__':
     unittest.main()
@@ -1,8 +1,38 @@
 import lots as lots_lib
 import wash as wash_lib
 
-from functools import cmp_to_key
+import argparse
+import concurrent.futures
 import os
+import sys
+
+
+def diff_lots(actual, expected):
+    """Describes how one set of lots differs from another.
+
+    Lots that are equal in both sets are left out. The rest are paired up by
+    Lot.IDENTITY_FIELDS, and each pair is reported as a changed lot with the
+    fields that differ. Lots that can't be paired are reported as missing or
+    extra. See Lots.diff.
+
+    Args:
+        actual: A Lots object, the washed lots.
+        expected: A Lots object, the lots that the wash should give.
+    Returns:
+        A list of strings, one per difference. Empty if the lots are equal.
+    """
+    diff = expected.diff(actual)
+    differences = []
+    for expected_lot, actual_lot in diff.modified:
+        changes = ['{}: expected {}, got {}'.format(
+            field, getattr(expected_lot, field), getattr(actual_lot, field))
+            for field in lots_lib.Lot.FIELD_NAMES
+            if getattr(expected_lot, field) != getattr(actual_lot, field)]
+        differences.append('Changed lot {}: {}'.format(
+            expected_lot, '; '.join(changes)))
+    differences.extend('Missing lot {}'.format(lot) for lot in diff.removed)
+    differences.extend('Extra lot {}'.format(lot) for lot in diff.added)
+    return differences
 
 
 def run_test(infile, outfile):
@@ -11,31 +41,72 @@ def run_test(infile, outfile):
     Args:
         infile: Input filename.
         outfile: Expected output filename.
+    Returns:
+        A list of strings describing how the washed lots differ from the
+        expected ones. Empty if the test passed.
     """
-    lots = lots_lib.Lots.create_from_csv_data(open(infile))
+    with open(infile) as f:
+        lots = lots_lib.Lots.create_from_csv_data(f)
     wash_lib.wash_all_lots(lots)
-    expected = lots_lib.Lots.create_from_csv_data(open(outfile))
-    lots.sort(key=cmp_to_key(lots_lib.Lot.cmp_by_buy_date))
-    expected.sort(key=cmp_to_key(lots_lib.Lot.cmp_by_buy_date))
-    if not lots.contents_equal(expected):
-        print('Test failed: {}'.format(infile))
-        print('Got result:')
-        lots.do_print()
-        print('Expected:')
-        expected.do_print()
-        print('\n\n')
-    else:
-        print("Test passed: {}".format(infile))
+    with open(outfile) as f:
+        expected = lots_lib.Lots.create_from_csv_data(f)
+    return diff_lots(lots, expected)
+
+
+def _run_test_case(test_case):
+    """Runs run_test for an (infile, outfile) tuple in a worker process.
+
+    Returns:
+        The differences from run_test, or a list with the error that stopped
+        the test.
+    """
+    try:
+        return run_test(*test_case)
+    except Exception as e:
+        return ['Error: {}: {}'.format(type(e).__name__, e)]
+
+
+def find_tests(tests_dir):
+    """Returns the (infile, outfile) pair of each test in tests_dir.
+
+    A test is a file named name.csv, with the expected output in
+    name_out.csv.
+    """
+    return [(os.path.join(tests_dir, name),
+             os.path.join(tests_dir, name.rsplit('.', 1)[0] + '_out.csv'))
+            for name in sorted(os.listdir(tests_dir))
+            if name.endswith('.csv') and not name.endswith('_out.csv')]
 
 
 def main():
-    tests_dir = os.path.join(os.getcwd(), 'tests')
-    tests = [name
-             for name in os.listdir(tests_dir)
-             if name.endswith('.csv') and not name.endswith('_out.csv')]
-    for test in tests:
-        run_test(os.path.join(tests_dir, test),
-             os.path.join(tests_dir, test.rsplit('.', 1)[0] + "_out.csv"))
+    parser = argparse.ArgumentParser()
+    parser.add_argument('tests_dir', nargs='?',
+                        default=os.path.join(os.getcwd(), 'tests'))
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='The number of processes. Defaults to one per '
+                        'CPU.')
+    parsed = parser.parse_args()
+
+    test_cases = find_tests(parsed.tests_dir)
+    if parsed.jobs == 1:
+        results = [_run_test_case(test_case) for test_case in test_cases]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=parsed.jobs) as executor:
+            results = list(executor.map(_run_test_case, test_cases))
+    num_failed = 0
+    for (infile, outfile), differences in zip(test_cases, results):
+        if differences:
+            num_failed += 1
+            print('Test failed: {}'.format(infile))
+            for difference in differences:
+                print('  {}'.format(difference))
+        else:
+            print('Test passed: {}'.format(infile))
+    print('{} passed, {} failed'.format(len(test_cases) - num_failed,
+                                        num_failed))
+    if num_failed:
+        sys.exit(1)
 
 if __name__ == "__main__":
   main()
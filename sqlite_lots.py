@@ -0,0 +1,319 @@
+import copy
+import datetime
+import json
+import sqlite3
+import weakref
+
+import lots as lots_lib
+
+
+# The columns of the lots table, in the order of the Lot constructor, after
+# the lot number.
+_COLUMNS = ['lot_number'] + lots_lib.Lot.FIELD_NAMES
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS lots (
+    lot_number INTEGER PRIMARY KEY,
+    num_shares INTEGER,
+    symbol TEXT,
+    description TEXT,
+    buy_date TEXT,
+    adjusted_buy_date TEXT,
+    basis INTEGER,
+    adjusted_basis INTEGER,
+    sell_date TEXT,
+    proceeds INTEGER,
+    adjustment_code TEXT,
+    adjustment INTEGER,
+    form_position TEXT,
+    buy_lot TEXT,
+    replacement_for TEXT,
+    is_replacement INTEGER,
+    loss_processed INTEGER
+);
+CREATE INDEX IF NOT EXISTS lots_by_buy_date ON lots (
+    adjusted_buy_date, sell_date IS NULL, sell_date, form_position,
+    lot_number);
+CREATE INDEX IF NOT EXISTS lots_by_original_buy_date ON lots (
+    buy_date, sell_date IS NULL, sell_date, form_position, lot_number);
+CREATE INDEX IF NOT EXISTS lots_by_sell_date ON lots (
+    sell_date IS NULL, sell_date, buy_date, form_position, lot_number);
+CREATE INDEX IF NOT EXISTS unprocessed_losses ON lots (
+    sell_date, buy_date, form_position, lot_number)
+    WHERE sell_date IS NOT NULL AND proceeds < adjusted_basis AND
+        NOT loss_processed;
+"""
+
+# The condition that the unprocessed_losses index covers. It matches
+# Lot.is_loss and not Lot.loss_processed.
+_UNPROCESSED_LOSS = ('sell_date IS NOT NULL AND proceeds < adjusted_basis AND '
+                     'NOT loss_processed')
+
+
+#%% class SqliteLots
+class SqliteLots(object):
+    """A set of lots stored in an SQLite database, for out-of-core washes.
+
+    This has the parts of the Lots interface that the wash engine uses, but
+    the lots live in a table with an index for each sort order, so only the
+    lots that a wash touches need to be in memory. wash.earliest_loss_lot and
+    wash.best_replacement_lot become indexed queries, and wash.wash_all_lots
+    finds each loss with a query instead of queueing every loss in memory.
+
+    Lots that are loaded are kept in a weak identity map, so a lot that is
+    still referenced is always returned as the same Lot object, and changes
+    to it are seen by the next query that returns it. Changed and added lots
+    are written back by update and add. The writes are buffered and applied
+    in one transaction per batch, before any query that could see them.
+
+    Lots are identified by their lot numbers, so lots added to a store must
+    not be copies of lots already in it.
+    """
+
+    # The ORDER BY clause for each order in Lots.ORDERS.
+    ORDERS = {
+        'buy_date': ('adjusted_buy_date, sell_date IS NULL, sell_date, '
+                     'form_position, lot_number'),
+        'original_buy_date': ('buy_date, sell_date IS NULL, sell_date, '
+                              'form_position, lot_number'),
+        'sell_date': ('sell_date IS NULL, sell_date, buy_date, form_position, '
+                      'lot_number'),
+    }
+
+    def __init__(self, lots=(), path=':memory:', first_buy_lot=None,
+                 batch_size=10000):
+        """Opens a store, and adds lots to it.
+
+        Populates the buy_lot field in each added lot if it is not set, the
+        same way as the Lots constructor.
+
+        Args:
+            lots: An iterable of Lot objects, such as a list or
+                lots_lib.Lots.iter_csv_data.
+            path: The path of the database file. If it already has lots, they
+                are kept. The default keeps the database in memory.
+            first_buy_lot: An integer, the number to populate the first unset
+                buy_lot field with, or None to continue after the buy lots
+                already in the database, as wash.next_buy_lot does.
+            batch_size: An integer, the number of changed lots to buffer
+                before they are written.
+        """
+        self._connection = sqlite3.connect(path)
+        # A wash writes a small batch before nearly every query, so don't wait
+        # for each one to reach the disk. A crash can lose the last batches,
+        # but not corrupt the database.
+        self._connection.execute('PRAGMA journal_mode = WAL')
+        self._connection.execute('PRAGMA synchronous = NORMAL')
+        self._connection.executescript(_SCHEMA)
+        self._batch_size = batch_size
+        # Lot number to Lot, for the lots that are loaded.
+        self._loaded = weakref.WeakValueDictionary()
+        # Lot number to Lot, for the lots that have changes to write.
+        self._pending = {}
+        self._order = None
+        self._dates = {None: None}
+        # Lots created from now on, such as lots split off during a wash, must
+        # not reuse the lot numbers that are already in the database.
+        lots_lib._reserve_lot_numbers(self._query(
+            'SELECT {} FROM lots ORDER BY lot_number DESC LIMIT 1'))
+        i = first_buy_lot or self.next_buy_lot()
+        for lot in lots:
+            if not lot.buy_lot:
+                lot.buy_lot = '_{}'.format(i)
+                i += 1
+            self.add(lot)
+        self.flush()
+
+    def next_buy_lot(self):
+        """Returns the number after the largest _N buy lot in the store."""
+        self.flush()
+        number, = self._connection.execute(
+            "SELECT MAX(CAST(SUBSTR(buy_lot, 2) AS INTEGER)) FROM lots "
+            "WHERE buy_lot GLOB '_[0-9]*' AND "
+            "SUBSTR(buy_lot, 2) NOT GLOB '*[^0-9]*'").fetchone()
+        return number + 1 if number is not None else 1
+
+    def _lot_from_row(self, row):
+        """Returns the Lot for a row, loading it if it isn't loaded."""
+        lot = self._loaded.get(row[0])
+        if lot is not None:
+            return lot
+        dates = self._dates
+        for i in (4, 5, 8):
+            if row[i] not in dates:
+                dates[row[i]] = datetime.date.fromisoformat(row[i])
+        lot = lots_lib.Lot(row[1], row[2], row[3], dates[row[4]],
+                           dates[row[5]], row[6], row[7], dates[row[8]],
+                           row[9], row[10], row[11], row[12], row[13],
+                           json.loads(row[14]), bool(row[15]), bool(row[16]))
+        lot._lot_number = row[0]
+        self._loaded[row[0]] = lot
+        return lot
+
+    @staticmethod
+    def _row_from_lot(lot):
+        def convert_from_date(value):
+            if value:
+                return value.isoformat()
+            return None
+
+        return (lot._lot_number, lot.num_shares, lot.symbol, lot.description,
+                convert_from_date(lot.buy_date),
+                convert_from_date(lot.adjusted_buy_date), lot.basis,
+                lot.adjusted_basis, convert_from_date(lot.sell_date),
+                lot.proceeds, lot.adjustment_code, lot.adjustment,
+                lot.form_position, lot.buy_lot,
+                json.dumps(lot.replacement_for), int(lot.is_replacement),
+                int(lot.loss_processed))
+
+    def _query(self, sql, parameters=()):
+        """Writes pending changes, then returns the Lots selected by sql.
+
+        Args:
+            sql: A query that selects the _COLUMNS of rows of lots, with a {}
+                where the column names go.
+            parameters: The parameters for the query.
+        Returns:
+            A list of Lot objects.
+        """
+        self.flush()
+        return [self._lot_from_row(row) for row in self._connection.execute(
+            sql.format(', '.join(_COLUMNS)), parameters)]
+
+    def add(self, lot):
+        """Adds a lot to the store.
+
+        Args:
+            lot: The Lot to add.
+        """
+        self._loaded[lot._lot_number] = lot
+        self.update(lot)
+
+    def update(self, lot):
+        """Writes the fields of a lot in the store back to it.
+
+        The write is buffered until the next query, flush, or until
+        batch_size lots are waiting.
+
+        Args:
+            lot: The Lot that was changed.
+        """
+        self._pending[lot._lot_number] = lot
+        if len(self._pending) >= self._batch_size:
+            self.flush()
+
+    def flush(self):
+        """Writes all of the buffered changes in one transaction."""
+        if not self._pending:
+            return
+        with self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO lots ({}) VALUES ({})'.format(
+                    ', '.join(_COLUMNS), ', '.join('?' * len(_COLUMNS))),
+                [SqliteLots._row_from_lot(lot)
+                 for lot in self._pending.values()])
+        self._pending = {}
+
+    def close(self):
+        """Writes any buffered changes and closes the database."""
+        self.flush()
+        self._connection.close()
+
+    def size(self):
+        """Returns the number of lots."""
+        self.flush()
+        count, = self._connection.execute('SELECT COUNT(*) FROM lots').fetchone()
+        return count
+
+    def ordered(self, order):
+        """Returns the lots sorted in the given order.
+
+        Args:
+            order: A key of ORDERS, e.g. 'sell_date'.
+        Returns:
+            A list of Lot objects.
+        """
+        return self._query('SELECT {{}} FROM lots ORDER BY {}'.format(
+            SqliteLots.ORDERS[order]))
+
+    def sort_by(self, order):
+        """Sets the order that lots and __iter__ return the lots in.
+
+        Args:
+            order: A key of ORDERS, e.g. 'sell_date'.
+        """
+        self._order = order
+
+    def lots(self):
+        """Returns a list of all of the Lot objects.
+
+        They are in the order given to sort_by, or in the order that they
+        were added. This loads every lot.
+        """
+        if self._order:
+            return self.ordered(self._order)
+        return self._query('SELECT {} FROM lots ORDER BY lot_number')
+
+    def __iter__(self):
+        return iter(self.lots())
+
+    def __deepcopy__(self, memo):
+        """Returns a lots_lib.Lots object with copies of the lots.
+
+        The database connection can't be copied, so the copy is in memory.
+        This loads every lot.
+        """
+        return lots_lib.Lots(copy.deepcopy(self.lots(), memo))
+
+    def bought_between(self, start, end):
+        """Yields the lots with an original buy date in [start, end].
+
+        The lots are yielded in cmp_by_original_buy_date order. This is a range
+        query on the original buy date index, and rows are only loaded as they
+        are yielded, so stopping early is cheap.
+
+        Args:
+            start: A datetime.date, the earliest buy date to include.
+            end: A datetime.date, the latest buy date to include.
+        """
+        self.flush()
+        cursor = self._connection.execute(
+            'SELECT {} FROM lots WHERE buy_date BETWEEN ? AND ? '
+            'ORDER BY {}'.format(', '.join(_COLUMNS),
+                                 SqliteLots.ORDERS['original_buy_date']),
+            (start.isoformat(), end.isoformat()))
+        for row in cursor:
+            yield self._lot_from_row(row)
+
+    def earliest_loss_lot(self):
+        """Returns the first loss sale that has not been processed, or None.
+
+        This is a query on the unprocessed_losses index, so it doesn't scan
+        the losses that were already processed.
+        """
+        lots = self._query(
+            'SELECT {{}} FROM lots WHERE {} ORDER BY sell_date, buy_date, '
+            'form_position, lot_number LIMIT 1'.format(_UNPROCESSED_LOSS))
+        return lots[0] if lots else None
+
+    def write_csv_data(self, output_file):
+        """Writes the lots as CSV data to an output file.
+
+        The lots are read and written in batches, in the order given to
+        sort_by, so they don't all need to be loaded at once.
+
+        Args:
+            output_file: A file-like object to write to.
+        """
+        self.flush()
+        order = SqliteLots.ORDERS[self._order] if self._order else 'lot_number'
+        cursor = self._connection.execute(
+            'SELECT {} FROM lots ORDER BY {}'.format(', '.join(_COLUMNS),
+                                                     order))
+        with lots_lib.LotWriter(output_file) as writer:
+            for row in cursor:
+                writer.write(self._lot_from_row(row))
+
+    def do_print(self, *args, **kwargs):
+        """Prints the lots, like Lots.do_print. This loads every lot."""
+        lots_lib.Lots(self.lots()).do_print(*args, **kwargs)
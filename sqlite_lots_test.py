@@ -0,0 +1,138 @@
+import copy
+import datetime
+import io
+import os
+import tempfile
+import unittest
+
+import lots as lots_lib
+import sqlite_lots as sqlite_lots_lib
+import stats as stats_lib
+import wash
+import wash_test
+
+create_lot = wash_test.create_lot
+
+
+class SqliteWashTestCase(wash_test.WashTestCase):
+    """Runs the wash scenarios from wash_test against lots stored in SQLite."""
+
+    make_lots = sqlite_lots_lib.SqliteLots
+
+
+class TestEarliestLossLot(SqliteWashTestCase, wash_test.TestEarliestLossLot):
+    pass
+
+
+class TestBestReplacementLot(SqliteWashTestCase,
+                             wash_test.TestBestReplacementLot):
+    pass
+
+
+class TestWashOneLot(SqliteWashTestCase, wash_test.TestWashOneLot):
+    pass
+
+
+class TestWashAllLots(SqliteWashTestCase, wash_test.TestWashAllLots):
+
+    def test_stats(self):
+        lots = self.make_lots([
+            create_lot(10, 2011, 6, 1, 120, 2012, 1, 10, 110),
+            create_lot(18, 2012, 1, 1, 100, 2012, 6, 1, 200),
+            create_lot(10, 2012, 1, 5, 130),
+            create_lot(10, 2013, 1, 5, 130, 2013, 2, 1, 120),
+        ])
+        stats = stats_lib.Stats()
+        wash.wash_all_lots(lots, stats=stats)
+        summary = stats.summary()
+        # The lots are never sorted in memory.
+        self.assertEqual({
+            'candidates_examined': 2,
+            'losses_processed': 2,
+            'losses_washed': 1,
+            'losses_not_washed': 1,
+            'splits': 1,
+        }, summary['counts'])
+        self.assertEqual({'find_replacement', 'split'},
+                         set(summary['seconds']))
+
+
+class TestSqliteLots(unittest.TestCase):
+
+    def create_lots(self):
+        return [
+            create_lot(10, 2011, 6, 1, 120, 2012, 1, 10, 110),
+            create_lot(18, 2012, 1, 1, 100, 2012, 6, 1, 200),
+            create_lot(10, 2012, 1, 5, 130),
+            create_lot(10, 2013, 1, 5, 130, 2013, 2, 1, 120),
+        ]
+
+    def test_same_result_as_lots(self):
+        lots = lots_lib.Lots(self.create_lots())
+        stored = sqlite_lots_lib.SqliteLots(copy.deepcopy(lots.lots()))
+        wash.wash_all_lots(lots)
+        wash.wash_all_lots(stored)
+        expected = io.StringIO()
+        lots.write_csv_data(expected)
+        actual = io.StringIO()
+        stored.write_csv_data(actual)
+        self.assertEqual(expected.getvalue(), actual.getvalue())
+
+    def test_washed_lots_are_saved(self):
+        expected = lots_lib.Lots(self.create_lots())
+        wash.wash_all_lots(expected)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'lots.db')
+            stored = sqlite_lots_lib.SqliteLots(self.create_lots(), path)
+            wash.wash_all_lots(stored)
+            stored.close()
+            reopened = sqlite_lots_lib.SqliteLots(path=path)
+            reopened.sort_by('sell_date')
+            actual = reopened.lots()
+            reopened.close()
+        self.assertTrue(expected.contents_equal(lots_lib.Lots(actual)))
+        # Lots split off after reopening are numbered after the stored lots.
+        self.assertGreater(create_lot(10, 2012, 1, 5, 130)._lot_number,
+                           max(lot._lot_number for lot in actual))
+
+    def test_lots_added_to_a_reopened_store(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'lots.db')
+            stored = sqlite_lots_lib.SqliteLots(self.create_lots()[:2], path)
+            stored.close()
+            reopened = sqlite_lots_lib.SqliteLots(self.create_lots()[2:], path)
+            self.assertEqual(5, reopened.next_buy_lot())
+            buy_lots = [lot.buy_lot for lot in reopened.lots()]
+            reopened.close()
+        # The stored lots are kept, and the new buy lots don't reuse theirs.
+        self.assertEqual(['_1', '_2', '_3', '_4'], buy_lots)
+
+    def test_loaded_lots_are_shared(self):
+        lots = sqlite_lots_lib.SqliteLots(self.create_lots())
+        loss = lots.earliest_loss_lot()
+        self.assertIs(loss, lots.ordered('sell_date')[0])
+        loss.loss_processed = True
+        lots.update(loss)
+        self.assertIsNot(loss, lots.earliest_loss_lot())
+
+    def test_changes_are_written_in_batches(self):
+        lots = sqlite_lots_lib.SqliteLots(batch_size=2)
+        first, second, third = self.create_lots()[:3]
+        lots.add(first)
+        lots.add(second)
+        self.assertEqual({}, lots._pending)
+        lots.add(third)
+        self.assertEqual([third], list(lots._pending.values()))
+        self.assertEqual(3, lots.size())
+        self.assertEqual({}, lots._pending)
+
+    def test_bought_between(self):
+        lots = sqlite_lots_lib.SqliteLots(self.create_lots())
+        bought = lots.bought_between(datetime.date(2012, 1, 1),
+                                     datetime.date(2012, 1, 5))
+        self.assertEqual([datetime.date(2012, 1, 1), datetime.date(2012, 1, 5)],
+                         [lot.buy_date for lot in bought])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import contextlib
+import time
+
+
+class Stats(object):
+    """Counts the work done by a wash run, and times each phase of it.
+
+    A Stats object is passed through the wash functions in the same way as a
+    logger. Counts are kept by name, e.g. 'losses_processed', and phases are
+    timed by wrapping them in a with statement:
+
+        with stats.phase('read'):
+            ...
+
+    Nested phases are each timed in full, so the time of a phase includes the
+    time of the phases within it.
+    """
+
+    # False if nothing is recorded. Callers can check this before doing work
+    # that is only needed to record stats.
+    enabled = True
+
+    def __init__(self):
+        self._counts = {}
+        self._seconds = {}
+
+    def count(self, name, n=1):
+        """Adds n to the count called name."""
+        self._counts[name] = self._counts.get(name, 0) + n
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Returns a context manager that adds its run time to a phase.
+
+        Args:
+            name: A string, the name of the phase.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._seconds[name] = (self._seconds.get(name, 0.0) +
+                                   time.perf_counter() - start)
+
+    def summary(self):
+        """Returns the stats as a dict that can be saved as JSON.
+
+        Returns:
+            A dict with a 'counts' dict mapping count names to integers, and a
+            'seconds' dict mapping phase names to the seconds spent in them.
+        """
+        return {'counts': dict(self._counts), 'seconds': dict(self._seconds)}
+
+    def __str__(self):
+        lines = ['{:<22} {}'.format(name, value)
+                 for name, value in sorted(self._counts.items())]
+        lines.extend('{:<22} {:.3f}s'.format(name, value)
+                     for name, value in sorted(self._seconds.items()))
+        return '\n'.join(lines)
+
+
+class NullStats(Stats):
+    """Stats that records nothing, for runs without --stats."""
+
+    enabled = False
+
+    def count(self, name, n=1):
+        pass
+
+    def phase(self, name):
+        return _NULL_PHASE
+
+
+# Reused by every NullStats.phase call, so that a disabled phase costs one
+# method call.
+_NULL_PHASE = contextlib.nullcontext()
@@ -0,0 +1,31 @@
+import unittest
+
+import stats as stats_lib
+
+
+class TestStats(unittest.TestCase):
+
+    def test_counts_and_phases(self):
+        stats = stats_lib.Stats()
+        stats.count('splits')
+        stats.count('splits', 2)
+        with stats.phase('read'):
+            pass
+        with stats.phase('read'):
+            pass
+        summary = stats.summary()
+        self.assertEqual({'splits': 3}, summary['counts'])
+        self.assertEqual(['read'], list(summary['seconds']))
+        self.assertGreaterEqual(summary['seconds']['read'], 0)
+
+    def test_null_stats_records_nothing(self):
+        stats = stats_lib.NullStats()
+        self.assertFalse(stats.enabled)
+        stats.count('splits')
+        with stats.phase('read'):
+            pass
+        self.assertEqual({'counts': {}, 'seconds': {}}, stats.summary())
+
+
+if __name__ == '__main__':
+    unittest.main()
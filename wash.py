@@ -1,9 +1,28 @@
 import argparse
-import copy
+import concurrent.futures
 import datetime
+import heapq
+import itertools
+import json
+import os
+import pickle
+import groups as groups_lib
 import lots as lots_lib
 import logger as logger_lib
-from functools import cmp_to_key
+import sqlite_lots as sqlite_lots_lib
+import stats as stats_lib
+
+# A replacement lot must be bought within this many days of a loss sale, on
+# either side.
+WASH_WINDOW = datetime.timedelta(days=30)
+
+#%% class UnsortedLotsError
+class UnsortedLotsError(Exception):
+    """Raised if lots that should be in buy date order are not."""
+
+#%% class IncrementalWashError
+class IncrementalWashError(Exception):
+    """Raised if new lots can't be washed starting from a checkpoint."""
 
 def _split_lot(num_shares, lot, lots, logger, type_of_lot,
                existing_loss_lot=None, existing_replacement_lot=None):
@@ -24,7 +43,7 @@ def _split_lot(num_shares, lot, lots, logger, type_of_lot,
     existing_lot_portion = float(num_shares) / float(lot.num_shares)
     new_lot_portion = float(lot.num_shares - num_shares) / float(lot.num_shares)
 
-    new_lot = copy.deepcopy(lot)
+    new_lot = lot.clone()
     new_lot.num_shares -= num_shares
     new_lot.basis = int(round(new_lot.basis * new_lot_portion))
     new_lot.adjusted_basis = int(round(new_lot.adjusted_basis *
@@ -38,7 +57,10 @@ def _split_lot(num_shares, lot, lots, logger, type_of_lot,
     lot.adjusted_basis = int(round(lot.adjusted_basis * existing_lot_portion))
     lot.proceeds = int(round(lot.proceeds * existing_lot_portion))
     lot.adjustment = int(round(lot.adjustment * existing_lot_portion))
+    lots.update(lot)
 
+    if not logger.enabled:
+        return
     loss_lots = [lot] if type_of_lot == 'loss' else [existing_loss_lot]
     split_off_loss_lots = [new_lot] if type_of_lot == 'loss' else []
     replacement_lots = (
@@ -53,7 +75,8 @@ def _split_lot(num_shares, lot, lots, logger, type_of_lot,
                       replacement_lots=replacement_lots,
                       split_off_replacement_lots=split_off_replacement_lots)
 
-def best_replacement_lot(loss_lot, lots):
+def best_replacement_lot(loss_lot, lots, groups=None,
+                         stats=stats_lib.NullStats()):
     """Finds the best replacement lot for a loss lot.
 
     The search starts from the earliest buy, and continues forward in time. A
@@ -74,20 +97,30 @@ def best_replacement_lot(loss_lot, lots):
     ruling on this issue, so it's up in the air whether this would present a
     problem. But IANACPA/IANAL.
 
+    Only lots whose symbol is substantially identical to the loss lot's symbol
+    are considered. Without groups, all lots are substantially identical.
+
     Args:
         loss_lot: A Lot object, which is a loss that should be washed.
         lots: A Lots object, the full set of lots.
+        groups: A groups_lib.IdentityGroups object, or None.
+        stats: A stats_lib.Stats, which counts the candidates examined.
     Returns:
         A Lot object, the best replacement lot, or None if there is none. May
         have more or fewer shares than the loss_lot.
     """
-    # Replacement lots must be chosen oldest first.
-    lots.sort(key=cmp_to_key(lots_lib.Lot.cmp_by_original_buy_date))
-    possible_replacement_lots = []
-    for lot in lots:
-        if abs(loss_lot.sell_date - lot.buy_date) > datetime.timedelta(days=30):
-            # A replacement lot must be within 61 days (30 before, day of, and
-            # 30 after) of the sale.
+    # Replacement lots must be chosen oldest first, which is the order that
+    # bought_between yields them in. A replacement lot must be within 61 days
+    # (30 before, day of, and 30 after) of the sale.
+    window = WASH_WINDOW
+    if groups:
+        loss_group_id = groups.group_id(loss_lot.symbol)
+    examined = 0
+    for examined, lot in enumerate(
+            lots.bought_between(loss_lot.sell_date - window,
+                                loss_lot.sell_date + window), 1):
+        if groups and groups.group_id(lot.symbol) != loss_group_id:
+            # Only substantially identical securities are replacements.
             continue
         if loss_lot is lot or (loss_lot.buy_lot != '' and
                                loss_lot.buy_lot == lot.buy_lot):
@@ -114,22 +147,23 @@ def best_replacement_lot(loss_lot, lots):
             # that would cause the basis to increase, leading to a loop where
             # it would make another lot be adjusted more.
             continue
-        possible_replacement_lots.append(lot)
-
-    if not possible_replacement_lots:
-        return None
-    return possible_replacement_lots[0]
+        stats.count('candidates_examined', examined)
+        return lot
+    stats.count('candidates_examined', examined)
+    return None
 
 def earliest_loss_lot(lots):
     """Finds the first loss sale that has not already been processed.
 
     Args:
-        lots: A Lots object, the full set of lots to search through.
+        lots: A Lots or sqlite_lots_lib.SqliteLots object, the full set of lots
+            to search through.
     Returns:
         A Lot, or None.
     """
-    lots.sort(key=cmp_to_key(lots_lib.Lot.cmp_by_sell_date))
-    for lot in lots:
+    if isinstance(lots, sqlite_lots_lib.SqliteLots):
+        return lots.earliest_loss_lot()
+    for lot in lots.ordered('sell_date'):
         if not lot.is_loss():
             continue
         if lot.loss_processed:
@@ -137,7 +171,8 @@ def earliest_loss_lot(lots):
         return lot
     return None
 
-def wash_one_lot(loss_lot, lots, logger=logger_lib.NullLogger()):
+def wash_one_lot(loss_lot, lots, logger=logger_lib.NullLogger(), groups=None,
+                 stats=stats_lib.NullStats()):
     """Performs a single wash.
 
     Given a single loss lot, finds replacement lot(s) and adjusts their basis
@@ -161,26 +196,42 @@ def wash_one_lot(loss_lot, lots, logger=logger_lib.NullLogger()):
         loss_lot: A Lot object, which is a loss that should be washed.
         lots: A Lots object, the full set of lots.
         logger: A logger_lib.Logger.
+        groups: A groups_lib.IdentityGroups object, or None to treat all lots
+            as substantially identical.
+        stats: A stats_lib.Stats.
+    Returns:
+        The replacement Lot that the loss was washed against, or None if there
+        was no replacement lot.
     """
-    replacement_lot = best_replacement_lot(loss_lot, lots)
+    with stats.phase('find_replacement'):
+        replacement_lot = best_replacement_lot(loss_lot, lots, groups, stats)
     if not replacement_lot:
-        logger.print_lots('No replacement lot', lots, loss_lots=[loss_lot])
+        if logger.enabled:
+            logger.print_lots('No replacement lot', lots,
+                              loss_lots=[loss_lot])
         loss_lot.loss_processed = True
-        return
+        lots.update(loss_lot)
+        stats.count('losses_not_washed')
+        return None
 
-    logger.print_lots('Found replacement lot',
-                      lots,
-                      loss_lots=[loss_lot],
-                      replacement_lots=[replacement_lot])
+    if logger.enabled:
+        logger.print_lots('Found replacement lot',
+                          lots,
+                          loss_lots=[loss_lot],
+                          replacement_lots=[replacement_lot])
 
     # There is a replacement lot. If it is not for the same number of shares as
     # the loss lot, split the larger one.
     if loss_lot.num_shares > replacement_lot.num_shares:
-        _split_lot(replacement_lot.num_shares, loss_lot, lots, logger, 'loss',
-                   existing_replacement_lot=replacement_lot)
+        stats.count('splits')
+        with stats.phase('split'):
+            _split_lot(replacement_lot.num_shares, loss_lot, lots, logger,
+                       'loss', existing_replacement_lot=replacement_lot)
     elif replacement_lot.num_shares > loss_lot.num_shares:
-        _split_lot(loss_lot.num_shares, replacement_lot, lots, logger,
-                   'replacement', existing_loss_lot=loss_lot)
+        stats.count('splits')
+        with stats.phase('split'):
+            _split_lot(loss_lot.num_shares, replacement_lot, lots, logger,
+                       'replacement', existing_loss_lot=loss_lot)
 
     # Now the loss_lot and replacement_lot have the same number of shares.
     loss_lot.loss_processed = True
@@ -192,48 +243,517 @@ def wash_one_lot(loss_lot, lots, logger=logger_lib.NullLogger()):
     replacement_lot.adjusted_basis += loss_lot.adjustment
     replacement_lot.adjusted_buy_date -= (
         loss_lot.sell_date - loss_lot.adjusted_buy_date)
+    lots.update(loss_lot)
+    lots.update(replacement_lot)
+    stats.count('losses_washed')
 
-    logger.print_lots('Adjusted basis and buy date',
-                      lots,
-                      loss_lots=[loss_lot],
-                      replacement_lots=[replacement_lot])
+    if logger.enabled:
+        logger.print_lots('Adjusted basis and buy date',
+                          lots,
+                          loss_lots=[loss_lot],
+                          replacement_lots=[replacement_lot])
+    return replacement_lot
+
+def _push_loss(loss_queue, lot, counter):
+    """Queues lot for washing if it is a loss that has not been processed.
+
+    Entries are ordered the same way as Lot.cmp_by_sell_date.
+
+    Args:
+        loss_queue: A list used as a heap by wash_all_lots.
+        lot: A Lot object.
+        counter: An itertools.count, used to keep entries for the same lot from
+            being compared.
+    """
+    if lot.is_loss() and not lot.loss_processed:
+        heapq.heappush(loss_queue,
+                       (lots_lib.Lot.sell_date_key(lot), next(counter), lot))
 
-def wash_all_lots(lots, logger=logger_lib.NullLogger()):
+def wash_all_lots(lots, logger=logger_lib.NullLogger(), groups=None,
+                  checkpoint_date=None, stats=stats_lib.NullStats()):
     """Performs wash sales of all the lots.
 
+    Unprocessed losses are kept in a heap so that the next loss to wash can be
+    found without re-sorting all of the lots. Lots that are split off during a
+    wash, and replacement lots whose adjusted basis turns them into a loss,
+    are pushed onto the heap as they appear. Entries for lots that stopped
+    being unprocessed losses after they were pushed are skipped when popped.
+
+    Losses are washed in sell date order, so the lots can be copied part way
+    through as a checkpoint, see wash_incremental.
+
+    For a sqlite_lots_lib.SqliteLots object, each loss is found with an
+    indexed query instead, so the losses are never all held in memory.
+
+    Args:
+        lots: A Lots or sqlite_lots_lib.SqliteLots object.
+        logger: A logger_lib.Logger.
+        groups: A groups_lib.IdentityGroups object, or None to treat all lots
+            as substantially identical.
+        checkpoint_date: A datetime.date, or None. Not supported for a
+            sqlite_lots_lib.SqliteLots object.
+        stats: A stats_lib.Stats.
+    Returns:
+        If checkpoint_date is set, a Lots object with a copy of the lots as
+        they were before any loss sold on or after checkpoint_date was washed.
+        Otherwise None.
+    """
+    if isinstance(lots, sqlite_lots_lib.SqliteLots):
+        if checkpoint_date is not None:
+            raise ValueError('Checkpoints are not supported for SqliteLots')
+        loss_lot = lots.earliest_loss_lot()
+        while loss_lot:
+            if logger.enabled:
+                logger.print_lots('Found loss', lots, loss_lots=[loss_lot])
+            stats.count('losses_processed')
+            wash_one_lot(loss_lot, lots, logger, groups, stats)
+            loss_lot = lots.earliest_loss_lot()
+        # The output order is only applied as the lots are read out.
+        lots.sort_by('sell_date')
+        lots.flush()
+        return None
+
+    num_sorts = lots.num_sorts()
+    counter = itertools.count()
+    loss_queue = []
+    for lot in lots:
+        _push_loss(loss_queue, lot, counter)
+
+    checkpoint = None
+    while loss_queue:
+        if (checkpoint_date is not None and checkpoint is None and
+                loss_queue[0][-1].sell_date >= checkpoint_date):
+            with stats.phase('checkpoint'):
+                checkpoint = lots.clone()
+        loss_lot = heapq.heappop(loss_queue)[-1]
+        if not loss_lot.is_loss() or loss_lot.loss_processed:
+            continue
+        if logger.enabled:
+            logger.print_lots('Found loss', lots, loss_lots=[loss_lot])
+        stats.count('losses_processed')
+        num_lots = lots.size()
+        replacement_lot = wash_one_lot(loss_lot, lots, logger, groups, stats)
+        # Lots that were split off are appended to the end of lots.
+        for lot in lots.lots()[num_lots:]:
+            _push_loss(loss_queue, lot, counter)
+        if replacement_lot:
+            _push_loss(loss_queue, replacement_lot, counter)
+
+    if checkpoint_date is not None and checkpoint is None:
+        with stats.phase('checkpoint'):
+            checkpoint = lots.clone()
+
+    # Leave the lots ordered by sell date, as the output has always been.
+    with stats.phase('sort'):
+        lots.sort_by('sell_date')
+    stats.count('sorts', lots.num_sorts() - num_sorts)
+    return checkpoint
+
+def last_trade_date(lots):
+    """Returns the latest buy or sell date of any lot, or None if no lots."""
+    dates = [lot.buy_date for lot in lots]
+    dates.extend(lot.sell_date for lot in lots if lot.sell_date)
+    return max(dates) if dates else None
+
+def checkpoint_date(lots):
+    """Returns the date to take a checkpoint of lots at.
+
+    No lot bought on or after the last trade date can be a replacement for a
+    loss sold more than WASH_WINDOW before then, so a checkpoint from that
+    date can be used to wash lots bought on or after the last trade date.
+
+    Args:
+        lots: A Lots object, with all of the lots that will be washed.
+    Returns:
+        A datetime.date.
+    """
+    last_date = last_trade_date(lots)
+    if last_date is None:
+        return datetime.date.min
+    return last_date - WASH_WINDOW
+
+def next_buy_lot(lots):
+    """Returns the number that Lots gives to the next lot without a buy lot.
+
+    Lots numbers the buy lots that it fills in as _1, _2, ... in input order,
+    so lots added to the end of the input continue from the largest of those.
+
     Args:
         lots: A Lots object.
+    """
+    numbers = [int(lot.buy_lot[1:]) for lot in lots
+               if lot.buy_lot[:1] == '_' and lot.buy_lot[1:].isdigit()]
+    return max(numbers) + 1 if numbers else 1
+
+def wash_incremental(checkpoint, new_lots, logger=logger_lib.NullLogger(),
+                     groups=None, stats=stats_lib.NullStats()):
+    """Washes lots that were added after a checkpoint was taken.
+
+    Washing all of the lots each time that trades are added repeats the work
+    of washing every earlier loss. Losses are washed in sell date order, and a
+    replacement must be bought within WASH_WINDOW of the loss sale, so a lot
+    bought on or after the last trade date of the earlier lots can't change
+    how any loss sold before checkpoint_date(earlier lots) was washed. The
+    checkpoint holds the lots as they were just before that date, so only the
+    losses after it are washed again.
+
+    The result is the same as washing the earlier and new lots together with
+    wash_all_lots, as long as the same groups are used.
+
+    Args:
+        checkpoint: A Lots object, returned by wash_all_lots with
+            checkpoint_date(lots), or by this function. The lots in it are
+            washed in place.
+        new_lots: A Lots object with the lots to add, all bought on or after
+            the last trade date in checkpoint. It should be created with
+            first_buy_lot=next_buy_lot(checkpoint), so that lots without a
+            buy lot are numbered after the earlier ones.
+        logger: A logger_lib.Logger.
+        groups: A groups_lib.IdentityGroups object, or None.
+        stats: A stats_lib.Stats.
+    Returns:
+        A (lots, checkpoint) tuple. lots is a Lots object with all of the
+        washed lots, and checkpoint can be used to wash lots added later.
+    """
+    last_date = last_trade_date(checkpoint)
+    for lot in new_lots:
+        if last_date is not None and lot.buy_date < last_date:
+            raise IncrementalWashError(
+                'Lot bought on {} is before the last trade in the checkpoint, '
+                'on {}. Wash all of the lots instead.'.format(lot.buy_date,
+                                                              last_date))
+    lots = lots_lib.Lots(checkpoint.lots() + new_lots.lots())
+    new_checkpoint = wash_all_lots(lots, logger, groups, checkpoint_date(lots),
+                                   stats)
+    return lots, new_checkpoint
+
+def _push_final(final_queue, lot, counter):
+    """Queues lot to be written by wash_stream once it can't change.
+
+    The entry's date is the one that the next loss must be sold after for lot
+    to be final. A lot sold before the next loss can't replace it, and
+    neither can a lot bought more than WASH_WINDOW before it. An unprocessed
+    loss can't be final before it is washed, which happens on its sell date.
+
+    Args:
+        final_queue: A list used as a heap by wash_stream.
+        lot: A Lot object.
+        counter: An itertools.count, used to keep entries from being compared
+            by lot.
+    """
+    date = lot.buy_date + WASH_WINDOW
+    if lot.sell_date and (lot.sell_date < date or
+                          (lot.is_loss() and not lot.loss_processed)):
+        date = lot.sell_date
+    heapq.heappush(final_queue, (date, next(counter), lot))
+
+def wash_stream(lot_iter, write_lot, logger=logger_lib.NullLogger(),
+                groups=None, stats=stats_lib.NullStats()):
+    """Performs wash sales of lots read in buy date order, in bounded memory.
+
+    This makes the same washes as wash_all_lots, but only holds the lots that
+    could still change. A loss is washed once every lot bought within
+    WASH_WINDOW after its sale has been read, and a lot is written as soon as
+    no later loss can use it as a replacement and it is not a loss waiting to
+    be washed. So memory depends on the number of lots that are open, or
+    bought or sold within WASH_WINDOW of each other, rather than on the
+    length of the history.
+
+    The lots are written in the order that they become final, not sorted by
+    sell date.
+
+    Args:
+        lot_iter: An iterable of Lot objects in buy date order, such as
+            lots_lib.Lots.iter_csv_data. Lots bought on the same day must be in
+            the order that wash_all_lots should see them in.
+        write_lot: A function that is called with each Lot once it is final.
         logger: A logger_lib.Logger.
+        groups: A groups_lib.IdentityGroups object, or None to treat all lots
+            as substantially identical.
+        stats: A stats_lib.Stats.
+    Raises:
+        UnsortedLotsError: If a lot was bought before the lot read before it.
+    """
+    lot_iter = iter(lot_iter)
+    lots = lots_lib.Lots([])
+    counter = itertools.count()
+    loss_queue = []
+    final_queue = []
+    next_lot = next(lot_iter, None)
+    while next_lot is not None or loss_queue:
+        if next_lot is not None and (
+                not loss_queue or next_lot.buy_date <=
+                loss_queue[0][-1].sell_date + WASH_WINDOW):
+            # The lot could be a replacement for the next loss, or be sold
+            # before it, so read it first.
+            lot = next_lot
+            lots.add(lot)
+            _push_loss(loss_queue, lot, counter)
+            _push_final(final_queue, lot, counter)
+            next_lot = next(lot_iter, None)
+            if next_lot is not None and next_lot.buy_date < lot.buy_date:
+                raise UnsortedLotsError('A lot bought on {} comes after a lot '
+                                        'bought later, on {}'.format(
+                                            next_lot.buy_date, lot.buy_date))
+        else:
+            loss_lot = heapq.heappop(loss_queue)[-1]
+            if loss_lot.is_loss() and not loss_lot.loss_processed:
+                if logger.enabled:
+                    logger.print_lots('Found loss', lots,
+                                      loss_lots=[loss_lot])
+                stats.count('losses_processed')
+                num_lots = lots.size()
+                replacement_lot = wash_one_lot(loss_lot, lots, logger, groups,
+                                               stats)
+                for lot in lots.lots()[num_lots:]:
+                    _push_loss(loss_queue, lot, counter)
+                    _push_final(final_queue, lot, counter)
+                if replacement_lot:
+                    _push_loss(loss_queue, replacement_lot, counter)
+
+        # Every loss that is washed from now on is sold on or after this.
+        dates = [loss_queue[0][-1].sell_date] if loss_queue else []
+        if next_lot is not None:
+            dates.append(next_lot.buy_date)
+        next_date = min(dates) if dates else datetime.date.max
+        while final_queue and final_queue[0][0] < next_date:
+            lot = heapq.heappop(final_queue)[-1]
+            if lot.is_loss() and not lot.loss_processed:
+                # A replacement that became a loss.
+                _push_final(final_queue, lot, counter)
+                continue
+            lots.remove(lot)
+            with stats.phase('write'):
+                write_lot(lot)
+
+def _wash_partition(lots):
+    """Washes one partition of lots in a worker process and returns it."""
+    wash_all_lots(lots)
+    return lots
+
+def _symbol(lot):
+    return lot.symbol
+
+def _sell_order(lot):
+    # The sell date order without the lot number, which is only meaningful
+    # within the process that numbered the lot.
+    return lots_lib.Lot.sell_date_key(lot)[:-1]
+
+def wash_partitions(lots, key=_symbol, max_workers=None):
+    """Washes groups of lots independently, in a pool of worker processes.
+
+    Lots are only washed against lots in the same partition, so this treats
+    each symbol (by default) as a separate security. Pass
+    groups.lot_group_id as the key to partition by identity group instead.
+    Each partition is washed by wash_all_lots in a worker process, and the
+    results are merged into one Lots object in sell date order. Lots that tie
+    are ordered by the partition whose key appears first in lots.
+
+    Args:
+        lots: A Lots object. It is not modified.
+        key: A function that takes a Lot and returns a hashable partition key.
+        max_workers: An integer, the number of worker processes, or None to
+            use one per CPU. With one worker, or a single partition, the lots
+            are washed in this process.
+    Returns:
+        A new Lots object with the washed lots.
+    """
+    partitions = lots.partition(key)
+    if max_workers == 1 or len(partitions) <= 1:
+        # Wash copies, as the worker processes do, so that the result doesn't
+        # depend on the number of workers.
+        washed = [_wash_partition(partition.clone())
+                  for partition in partitions]
+    else:
+        max_workers = max_workers or os.cpu_count() or 1
+        # Send partitions in chunks, since there may be thousands of small
+        # ones.
+        chunksize = max(1, len(partitions) // (4 * max_workers))
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=max_workers) as executor:
+            washed = list(executor.map(_wash_partition, partitions,
+                                       chunksize=chunksize))
+    return lots_lib.Lots(list(heapq.merge(
+        *[partition.lots() for partition in washed], key=_sell_order)))
+
+def wash_lot_table(table):
+    """Performs wash sales of all the lots in a LotTable.
+
+    This makes the same choices as wash_all_lots, but each loss and its
+    replacement are found with one vectorized mask over the table's columns.
+
+    Args:
+        table: A lot_table_lib.LotTable.
     """
     while True:
-        loss_lot = earliest_loss_lot(lots)
-        if not loss_lot:
+        loss = table.earliest_loss()
+        if loss is None:
             break
-        logger.print_lots('Found loss', lots, loss_lots=[loss_lot])
-        wash_one_lot(loss_lot, lots, logger)
+        replacement = table.best_replacement(loss)
+        if replacement is None:
+            table.column('loss_processed')[loss] = True
+            continue
+        num_shares = table.column('num_shares')
+        loss_shares = int(num_shares[loss])
+        replacement_shares = int(num_shares[replacement])
+        if loss_shares > replacement_shares:
+            table.split(loss, replacement_shares)
+        elif replacement_shares > loss_shares:
+            table.split(replacement, loss_shares)
+        table.wash(loss, replacement)
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('-o', '--out_file')
     parser.add_argument('-w', '--do_wash', metavar='in_file')
     parser.add_argument('-q', '--quiet', action="store_true")
+    parser.add_argument('--window', type=int, metavar='num_lots',
+                        help='At each step, only print the highlighted lots '
+                        'and num_lots lots on either side of each, in buy '
+                        'date order. Steps with no highlighted lots print '
+                        'all of the lots.')
+    parser.add_argument('--columnar', action="store_true",
+                        help='Wash using the NumPy LotTable representation.')
+    parser.add_argument('--by_symbol', action="store_true",
+                        help='Only wash lots against lots of the same symbol, '
+                        'washing each symbol in a separate process.')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='The number of processes for --by_symbol. '
+                        'Defaults to one per CPU.')
+    parser.add_argument('-c', '--checkpoint', metavar='checkpoint_file',
+                        help='A checkpoint saved by --save_checkpoint. The '
+                        'lots in in_file are added to it, and must all be '
+                        'bought on or after its last trade date. Checkpoints '
+                        'are pickle files, and loading one can run any code, '
+                        'so only load checkpoints that you saved yourself.')
+    parser.add_argument('--save_checkpoint', metavar='checkpoint_file',
+                        help='Where to save a checkpoint that lots bought '
+                        'on or after the last trade date can be added to.')
+    parser.add_argument('--stream', action="store_true",
+                        help='Read in_file in buy date order and write each '
+                        'lot to out_file once it is final, holding only the '
+                        'lots that could still change in memory.')
+    parser.add_argument('--stats', nargs='?', const='', metavar='stats_file',
+                        help='Count and time the work done by the wash, and '
+                        'print the counts, or save them as JSON to '
+                        'stats_file.')
+    parser.add_argument('--sqlite', metavar='db_file',
+                        help='Keep the lots in an SQLite database at db_file '
+                        'instead of in memory, for histories too large to '
+                        'wash in memory. db_file must not already have lots, '
+                        'and the washed lots are left in it.')
+    parser.add_argument('-g', '--groups', metavar='groups_file',
+                        help='A csv file with Symbol,Group rows. Only lots '
+                        'of symbols in the same group wash against each '
+                        'other, and symbols in no group are separate.')
     parsed = parser.parse_args()
+    if ((parsed.checkpoint or parsed.save_checkpoint) and
+            (parsed.columnar or parsed.by_symbol)):
+        parser.error('--checkpoint and --save_checkpoint do not support '
+                     '--columnar or --by_symbol')
+    if parsed.stream and (parsed.columnar or parsed.by_symbol or
+                          parsed.checkpoint or parsed.save_checkpoint):
+        parser.error('--stream does not support --columnar, --by_symbol or '
+                     'checkpoints')
+    if parsed.stream and parsed.do_wash and not parsed.out_file:
+        parser.error('--stream requires --out_file')
+    if parsed.sqlite and (parsed.columnar or parsed.by_symbol or
+                          parsed.stream or parsed.checkpoint or
+                          parsed.save_checkpoint):
+        parser.error('--sqlite does not support --columnar, --by_symbol, '
+                     '--stream or checkpoints')
+    if parsed.sqlite and parsed.do_wash and os.path.exists(parsed.sqlite):
+        # Washing trades on top of lots that were already washed is not the
+        # same as washing them together, and a second run on the same file
+        # would store every lot twice.
+        existing = sqlite_lots_lib.SqliteLots(path=parsed.sqlite)
+        num_existing = existing.size()
+        existing.close()
+        if num_existing:
+            parser.error('{} already has {} lots. Use a new db_file.'.format(
+                parsed.sqlite, num_existing))
+    if parsed.groups and parsed.columnar and not parsed.by_symbol:
+        parser.error('--columnar does not support --groups without '
+                     '--by_symbol')
 
     if parsed.quiet:
         logger = logger_lib.NullLogger()
     else:
-        logger = logger_lib.TermLogger()
-    if parsed.do_wash:
+        logger = logger_lib.TermLogger(parsed.window)
+    if parsed.stats is not None:
+        stats = stats_lib.Stats()
+    else:
+        stats = stats_lib.NullStats()
+    groups = None
+    if parsed.groups:
+        with open(parsed.groups) as f:
+            groups = groups_lib.IdentityGroups.create_from_csv_data(f)
+    if parsed.do_wash and parsed.stream:
+        try:
+            with open(parsed.do_wash) as in_file, \
+                    open(parsed.out_file, 'w') as out_file, \
+                    lots_lib.LotWriter(out_file) as writer, \
+                    stats.phase('wash'):
+                wash_stream(lots_lib.Lots.iter_csv_data(in_file), writer.write,
+                            logger, groups, stats)
+        except UnsortedLotsError as e:
+            parser.error('--stream needs input sorted by buy date. '
+                         '{}'.format(e))
+    elif parsed.do_wash:
         lots = lots_lib.Lots([])
-        with open(parsed.do_wash) as f:
-            lots = lots_lib.Lots.create_from_csv_data(f)
+        checkpoint = None
+        first_buy_lot = 1
+        with stats.phase('read'):
+            if parsed.checkpoint:
+                with open(parsed.checkpoint, 'rb') as f:
+                    checkpoint = pickle.load(f)
+                first_buy_lot = next_buy_lot(checkpoint)
+            with open(parsed.do_wash) as f:
+                if parsed.sqlite:
+                    lots = sqlite_lots_lib.SqliteLots(
+                        lots_lib.Lots.iter_csv_data(f), parsed.sqlite)
+                else:
+                    lots = lots_lib.Lots.create_from_csv_data(
+                        f, first_buy_lot=first_buy_lot)
         logger.print_lots('Start lots', lots)
-        wash_all_lots(lots, logger)
-        if parsed.out_file:
-            with open(parsed.out_file, 'w') as f:
-                lots.write_csv_data(f)
-        else:
+        with stats.phase('wash'):
+            if parsed.checkpoint:
+                try:
+                    lots, checkpoint = wash_incremental(checkpoint, lots,
+                                                        logger, groups, stats)
+                except IncrementalWashError as e:
+                    parser.error(str(e))
+            elif parsed.save_checkpoint:
+                checkpoint = wash_all_lots(lots, logger, groups,
+                                           checkpoint_date(lots), stats)
+            elif parsed.by_symbol:
+                key = groups.lot_group_id if groups else _symbol
+                lots = wash_partitions(lots, key=key, max_workers=parsed.jobs)
+            elif parsed.columnar:
+                # lot_table imports numpy, so it is only loaded when used.
+                import lot_table as lot_table_lib
+                table = lot_table_lib.LotTable.from_lots(lots)
+                wash_lot_table(table)
+                lots = table.to_lots()
+                lots.sort_by('sell_date')
+            else:
+                wash_all_lots(lots, logger, groups, stats=stats)
+        with stats.phase('write'):
+            if parsed.save_checkpoint:
+                with open(parsed.save_checkpoint, 'wb') as f:
+                    pickle.dump(checkpoint, f, pickle.HIGHEST_PROTOCOL)
+            if parsed.out_file:
+                with open(parsed.out_file, 'w') as f:
+                    lots.write_csv_data(f)
+        if not parsed.out_file:
             logger.print_lots('Final lots', lots)
+        if parsed.sqlite:
+            lots.close()
+    if parsed.stats:
+        with open(parsed.stats, 'w') as f:
+            json.dump(stats.summary(), f, indent=2, sort_keys=True)
+    elif parsed.stats is not None:
+        print(stats)
 
 
 if __name__ == "__main__":
@@ -1,10 +1,17 @@
 import copy
 import datetime
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
 import unittest
 
+import groups as groups_lib
+import logger as logger_lib
 import lots as lots_lib
+import stats as stats_lib
 import wash
-from functools import cmp_to_key
 
 def create_lot(num_shares,
                buy_year,
@@ -25,7 +32,34 @@ def create_lot(num_shares,
                         False, False)
 
 
-class TestEarliestLossLot(unittest.TestCase):
+def run_wash_py(*args):
+    """Runs `python wash.py` with args, and returns the CompletedProcess."""
+    return subprocess.run(
+        [sys.executable, 'wash.py'] + list(args),
+        cwd=os.path.dirname(os.path.abspath(wash.__file__)),
+        capture_output=True, text=True)
+
+
+def in_memory(lots):
+    """Returns a Lots object with the same Lot objects as a lots store."""
+    return lots_lib.Lots(list(lots.lots()))
+
+
+class WashTestCase(unittest.TestCase):
+    """Tests that wash the lots store made by make_lots.
+
+    sqlite_lots_test runs the same tests with a sqlite_lots.SqliteLots store.
+    """
+
+    make_lots = lots_lib.Lots
+
+    def assertSameLots(self, a, b):
+        a = in_memory(a)
+        b = in_memory(b)
+        self.assertEqual(a, b, msg='Lots are not equal: \n{}\n{}'.format(a, b))
+
+
+class TestEarliestLossLot(WashTestCase):
     # In these tests, we compare the object ids, since we want to ensure that
     # the actual object, and not a copy, is returned.
 
@@ -41,19 +75,19 @@ class TestEarliestLossLot(unittest.TestCase):
             id(a), id(b), lots_lib.Lots([a, b])))
 
     def test_two_losses(self):
-        lots = lots_lib.Lots([self.loss1, self.loss2, self.loss3])
+        lots = self.make_lots([self.loss1, self.loss2, self.loss3])
         self.assertSameLot(self.loss1, wash.earliest_loss_lot(lots))
 
     def test_unsold(self):
-        lots = lots_lib.Lots([self.loss1, self.unsold, self.loss2])
+        lots = self.make_lots([self.loss1, self.unsold, self.loss2])
         self.assertSameLot(self.loss1, wash.earliest_loss_lot(lots))
 
     def test_gain(self):
-        lots = lots_lib.Lots([self.loss1, self.gain, self.loss2])
+        lots = self.make_lots([self.loss1, self.gain, self.loss2])
         self.assertSameLot(self.loss1, wash.earliest_loss_lot(lots))
 
 
-class TestBestReplacementLot(unittest.TestCase):
+class TestBestReplacementLot(WashTestCase):
     # In these tests, we compare the object ids, since we want to ensure that
     # the actual object, and not a copy, is returned.
 
@@ -82,50 +116,47 @@ class TestBestReplacementLot(unittest.TestCase):
         self.assertIs(a, b, msg='{} is not {}: \n{}'.format(
             id(a), id(b), lots_lib.Lots([a, b])))
 
-    def assertSameLots(self, a, b):
-        self.assertEqual(a, b, msg='Lots are not equal: \n{}\n{}'.format(a, b))
-
     def assertLotIsNone(self, a):
         self.assertIsNone(a, msg='{} is not None: \n{}'.format(
             id(a), lots_lib.Lots([a]) if a else None))
 
     def test_only_loss_lot_exists(self):
-        lots = lots_lib.Lots([self.loss])
+        lots = self.make_lots([self.loss])
         self.assertLotIsNone(wash.best_replacement_lot(self.loss, lots))
 
     def test_no_replacement_too_early(self):
-        lots = lots_lib.Lots([self.very_early_gain, self.loss])
+        lots = self.make_lots([self.very_early_gain, self.loss])
         self.assertLotIsNone(wash.best_replacement_lot(self.loss, lots))
 
     def test_no_replacement_too_late(self):
-        lots = lots_lib.Lots([self.second_gain, self.loss])
+        lots = self.make_lots([self.second_gain, self.loss])
         self.assertLotIsNone(wash.best_replacement_lot(self.loss, lots))
 
     def test_no_replacement_31_days_before(self):
-        lots = lots_lib.Lots([self.days_early_31])
+        lots = self.make_lots([self.days_early_31])
         self.assertLotIsNone(wash.best_replacement_lot(self.loss, lots))
 
     def test_no_replacement_31_days_after(self):
-        lots = lots_lib.Lots([self.days_after_31])
+        lots = self.make_lots([self.days_after_31])
         self.assertLotIsNone(wash.best_replacement_lot(self.loss, lots))
 
     def test_replacement_30_days_before(self):
-        lots = lots_lib.Lots([self.days_early_30])
+        lots = self.make_lots([self.days_early_30])
         self.assertSameLot(self.days_early_30,
                             wash.best_replacement_lot(self.loss, lots))
 
     def test_replacement_30_days_after(self):
-        lots = lots_lib.Lots([self.days_after_30])
+        lots = self.make_lots([self.days_after_30])
         self.assertSameLot(self.days_after_30,
                             wash.best_replacement_lot(self.loss, lots))
 
     def test_replacement_is_unsold(self):
-        lots = lots_lib.Lots([self.unsold, self.loss])
+        lots = self.make_lots([self.unsold, self.loss])
         self.assertSameLot(self.unsold,
                             wash.best_replacement_lot(self.loss, lots))
 
     def test_replacement_is_first_bought(self):
-        lots = lots_lib.Lots([self.first_gain, self.first_gain_earlier_sale,
+        lots = self.make_lots([self.first_gain, self.first_gain_earlier_sale,
                               self.first_gain_later_sale])
         self.assertSameLot(self.first_gain_earlier_sale,
                             wash.best_replacement_lot(self.loss, lots))
@@ -133,35 +164,33 @@ class TestBestReplacementLot(unittest.TestCase):
     def test_replacement_checks_sell_date(self):
         # If there are multiple possible replacements that were bought on the
         # same day, the one with the earlier sell date is chosen.
-        lots = lots_lib.Lots([self.unsold, self.first_gain, self.loss])
+        lots = self.make_lots([self.unsold, self.first_gain, self.loss])
         self.assertSameLot(self.first_gain,
                             wash.best_replacement_lot(self.loss, lots))
 
     def test_replacement_for_small_loss(self):
-        lots = lots_lib.Lots([self.unsold, self.first_gain, self.small_loss])
+        lots = self.make_lots([self.unsold, self.first_gain, self.small_loss])
         wash_lot = wash.best_replacement_lot(self.small_loss, lots)
         self.assertSameLot(self.first_gain, wash_lot)
 
     def test_replacement_for_loss_multiple_options(self):
-        lots = lots_lib.Lots([self.loss, self.small_first_gain,
+        lots = self.make_lots([self.loss, self.small_first_gain,
                               self.large_first_gain])
         wash_lot = wash.best_replacement_lot(self.loss, lots)
         self.assertSameLot(self.small_first_gain, wash_lot)
 
     def test_replacement_for_large_loss(self):
-        lots = lots_lib.Lots([self.unsold, self.first_gain, self.large_loss])
+        lots = self.make_lots([self.unsold, self.first_gain, self.large_loss])
         final_lots = copy.deepcopy(lots)
         wash_lot = wash.best_replacement_lot(self.large_loss, lots)
         self.assertSameLot(self.first_gain, wash_lot)
         self.assertEqual(10, wash_lot.num_shares)
         self.assertEqual(3, lots.size())
 
-        lots.sort(key=cmp_to_key(lots_lib.Lot.cmp_by_original_buy_date))
-        final_lots.sort(key=cmp_to_key(lots_lib.Lot.cmp_by_original_buy_date))
         self.assertSameLots(lots, final_lots)
 
     def test_loss_not_in_lots(self):
-        lots = lots_lib.Lots([self.unsold, self.first_gain])
+        lots = self.make_lots([self.unsold, self.first_gain])
         self.assertSameLot(self.first_gain,
                             wash.best_replacement_lot(self.loss, lots))
 
@@ -170,7 +199,7 @@ class TestBestReplacementLot(unittest.TestCase):
         # separately.
         lot1 = create_lot(10, 2012, 1, 1, 120, 2012, 1, 10, 110)
         lot2 = create_lot(10, 2012, 1, 1, 120, 2012, 1, 10, 110)
-        lots = lots_lib.Lots([lot1, lot2])
+        lots = self.make_lots([lot1, lot2])
         self.assertSameLot(lot2, wash.best_replacement_lot(lot1, lots))
 
     def test_two_lots_from_same_buy_lot(self):
@@ -180,22 +209,40 @@ class TestBestReplacementLot(unittest.TestCase):
         lot1.buy_lot = '1'
         lot2 = create_lot(10, 2012, 1, 1, 120, 2012, 1, 10, 110)
         lot2.buy_lot = '1'
-        lots = lots_lib.Lots([lot1, lot2])
+        lots = self.make_lots([lot1, lot2])
         self.assertLotIsNone(wash.best_replacement_lot(lot1, lots))
 
     def test_already_used_replacement_is_not_used_again(self):
         lot1 = create_lot(10, 2012, 1, 1, 120, 2012, 1, 10, 110)
         lot2 = create_lot(10, 2012, 1, 1, 120, 2012, 1, 10, 110)
         lot2.is_replacement = True
-        lots = lots_lib.Lots([lot1, lot2])
+        lots = self.make_lots([lot1, lot2])
         self.assertLotIsNone(wash.best_replacement_lot(lot1, lots))
 
     def test_lot_sold_before_loss_is_not_replacement(self):
-        lots = lots_lib.Lots([self.loss, self.gain_just_before_loss])
+        lots = self.make_lots([self.loss, self.gain_just_before_loss])
         self.assertLotIsNone(wash.best_replacement_lot(self.loss, lots))
 
+    def test_replacement_is_in_the_same_group(self):
+        groups = groups_lib.IdentityGroups({'ABC': 'alphabet', 'ABD':
+                                            'alphabet'})
+        self.first_gain.symbol = 'XYZ'
+        self.unsold.symbol = 'ABD'
+        lots = self.make_lots([self.loss, self.first_gain, self.unsold])
+        self.assertSameLot(self.first_gain,
+                           wash.best_replacement_lot(self.loss, lots))
+        self.assertSameLot(self.unsold,
+                           wash.best_replacement_lot(self.loss, lots, groups))
+
+    def test_symbols_in_no_group_are_separate(self):
+        groups = groups_lib.IdentityGroups({})
+        self.first_gain.symbol = 'XYZ'
+        lots = self.make_lots([self.loss, self.first_gain])
+        self.assertLotIsNone(
+            wash.best_replacement_lot(self.loss, lots, groups))
 
-class TestWashOneLot(unittest.TestCase):
+
+class TestWashOneLot(WashTestCase):
 
     def setUp(self):
         self.loss = create_lot(10, 2011, 6, 1, 120, 2012, 1, 10, 110)
@@ -210,11 +257,8 @@ class TestWashOneLot(unittest.TestCase):
         self.very_late_gain = create_lot(10, 2013, 1, 1, 150, 2013, 8, 1, 250)
         self.unsold = create_lot(10, 2012, 1, 5, 130)
 
-    def assertSameLots(self, a, b):
-        self.assertEqual(a, b, msg='Lots are not equal: \n{}\n{}'.format(a, b))
-
     def test_no_wash_if_no_replacement_shares(self):
-        lots = lots_lib.Lots([self.loss, self.very_early_gain,
+        lots = self.make_lots([self.loss, self.very_early_gain,
                               self.very_late_gain])
 
         final_lots = copy.deepcopy(lots)
@@ -225,7 +269,7 @@ class TestWashOneLot(unittest.TestCase):
         self.assertSameLots(lots, final_lots)
 
     def test_wash_against_single_purchase(self):
-        lots = lots_lib.Lots([self.loss, self.first_gain])
+        lots = self.make_lots([self.loss, self.first_gain])
 
         final_lots = copy.deepcopy(lots)
         disallowed_loss = final_lots.lots()[0]
@@ -243,7 +287,7 @@ class TestWashOneLot(unittest.TestCase):
         self.assertSameLots(lots, final_lots)
 
     def test_wash_against_first_purchase(self):
-        lots = lots_lib.Lots([self.loss, self.first_gain, self.second_gain])
+        lots = self.make_lots([self.loss, self.first_gain, self.second_gain])
 
         final_lots = copy.deepcopy(lots)
         disallowed_loss = final_lots.lots()[0]
@@ -261,7 +305,7 @@ class TestWashOneLot(unittest.TestCase):
         self.assertSameLots(lots, final_lots)
 
     def test_wash_against_unsold(self):
-        lots = lots_lib.Lots([self.loss, self.unsold])
+        lots = self.make_lots([self.loss, self.unsold])
 
         final_lots = copy.deepcopy(lots)
         disallowed_loss = final_lots.lots()[0]
@@ -279,7 +323,7 @@ class TestWashOneLot(unittest.TestCase):
         self.assertSameLots(lots, final_lots)
 
     def test_wash_against_subsequent_loss(self):
-        lots = lots_lib.Lots([self.loss, self.later_loss])
+        lots = self.make_lots([self.loss, self.later_loss])
 
         final_lots = copy.deepcopy(lots)
         disallowed_loss = final_lots.lots()[0]
@@ -297,7 +341,7 @@ class TestWashOneLot(unittest.TestCase):
         self.assertSameLots(lots, final_lots)
 
     def test_wash_against_small_replacement(self):
-        lots = lots_lib.Lots([self.loss, self.small_first_gain])
+        lots = self.make_lots([self.loss, self.small_first_gain])
 
         final_lots = copy.deepcopy(lots)
         disallowed_loss = final_lots.lots()[0]
@@ -327,7 +371,7 @@ class TestWashOneLot(unittest.TestCase):
         self.assertSameLots(lots, final_lots)
 
     def test_wash_against_large_replacement(self):
-        lots = lots_lib.Lots([self.loss, self.large_first_gain])
+        lots = self.make_lots([self.loss, self.large_first_gain])
 
         final_lots = copy.deepcopy(lots)
         disallowed_loss = final_lots.lots()[0]
@@ -360,9 +404,277 @@ class TestWashOneLot(unittest.TestCase):
         self.assertSameLots(lots, final_lots)
 
 
+class TestWashAllLots(WashTestCase):
+
+    def assertSameLot(self, a, b):
+        self.assertIs(a, b, msg='{} is not {}: \n{}'.format(
+            id(a), id(b), lots_lib.Lots([a, b])))
+
+    def test_replacement_that_becomes_a_loss_is_washed(self):
+        loss = create_lot(10, 2011, 6, 1, 120, 2012, 1, 10, 110)
+        # A gain until it absorbs the disallowed loss above.
+        replacement = create_lot(10, 2012, 1, 1, 100, 2012, 6, 1, 105)
+        second_replacement = create_lot(10, 2012, 6, 10, 130)
+        lots = self.make_lots([second_replacement, replacement, loss])
+
+        wash.wash_all_lots(lots)
+
+        self.assertTrue(replacement.loss_processed)
+        self.assertEqual('W', replacement.adjustment_code)
+        self.assertEqual(5, replacement.adjustment)
+        self.assertTrue(second_replacement.is_replacement)
+        self.assertEqual(135, second_replacement.adjusted_basis)
+        self.assertEqual([loss.buy_lot, replacement.buy_lot],
+                         second_replacement.replacement_for)
+
+    def test_lots_are_left_sorted_by_sell_date(self):
+        loss = create_lot(10, 2011, 6, 1, 120, 2012, 1, 10, 110)
+        gain = create_lot(18, 2012, 1, 1, 100, 2012, 6, 1, 200)
+        unsold = create_lot(10, 2012, 1, 5, 130)
+        lots = self.make_lots([unsold, gain, loss])
+
+        wash.wash_all_lots(lots)
+
+        self.assertEqual(4, lots.size())
+        self.assertSameLot(loss, lots.lots()[0])
+        self.assertSameLot(gain, lots.lots()[1])
+        self.assertSameLot(unsold, lots.lots()[3])
+
+    def test_disabled_logger_is_not_called(self):
+
+        class DisabledLogger(logger_lib.NullLogger):
+            def print_lots(self, *args, **kwargs):
+                raise AssertionError('print_lots called')
+
+        lots = self.make_lots([
+            create_lot(10, 2011, 6, 1, 120, 2012, 1, 10, 110),
+            create_lot(18, 2012, 1, 1, 100, 2012, 6, 1, 200),
+            create_lot(10, 2012, 1, 5, 130),
+        ])
+        wash.wash_all_lots(lots, DisabledLogger())
+        self.assertEqual(4, lots.size())
+
+    def test_stats(self):
+        lots = self.make_lots([
+            create_lot(10, 2011, 6, 1, 120, 2012, 1, 10, 110),
+            create_lot(18, 2012, 1, 1, 100, 2012, 6, 1, 200),
+            create_lot(10, 2012, 1, 5, 130),
+            create_lot(10, 2013, 1, 5, 130, 2013, 2, 1, 120),
+        ])
+        stats = stats_lib.Stats()
+        wash.wash_all_lots(lots, stats=stats)
+        summary = stats.summary()
+        self.assertEqual({
+            'candidates_examined': 2,
+            'losses_processed': 2,
+            'losses_washed': 1,
+            'losses_not_washed': 1,
+            'splits': 1,
+            'sorts': 2,
+        }, summary['counts'])
+        self.assertEqual({'find_replacement', 'split', 'sort'},
+                         set(summary['seconds']))
+
+
+class TestWashPartitions(unittest.TestCase):
+
+    def setUp(self):
+        self.loss = create_lot(10, 2011, 6, 1, 120, 2012, 1, 10, 110)
+        self.other_symbol_gain = create_lot(10, 2012, 1, 1, 100, 2012, 6, 1,
+                                            200)
+        self.other_symbol_gain.symbol = 'XYZ'
+        self.large_gain = create_lot(18, 2012, 1, 5, 100, 2012, 6, 1, 200)
+        self.other_symbol_loss = create_lot(10, 2011, 6, 1, 120, 2012, 1, 12,
+                                            110)
+        self.other_symbol_loss.symbol = 'XYZ'
+
+    def make_lots(self):
+        return lots_lib.Lots([self.loss, self.other_symbol_gain,
+                              self.large_gain, self.other_symbol_loss])
+
+    def test_lots_only_wash_against_the_same_symbol(self):
+        # Without partitioning, the loss would wash against the earlier
+        # purchase of the other symbol.
+        lots = wash.wash_partitions(self.make_lots(), max_workers=1)
+        self.assertEqual(5, lots.size())
+        self.assertEqual(
+            {self.large_gain.buy_lot: (10, [self.loss.buy_lot]),
+             self.other_symbol_gain.buy_lot: (
+                 10, [self.other_symbol_loss.buy_lot])},
+            {lot.buy_lot: (lot.num_shares, lot.replacement_for)
+             for lot in lots if lot.is_replacement})
+        # The lots that were passed in are washed as copies.
+        self.assertEqual(18, self.large_gain.num_shares)
+        self.assertEqual(['ABC', 'XYZ', 'XYZ', 'ABC', 'ABC'],
+                         [lot.symbol for lot in lots])
+
+    def test_partition_by_group(self):
+        groups = groups_lib.IdentityGroups({'ABC': 'alphabet', 'XYZ':
+                                            'alphabet'})
+        lots = wash.wash_partitions(self.make_lots(),
+                                    key=groups.lot_group_id, max_workers=1)
+        expected = self.make_lots()
+        wash.wash_all_lots(expected)
+        self.assertTrue(expected.contents_equal(lots))
+
+    def test_worker_processes_match_washing_in_process(self):
+        lots = self.make_lots()
+        in_process = wash.wash_partitions(lots, max_workers=1)
+        in_workers = wash.wash_partitions(lots, max_workers=2)
+        self.assertTrue(in_process.contents_equal(in_workers))
+        self.assertEqual(in_process.size(), in_workers.size())
+
+
+class TestWashIncremental(unittest.TestCase):
+
+    def make_earlier_lots(self):
+        return lots_lib.Lots([
+            create_lot(10, 2011, 6, 1, 120, 2012, 1, 10, 110),
+            create_lot(6, 2012, 1, 1, 100, 2012, 3, 1, 200),
+            create_lot(10, 2011, 6, 1, 150, 2012, 3, 5, 100),
+        ])
+
+    def make_new_lots(self, first_buy_lot):
+        # The first lot can replace the loss sold on 2012-3-5.
+        return lots_lib.Lots([
+            create_lot(18, 2012, 3, 20, 90),
+            create_lot(5, 2012, 4, 1, 100, 2012, 4, 2, 90),
+        ], first_buy_lot)
+
+    def test_checkpoint_is_before_losses_on_checkpoint_date(self):
+        lots = self.make_earlier_lots()
+        self.assertEqual(datetime.date(2012, 3, 5), wash.last_trade_date(lots))
+        self.assertEqual(datetime.date(2012, 2, 4), wash.checkpoint_date(lots))
+        checkpoint = wash.wash_all_lots(lots, checkpoint_date=datetime.date(
+            2012, 3, 5))
+        self.assertEqual(4, checkpoint.size())
+        # The lots are in the order that they were created.
+        self.assertEqual([True, False, False, True],
+                         [lot.loss_processed for lot in checkpoint])
+        self.assertTrue(lots.lots()[-1].loss_processed)
+
+    def test_matches_washing_all_lots(self):
+        lots = self.make_earlier_lots()
+        checkpoint = wash.wash_all_lots(lots, checkpoint_date=
+                                        wash.checkpoint_date(lots))
+        # Checkpoints are saved to disk by wash.py.
+        checkpoint = pickle.loads(pickle.dumps(checkpoint))
+        new_lots = self.make_new_lots(wash.next_buy_lot(checkpoint))
+        lots, checkpoint = wash.wash_incremental(checkpoint, new_lots)
+
+        all_lots = lots_lib.Lots(self.make_earlier_lots().lots() +
+                                 self.make_new_lots(4).lots())
+        wash.wash_all_lots(all_lots)
+        self.assertTrue(all_lots.contents_equal(lots))
+        self.assertEqual(all_lots.size(), lots.size())
+        self.assertEqual([['_3'], ['_5'], []],
+                         [lot.replacement_for for lot in lots
+                          if lot.buy_lot == '_4'])
+
+        # A checkpoint from wash_incremental can be used the same way.
+        newer_lots = lots_lib.Lots([create_lot(10, 2012, 4, 2, 100)],
+                                   wash.next_buy_lot(checkpoint))
+        self.assertEqual('_6', newer_lots.lots()[0].buy_lot)
+        lots, checkpoint = wash.wash_incremental(checkpoint, newer_lots)
+        all_lots = lots_lib.Lots(
+            self.make_earlier_lots().lots() + self.make_new_lots(4).lots() +
+            lots_lib.Lots([create_lot(10, 2012, 4, 2, 100)], 6).lots())
+        wash.wash_all_lots(all_lots)
+        self.assertTrue(all_lots.contents_equal(lots))
+        self.assertEqual(all_lots.size(), lots.size())
+
+    def test_lots_bought_before_the_last_trade_date(self):
+        lots = self.make_earlier_lots()
+        checkpoint = wash.wash_all_lots(lots, checkpoint_date=
+                                        wash.checkpoint_date(lots))
+        new_lots = lots_lib.Lots([create_lot(10, 2012, 3, 4, 90)])
+        with self.assertRaises(wash.IncrementalWashError):
+            wash.wash_incremental(checkpoint, new_lots)
+
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint_path = os.path.join(directory, 'checkpoint.pickle')
+            with open(checkpoint_path, 'wb') as f:
+                pickle.dump(checkpoint, f)
+            in_path = os.path.join(directory, 'new.csv')
+            with open(in_path, 'w') as f:
+                new_lots.write_csv_data(f)
+            result = run_wash_py('-q', '-c', checkpoint_path, '-w', in_path)
+        self.assertEqual(2, result.returncode)
+        self.assertIn('error: Lot bought on 2012-03-04 is before the last '
+                      'trade', result.stderr)
+
+
+class TestWashStream(unittest.TestCase):
+
+    def make_lots(self):
+        # In buy date order. The first two lots are washed long before the
+        # last two are bought.
+        return [
+            create_lot(10, 2011, 6, 1, 120, 2012, 1, 10, 110),
+            create_lot(18, 2012, 1, 5, 100, 2012, 6, 1, 200),
+            create_lot(10, 2013, 6, 1, 120, 2014, 1, 10, 110),
+            create_lot(5, 2014, 1, 20, 130),
+        ]
+
+    def test_matches_wash_all_lots(self):
+        written = []
+        wash.wash_stream(lots_lib.Lots(self.make_lots()).lots(),
+                         written.append)
+        lots = lots_lib.Lots(self.make_lots())
+        wash.wash_all_lots(lots)
+        self.assertEqual(lots.size(), len(written))
+        self.assertEqual(lots, lots_lib.Lots(written))
+
+    def test_lots_are_written_before_later_lots_are_read(self):
+        events = []
+
+        def read_lots():
+            for lot in lots_lib.Lots(self.make_lots()):
+                events.append('read')
+                yield lot
+
+        wash.wash_stream(read_lots(), lambda lot: events.append('write'))
+        self.assertEqual(['read', 'read', 'read', 'write', 'write', 'write'],
+                         events[:6])
+        self.assertEqual(10, len(events))
+
+    def test_unsorted_lots(self):
+        lots = self.make_lots()
+        lots.reverse()
+        with self.assertRaisesRegex(wash.UnsortedLotsError,
+                                    'A lot bought on 2013-06-01 comes after '
+                                    'a lot bought later, on 2014-01-20'):
+            wash.wash_stream(lots, lambda lot: None)
+
+        with tempfile.TemporaryDirectory() as directory:
+            in_path = os.path.join(directory, 'unsorted.csv')
+            with open(in_path, 'w') as f:
+                lots_lib.Lots(lots).write_csv_data(f)
+            result = run_wash_py('-q', '--stream', '-w', in_path, '-o',
+                                 os.path.join(directory, 'out.csv'))
+        self.assertEqual(2, result.returncode)
+        self.assertIn('error: --stream needs input sorted by buy date',
+                      result.stderr)
+
+
+class TestStartup(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = os.path.dirname(os.path.abspath(wash.__file__))
+
+    def test_unneeded_libraries_are_not_imported(self):
+        result = subprocess.run(
+            [sys.executable, '-c',
+             'import sys, wash; print(sorted(name for name in ['
+             '"numpy", "dateutil", "terminaltables", "colorclass", '
+             '"lot_table"] if name in sys.modules))'],
+            cwd=self.directory, capture_output=True, text=True, check=True)
+        self.assertEqual('[]\n', result.stdout)
+        self.assertEqual('', result.stderr)
+
 
-# wash_all_lots is tested with run_integ_tests using the files in the tests/
-# directory.
+# wash_all_lots is also tested with run_integ_tests using the files in the
+# tests/ directory.
 
 
 if __name__ == '__main__':